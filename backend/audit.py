@@ -1,14 +1,209 @@
 """
 Sistema de Auditoría - Historial de Movimientos
 Registra todas las acciones de los usuarios en el sistema.
+
+Por defecto cada movimiento se confirma en el momento (o junto con el cambio
+dentro de unit_of_work). Con un AuditWriter configurado (set_audit_writer)
+los movimientos sueltos, como los logins, se encolan en memoria y un hilo
+los inserta en lotes con un solo INSERT de varias filas.
+
+Las ediciones guardan solo las columnas que cambiaron. Cada
+CHECKPOINT_EVERY ediciones de un registro se guarda el registro entero
+(datos_completos), así reconstruir_registro arma el estado en cualquier
+punto de la historia leyendo pocos movimientos.
 """
-from sqlalchemy.orm import Session
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session, load_only
 from models import HistorialMovimiento, AccionEnum
+from serializers import to_audit_dict
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import Optional, Any
+from typing import List, Optional, Any
 import json
+import os
+import queue
+import threading
+import time
 from decimal import Decimal
 
+UNIT_OF_WORK_KEY = "auditoria_en_transaccion"
+CHECKPOINT_EVERY = max(int(os.environ.get("AUDIT_CHECKPOINT_EVERY", 20)), 1)
+ESTADO_ACCIONES = (AccionEnum.crear, AccionEnum.editar, AccionEnum.eliminar)
+
+@contextmanager
+def unit_of_work(db: Session):
+    """
+    El cambio y su movimiento de auditoría en una sola transacción.
+    Dentro del bloque los audit_* solo agregan el movimiento a la sesión (si
+    falla, falla todo); al salir se hace un único commit, o rollback si hubo
+    error. Las instancias no se expiran en el commit, así la respuesta se
+    arma con lo que ya está cargado, sin refresh ni otra consulta.
+    """
+    db.info[UNIT_OF_WORK_KEY] = True
+    db.expire_on_commit = False
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.info.pop(UNIT_OF_WORK_KEY, None)
+        db.expire_on_commit = True
+
+class AuditWriter:
+    """
+    Hilo del proceso que escribe los movimientos encolados.
+    Un lote se escribe al juntar batch_size movimientos o al pasar interval
+    segundos desde el primero. Con la cola llena, quien registra espera hasta
+    enqueue_timeout segundos (contrapresión) y si sigue llena el movimiento se
+    descarta y se cuenta. Un lote que no se puede insertar se reintenta retries
+    veces y después se inserta fila por fila (ver _write). Al detenerse escribe
+    lo que quede en la cola.
+    """
+
+    def __init__(self, session_factory, batch_size: int = 500, interval: float = 1.0,
+                 max_queue: int = 10000, enqueue_timeout: float = 0.5,
+                 retries: int = 3, retry_backoff: float = 0.5):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.interval = interval
+        self.enqueue_timeout = enqueue_timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.encolados = 0
+        self.escritos = 0
+        self.descartados = 0
+        self.fallidos = 0
+        self.lotes = 0
+        self.ultimo_error = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        """Deja de aceptar movimientos y espera a que se escriba lo encolado"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def enqueue(self, row: dict) -> bool:
+        """Encola un movimiento; False si se descartó por cola llena"""
+        try:
+            self._queue.put(row, timeout=self.enqueue_timeout)
+        except queue.Full:
+            with self._lock:
+                self.descartados += 1
+                descartados = self.descartados
+            if descartados == 1 or descartados % 1000 == 0:
+                print(f"⚠️ Cola de auditoría llena: {descartados} movimientos descartados")
+            return False
+        with self._lock:
+            self.encolados += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "activo": self.running,
+            "pendientes": self._queue.qsize(),
+            "capacidad": self._queue.maxsize,
+            "encolados": self.encolados,
+            "escritos": self.escritos,
+            "descartados": self.descartados,
+            "fallidos": self.fallidos,
+            "lotes": self.lotes,
+            "ultimo_error": self.ultimo_error
+        }
+
+    def _next_batch(self) -> List[dict]:
+        try:
+            batch = [self._queue.get(timeout=self.interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0 and not self._stop.is_set():
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _insert(self, rows: List[dict]):
+        db = self.session_factory()
+        try:
+            db.execute(insert(HistorialMovimiento.__table__).values(rows))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _write(self, batch: List[dict]):
+        """
+        Inserta el lote; si falla lo reintenta con espera creciente (caídas o
+        bloqueos pasajeros de la base) y después fila por fila, así una fila
+        inválida no se lleva al resto. Solo se pierden las que fallan solas.
+        """
+        for intento in range(self.retries + 1):
+            try:
+                self._insert(batch)
+                self.escritos += len(batch)
+                self.lotes += 1
+                return
+            except Exception as e:
+                self.ultimo_error = str(e)[:500]
+                print(f"⚠️ Error escribiendo {len(batch)} movimientos de auditoría (intento {intento + 1}): {e}")
+            if intento < self.retries:
+                time.sleep(self.retry_backoff * 2 ** intento)
+        
+        escritos = 0
+        for row in batch:
+            try:
+                self._insert([row])
+                escritos += 1
+            except Exception as e:
+                self.fallidos += 1
+                self.ultimo_error = str(e)[:500]
+                accion = row["accion"].value if isinstance(row["accion"], AccionEnum) else row["accion"]
+                print(f"❌ Movimiento de auditoría descartado: {row['tabla']} {accion} "
+                      f"id_registro={row['id_registro']} usuario={row['username']} "
+                      f"fecha={row['fecha_hora']}: {e}")
+        self.escritos += escritos
+        self.lotes += 1
+        print(f"⚠️ Lote de auditoría escrito fila por fila: {escritos} de {len(batch)} movimientos")
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+            elif self._stop.is_set():
+                break
+
+_audit_writer: Optional[AuditWriter] = None
+
+def set_audit_writer(writer: Optional[AuditWriter]):
+    """Activa (o con None desactiva) la escritura en lotes de los movimientos sueltos"""
+    global _audit_writer
+    _audit_writer = writer
+
 def decimal_default(obj):
     """Convertir Decimal a float para JSON"""
     if isinstance(obj, Decimal):
@@ -19,18 +214,8 @@ def model_to_dict(obj) -> dict:
     """Convierte un modelo SQLAlchemy a diccionario, excluyendo relaciones"""
     if obj is None:
         return None
-    
-    result = {}
-    for column in obj.__table__.columns:
-        value = getattr(obj, column.name)
-        if isinstance(value, Decimal):
-            value = float(value)
-        elif isinstance(value, datetime):
-            value = value.isoformat()
-        elif hasattr(value, 'value'):  # Enum
-            value = value.value
-        result[column.name] = value
-    return result
+    # Serializador generado para la clase (ver serializers.py)
+    return to_audit_dict(obj)
 
 def registrar_movimiento(
     db: Session,
@@ -43,7 +228,8 @@ def registrar_movimiento(
     datos_anteriores: Optional[dict] = None,
     datos_nuevos: Optional[dict] = None,
     ip_address: Optional[str] = None,
-    user_agent: Optional[str] = None
+    user_agent: Optional[str] = None,
+    datos_completos: bool = True
 ):
     """
     Registra un movimiento en el historial de auditoría.
@@ -60,21 +246,32 @@ def registrar_movimiento(
         datos_nuevos: Estado del registro después del cambio
         ip_address: Dirección IP del cliente
         user_agent: User-Agent del navegador
+        datos_completos: False si los datos son solo las columnas que cambiaron
     """
+    datos = dict(
+        id_usuario=usuario_id,
+        username=username,
+        fecha_hora=datetime.now(timezone.utc),
+        tabla=tabla,
+        accion=accion,
+        id_registro=id_registro,
+        descripcion=descripcion,
+        datos_anteriores=datos_anteriores,
+        datos_nuevos=datos_nuevos,
+        ip_address=ip_address,
+        user_agent=user_agent,
+        datos_completos=datos_completos
+    )
+    movimiento = HistorialMovimiento(**datos)
+    if db.info.get(UNIT_OF_WORK_KEY):
+        # Se confirma junto con el cambio (ver unit_of_work), aun con escritura en lotes
+        db.add(movimiento)
+        return movimiento
+    writer = _audit_writer
+    if writer is not None and writer.running:
+        # El movimiento devuelto no queda en la sesión: lo inserta el hilo de auditoría
+        return movimiento if writer.enqueue(datos) else None
     try:
-        movimiento = HistorialMovimiento(
-            id_usuario=usuario_id,
-            username=username,
-            fecha_hora=datetime.now(timezone.utc),
-            tabla=tabla,
-            accion=accion,
-            id_registro=id_registro,
-            descripcion=descripcion,
-            datos_anteriores=datos_anteriores,
-            datos_nuevos=datos_nuevos,
-            ip_address=ip_address,
-            user_agent=user_agent
-        )
         db.add(movimiento)
         db.commit()
         return movimiento
@@ -109,6 +306,24 @@ def audit_create(
         user_agent=user_agent
     )
 
+def field_delta(anteriores: dict, nuevos: dict) -> tuple:
+    """Solo las columnas que cambiaron: (antes, después)"""
+    cambiadas = [key for key, value in nuevos.items() if key not in anteriores or anteriores[key] != value]
+    return {key: anteriores.get(key) for key in cambiadas}, {key: nuevos[key] for key in cambiadas}
+
+def needs_checkpoint(db: Session, tabla: str, id_registro: int) -> bool:
+    """True si en las últimas CHECKPOINT_EVERY - 1 ediciones del registro no hay una completa"""
+    if CHECKPOINT_EVERY == 1:
+        return True
+    recientes = db.query(HistorialMovimiento.datos_completos)\
+        .filter(HistorialMovimiento.tabla == tabla,
+                HistorialMovimiento.id_registro == id_registro,
+                HistorialMovimiento.accion.in_(ESTADO_ACCIONES))\
+        .order_by(HistorialMovimiento.id_movimiento.desc())\
+        .limit(CHECKPOINT_EVERY - 1)\
+        .all()
+    return not any(completo for (completo,) in recientes)
+
 def audit_update(
     db: Session,
     usuario,
@@ -120,9 +335,14 @@ def audit_update(
     ip_address: Optional[str] = None,
     user_agent: Optional[str] = None
 ):
-    """Registra una acción de edición"""
+    """Registra una acción de edición (las columnas que cambiaron, o el registro entero si toca punto de control)"""
     datos_anteriores = model_to_dict(registro_anterior) if hasattr(registro_anterior, '__table__') else registro_anterior
-    datos_nuevos = model_to_dict(registro_nuevo) if hasattr(registro_nuevo, '__table__') else registro_nuevo
+    registro_completo = model_to_dict(registro_nuevo) if hasattr(registro_nuevo, '__table__') else registro_nuevo
+    
+    datos_anteriores, datos_nuevos = field_delta(datos_anteriores or {}, registro_completo or {})
+    datos_completos = needs_checkpoint(db, tabla, id_registro)
+    if datos_completos:
+        datos_nuevos = registro_completo
     
     return registrar_movimiento(
         db=db,
@@ -135,7 +355,8 @@ def audit_update(
         datos_anteriores=datos_anteriores,
         datos_nuevos=datos_nuevos,
         ip_address=ip_address,
-        user_agent=user_agent
+        user_agent=user_agent,
+        datos_completos=datos_completos
     )
 
 def audit_delete(
@@ -164,6 +385,68 @@ def audit_delete(
         user_agent=user_agent
     )
 
+def replay_state(movimientos) -> Optional[dict]:
+    """Aplica en orden (accion, datos_nuevos, datos_completos) desde un movimiento completo"""
+    estado = None
+    for accion, datos_nuevos, datos_completos in movimientos:
+        if accion == AccionEnum.eliminar:
+            estado = None
+        elif datos_completos or estado is None:
+            estado = dict(datos_nuevos or {})
+        else:
+            estado.update(datos_nuevos or {})
+    return estado
+
+def reconstruir_registro(
+    db: Session,
+    tabla: str,
+    id_registro: int,
+    hasta_id: Optional[int] = None,
+    hasta_fecha: Optional[datetime] = None
+) -> Optional[dict]:
+    """
+    Estado de un registro después de un movimiento (hasta_id) o a una fecha.
+    Parte del último movimiento completo y aplica las ediciones posteriores,
+    así lee como mucho CHECKPOINT_EVERY movimientos. None si no hay historial
+    completo del registro hasta ese punto.
+    """
+    query = db.query(HistorialMovimiento)\
+        .filter(HistorialMovimiento.tabla == tabla,
+                HistorialMovimiento.id_registro == id_registro,
+                HistorialMovimiento.accion.in_(ESTADO_ACCIONES))
+    if hasta_id is not None:
+        query = query.filter(HistorialMovimiento.id_movimiento <= hasta_id)
+    if hasta_fecha is not None:
+        query = query.filter(HistorialMovimiento.fecha_hora <= hasta_fecha)
+    
+    desde = query.with_entities(func.max(HistorialMovimiento.id_movimiento))\
+        .filter(HistorialMovimiento.datos_completos.is_(True))\
+        .scalar()
+    if desde is None:
+        return None
+    movimientos = query.options(load_only(
+        HistorialMovimiento.id_movimiento, HistorialMovimiento.fecha_hora, HistorialMovimiento.accion,
+        HistorialMovimiento.datos_anteriores, HistorialMovimiento.datos_nuevos, HistorialMovimiento.datos_completos
+    )).filter(HistorialMovimiento.id_movimiento >= desde)\
+        .order_by(HistorialMovimiento.id_movimiento)\
+        .all()
+    
+    estado = replay_state(
+        (movimiento.accion, movimiento.datos_nuevos, movimiento.datos_completos) for movimiento in movimientos
+    )
+    
+    ultimo = movimientos[-1]
+    # Dado de baja en ese punto: existe=False y datos=None
+    return {
+        "tabla": tabla,
+        "id_registro": id_registro,
+        "id_movimiento": ultimo.id_movimiento,
+        "fecha_hora": ultimo.fecha_hora,
+        "existe": estado is not None,
+        "datos": estado,
+        "movimientos_aplicados": len(movimientos)
+    }
+
 def audit_file_action(
     db: Session,
     usuario,
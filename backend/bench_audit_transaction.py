@@ -0,0 +1,160 @@
+"""
+Benchmark: create_base / update_base antes y después de unit_of_work
+"antes" reproduce el flujo anterior (commit de la entidad, refresh, commit
+aparte del movimiento de auditoría y nueva consulta con tizados y fichas
+para la respuesta); "después" son los endpoints actuales de server.py, que
+confirman entidad y auditoría en una sola transacción sin releer la fila.
+Por cada petición se cuentan sentencias SQL y commits y se mide la latencia.
+Las peticiones van por ASGI, sin red; con --rtt se agrega una espera por
+sentencia para simular la ida y vuelta a la base de datos.
+
+    python bench_audit_transaction.py --requests 500 --rtt 0.0005
+    python bench_audit_transaction.py --url sqlite:////tmp/bench.db
+
+Escribe bases y movimientos de auditoría: usar una base de pruebas. Con
+MariaDB hay que indicar una muestra base existente (--muestra-base); con
+SQLite se crean las tablas y una muestra de prueba.
+"""
+from fastapi import APIRouter, Depends, FastAPI, Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, joinedload
+import argparse
+import asyncio
+import logging
+import time
+
+import httpx
+
+import database
+from database import DATABASE_URL, get_db
+from models import BaseModel, Entalle, MuestraBase, RolEnum, Tela, TipoProducto, Usuario
+from schemas import BaseCreate, BaseSchema, BaseUpdate
+
+BENCH_USER = Usuario(username="bench", nombre="Benchmark", rol=RolEnum.super_admin)
+
+def build_legacy_app(server) -> FastAPI:
+    """Los endpoints como eran antes de unit_of_work"""
+    router = APIRouter()
+
+    @router.post("/bases", response_model=BaseSchema)
+    def create_base(base: BaseCreate, request: Request, db: Session = Depends(get_db)):
+        db_base = BaseModel(**base.model_dump())
+        db.add(db_base)
+        db.commit()
+        db.refresh(db_base)
+        server.audit_create(db, BENCH_USER, "bases", db_base, db_base.id_base,
+                            f"Creó base modelo: {db_base.modelo or 'Sin modelo'}",
+                            server.get_client_ip(request), server.get_user_agent(request))
+        return db.query(BaseModel).options(
+            joinedload(BaseModel.tizados), joinedload(BaseModel.fichas)
+        ).filter(BaseModel.id_base == db_base.id_base).first()
+
+    @router.put("/bases/{id_base}", response_model=BaseSchema)
+    def update_base(id_base: int, base: BaseUpdate, request: Request, db: Session = Depends(get_db)):
+        db_base = db.query(BaseModel).filter(BaseModel.id_base == id_base).first()
+        datos_anteriores = server.model_to_dict(db_base)
+        for key, value in base.model_dump(exclude_unset=True).items():
+            setattr(db_base, key, value)
+        db.commit()
+        server.audit_update(db, BENCH_USER, "bases", datos_anteriores, db_base, id_base,
+                            f"Editó base modelo: {db_base.modelo or 'Sin modelo'}",
+                            server.get_client_ip(request), server.get_user_agent(request))
+        return db.query(BaseModel).options(
+            joinedload(BaseModel.tizados), joinedload(BaseModel.fichas)
+        ).filter(BaseModel.id_base == id_base).first()
+
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+    return app
+
+def seed_muestra_base(engine) -> int:
+    database.Base.metadata.create_all(engine)
+    with database.SessionLocal() as db:
+        muestra = MuestraBase(tipo_producto=TipoProducto(nombre_tipo="bench"), entalle=Entalle(nombre_entalle="bench"),
+                              tela=Tela(nombre_tela="bench"))
+        db.add(muestra)
+        db.commit()
+        return muestra.id_muestra_base
+
+class StatementCounter:
+    """Cuenta sentencias y commits del motor; con rtt espera en cada sentencia"""
+
+    def __init__(self, engine, rtt: float):
+        self.statements = 0
+        self.commits = 0
+        self.rtt = rtt
+        event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(engine, "commit", self.commit)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+        if self.rtt:
+            time.sleep(self.rtt)
+
+    def commit(self, conn):
+        self.commits += 1
+        if self.rtt:
+            time.sleep(self.rtt)
+
+    def reset(self):
+        self.statements = self.commits = 0
+
+async def run(app: FastAPI, counter: StatementCounter, id_muestra_base: int, requests: int) -> dict:
+    latencies = {"create": [], "update": []}
+    totals = {"create": [0, 0], "update": [0, 0]}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for i in range(requests):
+            for op in ("create", "update"):
+                counter.reset()
+                start = time.perf_counter()
+                if op == "create":
+                    response = await client.post("/api/bases", json={"id_muestra_base": id_muestra_base, "modelo": f"bench {i}"})
+                    id_base = response.json()["id_base"]
+                else:
+                    response = await client.put(f"/api/bases/{id_base}", json={"modelo": f"bench {i} editada"})
+                latencies[op].append(time.perf_counter() - start)
+                response.raise_for_status()
+                totals[op][0] += counter.statements
+                totals[op][1] += counter.commits
+    result = {}
+    for op, values in latencies.items():
+        values.sort()
+        result[op] = {
+            "sentencias": totals[op][0] / requests,
+            "commits": totals[op][1] / requests,
+            "p50_ms": values[len(values) // 2] * 1000,
+            "p95_ms": values[int(len(values) * 0.95)] * 1000
+        }
+    return result
+
+async def main(args):
+    engine = create_engine(args.url, pool_pre_ping=not args.url.startswith("sqlite"))
+    database.engine = engine
+    database.SessionLocal.configure(bind=engine)
+    id_muestra_base = args.muestra_base or (seed_muestra_base(engine) if args.url.startswith("sqlite") else None)
+    if id_muestra_base is None:
+        raise SystemExit("Indicar --muestra-base con una muestra existente")
+
+    import server  # después de enlazar SessionLocal al motor del benchmark
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    server.app.dependency_overrides[server.get_current_user] = lambda: BENCH_USER
+    legacy = build_legacy_app(server)
+    counter = StatementCounter(engine, args.rtt)
+    try:
+        print(f"⏱️  {args.requests} peticiones por operación, rtt={args.rtt * 1000:.2f}ms por sentencia")
+        for nombre, app in (("antes", legacy), ("después", server.app)):
+            result = await run(app, counter, id_muestra_base, args.requests)
+            for op, r in result.items():
+                print(f"{nombre:<8} {op}_base  {r['sentencias']:4.1f} sentencias  {r['commits']:3.1f} commits  "
+                      f"p50={r['p50_ms']:.2f}ms  p95={r['p95_ms']:.2f}ms")
+    finally:
+        engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500, help="Peticiones de cada operación")
+    parser.add_argument("--rtt", type=float, default=0.0, help="Segundos de espera por sentencia (0 = sin demora)")
+    parser.add_argument("--muestra-base", type=int, default=None, help="id_muestra_base para las bases creadas")
+    parser.add_argument("--url", default=DATABASE_URL)
+    asyncio.run(main(parser.parse_args()))
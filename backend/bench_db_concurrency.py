@@ -0,0 +1,108 @@
+"""
+Benchmark: endpoints sync (threadpool) vs async (event loop) con muchos clientes
+Levanta en el mismo proceso una app con dos rutas que ejecutan la misma
+consulta que /api/bases (página de bases con tizados y fichas): una `def`
+con SessionLocal, que Starlette corre en el threadpool (40 hilos por
+defecto), y una `async def` con AsyncSessionLocal. Los clientes se conectan
+por ASGI, sin red, así la diferencia que se mide es la del modelo de
+concurrencia. Con --latency se agrega un SELECT SLEEP() para simular una
+consulta lenta (solo MySQL/MariaDB).
+
+    python bench_db_concurrency.py --concurrency 10,50,200 --duration 10 --latency 0.05
+
+Los dos motores usan el mismo tamaño de pool (--pool) para que el límite no
+sea la cantidad de conexiones.
+"""
+from fastapi import FastAPI
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import selectinload, sessionmaker
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from database import DATABASE_URL, ASYNC_DATABASE_URL
+from models import BaseModel
+
+PAGE_SIZE = 50
+
+def bases_query():
+    return select(BaseModel)\
+        .options(selectinload(BaseModel.tizados), selectinload(BaseModel.fichas))\
+        .order_by(BaseModel.id_base)\
+        .limit(PAGE_SIZE)
+
+def build_app(sync_url: str, async_url: str, pool: int, latency: float) -> tuple:
+    sync_engine = create_engine(sync_url, pool_size=pool, max_overflow=0, pool_pre_ping=True)
+    async_engine = create_async_engine(async_url, pool_size=pool, max_overflow=0, pool_pre_ping=True)
+    SyncSession = sessionmaker(bind=sync_engine)
+    AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+    app = FastAPI()
+
+    @app.get("/sync")
+    def sync_route():
+        with SyncSession() as db:
+            if latency:
+                db.execute(text("SELECT SLEEP(:s)"), {"s": latency})
+            return len(db.scalars(bases_query()).all())
+
+    @app.get("/async")
+    async def async_route():
+        async with AsyncSession() as db:
+            if latency:
+                await db.execute(text("SELECT SLEEP(:s)"), {"s": latency})
+            return len((await db.scalars(bases_query())).all())
+
+    return app, sync_engine, async_engine
+
+async def run(app: FastAPI, path: str, concurrency: int, duration: float) -> dict:
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client_loop(client: httpx.AsyncClient):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await client.get(path)
+            if response.status_code != 200:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[client_loop(client) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "req_s": len(latencies) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0,
+        "errores": errors
+    }
+
+async def main(args):
+    app, sync_engine, async_engine = build_app(args.sync_url, args.async_url, args.pool, args.latency)
+    try:
+        print(f"⏱️  pool={args.pool} latencia={args.latency}s duración={args.duration}s por prueba")
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            for path in ("/sync", "/async"):
+                result = await run(app, path, concurrency, args.duration)
+                print(f"{path:<7} clientes={concurrency:<5} {result['req_s']:8.1f} req/s  "
+                      f"p50={result['p50_ms']:.1f}ms  p95={result['p95_ms']:.1f}ms  errores={result['errores']}")
+    finally:
+        sync_engine.dispose()
+        await async_engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="10,50,200", help="Clientes simultáneos, separados por coma")
+    parser.add_argument("--duration", type=float, default=10.0, help="Segundos por prueba")
+    parser.add_argument("--latency", type=float, default=0.05, help="SELECT SLEEP() por petición (0 = sin demora)")
+    parser.add_argument("--pool", type=int, default=100, help="Conexiones de cada motor")
+    parser.add_argument("--sync-url", default=DATABASE_URL)
+    parser.add_argument("--async-url", default=ASYNC_DATABASE_URL)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,96 @@
+"""
+Caché en memoria de los catálogos (telas, marcas, entalles, tipos de producto)
+Son tablas chicas que cambian poco y se piden en cada carga de página. Se
+guarda el JSON ya serializado de la lista completa junto con la versión de
+la tabla (x_version_tabla); un acierto solo lee la versión por clave
+primaria, sin consultar la tabla ni pasar por Pydantic.
+
+Cada commit que modifica un catálogo aumenta su versión en la misma
+transacción (table_versions.track_versions) e invalida la entrada local; los
+demás workers ven la versión nueva en su próxima lectura y reconstruyen.
+"""
+from sqlalchemy.orm import Session
+from pydantic import TypeAdapter
+from typing import Callable, Dict, Iterable, List, Optional
+import threading
+import time
+
+from table_versions import get_version
+
+class CatalogEntry:
+    def __init__(self, version: int, body: bytes, rows: int):
+        self.version = version
+        self.body = body
+        self.rows = rows
+
+class CatalogCache:
+    def __init__(self):
+        self._entries: Dict[str, CatalogEntry] = {}
+        self._loaders: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.rebuild_seconds = 0.0
+        self.last_rebuild_seconds: Dict[str, float] = {}
+
+    def register(self, tabla: str, loader: Callable[[Session], list], schema):
+        """loader(db) devuelve las filas; schema es el modelo Pydantic de cada elemento"""
+        self._loaders[tabla] = (loader, TypeAdapter(List[schema]))
+
+    def get(self, db: Session, tabla: str, version: Optional[int] = None) -> bytes:
+        """JSON de la lista completa de la tabla, reconstruido solo si cambió la versión"""
+        if version is None:
+            version = get_version(db, tabla)
+        entry = self._entries.get(tabla)
+        if entry is not None and entry.version == version:
+            with self._lock:
+                self.hits += 1
+            return entry.body
+        return self._rebuild(db, tabla, version)
+
+    def _rebuild(self, db: Session, tabla: str, version: int) -> bytes:
+        loader, adapter = self._loaders[tabla]
+        start = time.perf_counter()
+        # La versión se leyó antes que las filas: si otro proceso cambia la tabla
+        # en el medio, la entrada queda con la versión vieja y se reconstruye en
+        # la próxima lectura
+        rows = loader(db)
+        body = adapter.dump_json(adapter.validate_python(rows, from_attributes=True))
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            current = self._entries.get(tabla)
+            if current is None or current.version <= version:
+                self._entries[tabla] = CatalogEntry(version, body, len(rows))
+            self.misses += 1
+            self.rebuilds += 1
+            self.rebuild_seconds += elapsed
+            self.last_rebuild_seconds[tabla] = elapsed
+        return body
+
+    def invalidate(self, tablas: Optional[Iterable[str]] = None):
+        with self._lock:
+            if tablas is None:
+                self._entries.clear()
+            for tabla in tablas or ():
+                self._entries.pop(tabla, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "aciertos": self.hits,
+                "fallos": self.misses,
+                "tasa_aciertos": round(self.hits / total, 4) if total else None,
+                "reconstrucciones": self.rebuilds,
+                "tiempo_reconstruccion_ms": round(self.rebuild_seconds * 1000, 2),
+                "tablas": {
+                    tabla: {
+                        "version": entry.version,
+                        "filas": entry.rows,
+                        "bytes": len(entry.body),
+                        "ultima_reconstruccion_ms": round(self.last_rebuild_seconds.get(tabla, 0) * 1000, 2)
+                    }
+                    for tabla, entry in self._entries.items()
+                }
+            }
@@ -1,5 +1,6 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 import os
 from dotenv import load_dotenv
 from pathlib import Path
@@ -15,6 +16,7 @@ PG_PASSWORD = os.environ.get('PG_PASSWORD')
 PG_DB = os.environ.get('PG_DB')
 
 DATABASE_URL = f"mysql+pymysql://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DB}"
+ASYNC_DATABASE_URL = f"mysql+aiomysql://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DB}"
 
 engine = create_engine(
     DATABASE_URL,
@@ -24,6 +26,20 @@ engine = create_engine(
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Motor async para los endpoints de lectura: no ocupan un hilo del threadpool
+# mientras esperan a la base de datos
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    echo=False,
+    pool_pre_ping=True,
+    pool_recycle=3600,
+    pool_size=int(os.environ.get('DB_ASYNC_POOL_SIZE', 20)),
+    max_overflow=int(os.environ.get('DB_ASYNC_MAX_OVERFLOW', 20))
+)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -32,3 +48,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
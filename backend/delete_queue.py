@@ -0,0 +1,205 @@
+"""
+Cola de eliminación de archivos en segundo plano
+Los handlers encolan las claves a borrar dentro de su propia transacción
+(x_cola_eliminacion) y un worker del proceso las elimina del almacenamiento
+en lotes de hasta 1000 claves (DeleteObjects de S3/R2), reintentando los
+fallos con espera exponencial.
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import update, delete
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+import threading
+import uuid
+
+from models import EliminacionPendiente, ArchivoContenido
+from file_dedup import release_alias
+
+BATCH_SIZE = 1000  # Máximo de claves por DeleteObjects
+LEASE_SECONDS = 300  # Tiempo que un lote queda reservado para el worker que lo tomó
+BACKOFF_BASE_SECONDS = 10
+BACKOFF_MAX_SECONDS = 3600
+
+def get_file_key(file_url: str) -> str:
+    """Extrae el nombre del archivo de la URL"""
+    # URL formato: https://bucket.account.r2.cloudflarestorage.com/filename
+    # o puede ser solo el filename guardado
+    if file_url.startswith('http'):
+        return file_url.split('/')[-1]
+    return file_url
+
+def enqueue_file_deletion(db: Session, file_url: Optional[str]) -> bool:
+    """
+    Encola un archivo para eliminarlo (sin hacer commit, se confirma junto
+    con el cambio de la entidad). Si es un alias deduplicado solo se encola
+    el contenido cuando era su última referencia.
+    """
+    if not file_url:
+        return False
+    file_key = get_file_key(file_url)
+    now = datetime.now(timezone.utc)
+
+    contenido = release_alias(db, file_key)
+    if contenido is not None:
+        if contenido.ref_count > 0:
+            return True
+        db.add(EliminacionPendiente(
+            storage_key=contenido.storage_key, sha256=contenido.sha256, proximo_intento=now
+        ))
+        return True
+
+    # Archivos antiguos guardados con su nombre como clave
+    db.add(EliminacionPendiente(storage_key=file_key, proximo_intento=now))
+    return True
+
+def enqueue_file_deletions(db: Session, file_urls: list) -> int:
+    """Encola varios archivos para eliminar"""
+    return sum(1 for url in file_urls if enqueue_file_deletion(db, url))
+
+def backoff_delay(intentos: int) -> timedelta:
+    """Espera exponencial entre reintentos"""
+    return timedelta(seconds=min(BACKOFF_BASE_SECONDS * (2 ** max(intentos - 1, 0)), BACKOFF_MAX_SECONDS))
+
+def claim_batch(db: Session, batch_size: int = BATCH_SIZE) -> List[EliminacionPendiente]:
+    """Reserva un lote de eliminaciones vencidas para este worker"""
+    now = datetime.now(timezone.utc)
+    token = str(uuid.uuid4())
+    db.execute(
+        update(EliminacionPendiente)
+        .where(EliminacionPendiente.proximo_intento <= now)
+        .values(token=token, proximo_intento=now + timedelta(seconds=LEASE_SECONDS))
+        .execution_options(synchronize_session=False)
+        .with_dialect_options(mysql_limit=batch_size)
+    )
+    db.commit()
+    return db.query(EliminacionPendiente)\
+        .filter(EliminacionPendiente.token == token)\
+        .order_by(EliminacionPendiente.id_eliminacion)\
+        .limit(batch_size)\
+        .all()
+
+def process_batch(
+    db: Session,
+    delete_keys: Callable[[List[str]], Dict[str, str]],
+    batch_size: int = BATCH_SIZE
+) -> dict:
+    """
+    Procesa un lote de la cola.
+    delete_keys recibe las claves y retorna {clave: error} con las que fallaron.
+    """
+    pendientes = claim_batch(db, batch_size)
+    if not pendientes:
+        return {"procesados": 0, "eliminados": 0, "fallidos": 0}
+
+    # Los contenidos deduplicados se bloquean mientras se borran (también los que
+    # no tienen registro, p. ej. huérfanos del recolector): si una subida
+    # concurrente los volvió a referenciar, se descartan de la cola
+    shas = {p.sha256 for p in pendientes if p.sha256}
+    referenciados = set()
+    if shas:
+        referenciados = {
+            sha for sha, ref_count in db.query(ArchivoContenido.sha256, ArchivoContenido.ref_count)
+            .filter(ArchivoContenido.sha256.in_(shas))
+            .with_for_update()
+            .all()
+            if ref_count > 0
+        }
+
+    descartados = [p for p in pendientes if p.sha256 in referenciados]
+    a_borrar = [p for p in pendientes if p.sha256 not in referenciados]
+
+    errores = delete_keys(sorted({p.storage_key for p in a_borrar})) if a_borrar else {}
+
+    now = datetime.now(timezone.utc)
+    eliminados = 0
+    for pendiente in a_borrar:
+        error = errores.get(pendiente.storage_key)
+        if error:
+            pendiente.intentos += 1
+            pendiente.ultimo_error = error[:2000]
+            pendiente.token = None
+            pendiente.proximo_intento = now + backoff_delay(pendiente.intentos)
+            continue
+        if pendiente.sha256:
+            db.execute(
+                delete(ArchivoContenido)
+                .where(ArchivoContenido.sha256 == pendiente.sha256, ArchivoContenido.ref_count <= 0)
+            )
+        db.delete(pendiente)
+        eliminados += 1
+    for pendiente in descartados:
+        db.delete(pendiente)
+    db.commit()
+
+    return {"procesados": len(pendientes), "eliminados": eliminados, "fallidos": len(a_borrar) - eliminados}
+
+def queue_stats(db: Session) -> dict:
+    """Estado de la cola de eliminación"""
+    from sqlalchemy import func
+    now = datetime.now(timezone.utc)
+    pendientes = db.query(func.count(EliminacionPendiente.id_eliminacion)).scalar()
+    con_error = db.query(func.count(EliminacionPendiente.id_eliminacion))\
+        .filter(EliminacionPendiente.intentos > 0).scalar()
+    vencidos = db.query(func.count(EliminacionPendiente.id_eliminacion))\
+        .filter(EliminacionPendiente.proximo_intento <= now).scalar()
+    return {"pendientes": pendientes, "con_error": con_error, "vencidos": vencidos}
+
+class DeletionWorker:
+    """Hilo del proceso que vacía la cola de eliminación"""
+
+    def __init__(self, session_factory, delete_keys: Callable[[List[str]], Dict[str, str]],
+                 interval: float = 5.0):
+        self.session_factory = session_factory
+        self.delete_keys = delete_keys
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.eliminados = 0
+        self.fallidos = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="deletion-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def notify(self):
+        """Despierta al worker (p. ej. después de encolar archivos)"""
+        self._wake.set()
+
+    def run_once(self) -> dict:
+        """Procesa lotes hasta vaciar lo vencido de la cola"""
+        total = {"procesados": 0, "eliminados": 0, "fallidos": 0}
+        while not self._stop.is_set():
+            db = self.session_factory()
+            try:
+                result = process_batch(db, self.delete_keys)
+            except Exception as e:
+                db.rollback()
+                print(f"⚠️ Error procesando la cola de eliminación: {e}")
+                break
+            finally:
+                db.close()
+            for key in total:
+                total[key] += result[key]
+            self.eliminados += result["eliminados"]
+            self.fallidos += result["fallidos"]
+            if result["procesados"] == 0 or result["fallidos"] == result["procesados"]:
+                break
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            result = self.run_once()
+            if result["eliminados"]:
+                print(f"🗑️ Cola de eliminación: {result['eliminados']} archivos eliminados")
+            self._wake.wait(self.interval)
+            self._wake.clear()
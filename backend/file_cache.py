@@ -0,0 +1,181 @@
+"""
+Caché local en disco para archivos de R2
+Guarda en disco los archivos descargados de R2 con un límite de bytes y
+desalojo LRU. Las escrituras se hacen en un temporal y se publican con un
+rename atómico, así una descarga interrumpida nunca deja un archivo a medias.
+"""
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+TMP_SUFFIX = ".tmp"
+
+class DiskCache:
+    """Caché LRU en disco con presupuesto de bytes"""
+
+    def __init__(self, cache_dir: Path, max_bytes: int, max_entry_bytes: Optional[int] = None):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes
+        self._entries = OrderedDict()  # nombre en disco -> tamaño, del menos al más usado
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._load_existing()
+
+    def _load_existing(self):
+        """Reconstruye el índice con los archivos que ya están en disco"""
+        files = []
+        for path in self.cache_dir.iterdir():
+            if not path.is_file():
+                continue
+            if path.name.endswith(TMP_SUFFIX):
+                # Descarga interrumpida de una ejecución anterior
+                path.unlink(missing_ok=True)
+                continue
+            stat_result = path.stat()
+            # El último acceso se guarda en atime (mtime conserva la fecha del original)
+            files.append((stat_result.st_atime, path.name, stat_result.st_size))
+
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._total_bytes += size
+        with self._lock:
+            self._evict()
+
+    def _entry_name(self, key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _evict(self):
+        """Elimina las entradas menos usadas hasta respetar el presupuesto (requiere lock)"""
+        while self._total_bytes > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            (self.cache_dir / name).unlink(missing_ok=True)
+
+    def get(self, key: str) -> Optional[Path]:
+        """Retorna la ruta del archivo en caché, o None si no está"""
+        name = self._entry_name(key)
+        with self._lock:
+            if name not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+        path = self.cache_dir / name
+        try:
+            # Persistir el orden LRU entre reinicios
+            os.utime(path, ns=(time.time_ns(), path.stat().st_mtime_ns))
+        except FileNotFoundError:
+            self.invalidate(key)
+            return None
+        return path
+
+    def accepts(self, size: Optional[int]) -> bool:
+        """Indica si un archivo de este tamaño puede guardarse en caché"""
+        return size is not None and size <= self.max_entry_bytes
+
+    def open_writer(self, key: str, expected_size: Optional[int] = None,
+                    mtime: Optional[float] = None) -> "CacheWriter":
+        """Abre un escritor que publica la entrada solo si se completa"""
+        tmp_path = self.cache_dir / f"{uuid.uuid4().hex}{TMP_SUFFIX}"
+        return CacheWriter(self, key, tmp_path, expected_size, mtime)
+
+    def _publish(self, key: str, tmp_path: Path, size: int, mtime: Optional[float] = None):
+        name = self._entry_name(key)
+        if mtime is not None:
+            # Conservar la fecha de modificación del original (Last-Modified / If-Range)
+            os.utime(tmp_path, (time.time(), mtime))
+        with self._lock:
+            os.replace(tmp_path, self.cache_dir / name)
+            previous = self._entries.pop(name, None)
+            if previous is not None:
+                self._total_bytes -= previous
+            self._entries[name] = size
+            self._total_bytes += size
+            self._evict()
+
+    def invalidate(self, key: str) -> bool:
+        """Elimina una entrada de la caché"""
+        name = self._entry_name(key)
+        with self._lock:
+            size = self._entries.pop(name, None)
+            if size is not None:
+                self._total_bytes -= size
+            (self.cache_dir / name).unlink(missing_ok=True)
+        return size is not None
+
+    def stats(self) -> dict:
+        """Contadores para dimensionar la caché"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "max_entry_bytes": self.max_entry_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+class CacheWriter:
+    """Escribe una entrada en un temporal y la publica con un rename atómico"""
+
+    def __init__(self, cache: DiskCache, key: str, tmp_path: Path,
+                 expected_size: Optional[int] = None, mtime: Optional[float] = None):
+        self.cache = cache
+        self.key = key
+        self.tmp_path = tmp_path
+        self.expected_size = expected_size
+        self.mtime = mtime
+        self.size = 0
+        self.failed = False
+        self._file = open(tmp_path, "wb")
+
+    def write(self, chunk: bytes):
+        if self.failed:
+            return
+        try:
+            self._file.write(chunk)
+            self.size += len(chunk)
+        except OSError as e:
+            # Un error de la caché (p. ej. disco lleno) no debe cortar la descarga
+            print(f"⚠️ Error escribiendo en caché: {e}")
+            self.failed = True
+
+    def commit(self) -> bool:
+        """Publica la entrada; si la descarga quedó incompleta la descarta"""
+        self._file.close()
+        if self.failed or (self.expected_size is not None and self.size != self.expected_size):
+            self.tmp_path.unlink(missing_ok=True)
+            return False
+        self.cache._publish(self.key, self.tmp_path, self.size, self.mtime)
+        return True
+
+    def abort(self):
+        self._file.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+async def aiter_and_cache(chunks, writer: CacheWriter):
+    """Transmite los bloques al cliente mientras los guarda en caché (escrituras en un hilo)"""
+    try:
+        async for chunk in chunks:
+            await asyncio.to_thread(writer.write, chunk)
+            yield chunk
+    except BaseException:
+        # Cliente desconectado o error de R2: descartar la escritura parcial
+        writer.abort()
+        raise
+    await asyncio.to_thread(writer.commit)
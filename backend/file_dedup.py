@@ -0,0 +1,91 @@
+"""
+Almacenamiento de archivos direccionado por contenido
+Cada contenido se guarda una sola vez con su SHA-256 como clave y los
+nombres uuid_nombreoriginal.ext quedan como alias en x_archivo_alias.
+Un contenido solo se borra del almacenamiento cuando se elimina su último
+alias (ver delete_queue.py).
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import update
+from typing import Dict, Optional
+from models import ArchivoContenido, ArchivoAlias
+
+CONTENT_KEY_PREFIX = "objects/"
+
+def content_key(sha256: str) -> str:
+    """Clave de almacenamiento para un contenido"""
+    return f"{CONTENT_KEY_PREFIX}{sha256}"
+
+def content_sha(key: str) -> Optional[str]:
+    """SHA-256 de una clave de contenido (objects/<sha>), o None si es otra clave"""
+    if key.startswith(CONTENT_KEY_PREFIX):
+        return key[len(CONTENT_KEY_PREFIX):]
+    return None
+
+def acquire_content(db: Session, sha256: str) -> bool:
+    """
+    Suma una referencia a un contenido existente.
+    Retorna False si el contenido no existe y hay que subirlo.
+    """
+    result = db.execute(
+        update(ArchivoContenido)
+        .where(ArchivoContenido.sha256 == sha256)
+        .values(ref_count=ArchivoContenido.ref_count + 1)
+    )
+    return result.rowcount > 0
+
+def create_content(db: Session, sha256: str, size: int, content_type: Optional[str]) -> None:
+    """Registra un contenido recién subido con una referencia"""
+    try:
+        with db.begin_nested():
+            db.add(ArchivoContenido(
+                sha256=sha256,
+                storage_key=content_key(sha256),
+                tamano=size,
+                content_type=content_type,
+                ref_count=1
+            ))
+    except IntegrityError:
+        # Otra subida concurrente del mismo contenido lo registró primero
+        acquire_content(db, sha256)
+
+def add_alias(db: Session, nombre: str, sha256: str) -> ArchivoAlias:
+    """Crea el alias uuid_nombreoriginal.ext para un contenido"""
+    alias = ArchivoAlias(nombre=nombre, sha256=sha256)
+    db.add(alias)
+    return alias
+
+def resolve_alias(db: Session, nombre: str) -> Optional[ArchivoContenido]:
+    """Retorna el contenido al que apunta un alias, o None si es un archivo antiguo"""
+    return db.query(ArchivoContenido)\
+        .join(ArchivoAlias, ArchivoAlias.sha256 == ArchivoContenido.sha256)\
+        .filter(ArchivoAlias.nombre == nombre)\
+        .first()
+
+def release_alias(db: Session, nombre: str) -> Optional[ArchivoContenido]:
+    """
+    Elimina un alias y resta una referencia a su contenido (sin hacer commit).
+    Retorna el contenido, o None si el nombre no era un alias.
+    """
+    alias = db.query(ArchivoAlias).filter(ArchivoAlias.nombre == nombre).first()
+    if not alias:
+        return None
+    sha256 = alias.sha256
+    db.delete(alias)
+    db.execute(
+        update(ArchivoContenido)
+        .where(ArchivoContenido.sha256 == sha256)
+        .values(ref_count=ArchivoContenido.ref_count - 1)
+    )
+    return db.query(ArchivoContenido).filter(ArchivoContenido.sha256 == sha256).first()
+
+def resolve_aliases(db: Session, nombres: list) -> Dict[str, ArchivoContenido]:
+    """Resuelve varios alias en una sola consulta: {nombre: contenido}"""
+    if not nombres:
+        return {}
+    rows = db.query(ArchivoAlias.nombre, ArchivoContenido)\
+        .join(ArchivoContenido, ArchivoAlias.sha256 == ArchivoContenido.sha256)\
+        .filter(ArchivoAlias.nombre.in_(set(nombres)))\
+        .all()
+    return {nombre: contenido for nombre, contenido in rows}
@@ -0,0 +1,340 @@
+"""
+Recolector de archivos huérfanos
+Recorre el almacenamiento (R2 o uploads/) y la tabla de alias página por
+página y verifica cada página en bloque contra las columnas de archivos de
+x_base, x_ficha, x_tizado y x_muestra_base. Lo que no usa nadie y es más
+antiguo que el período de gracia pasa a cuarentena (x_gc_cuarentena); al
+vencer la cuarentena se verifica de nuevo y se encola en la cola de
+eliminación (ver delete_queue.py).
+
+El avance de cada recorrido se guarda en x_gc_estado después de cada página,
+así el trabajo se retoma donde quedó sin tener todas las claves en memoria.
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import and_, func, or_, update
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional, Set
+import threading
+import uuid
+
+from models import (
+    BaseModel, Ficha, Tizado, MuestraBase,
+    ArchivoAlias, ArchivoContenido, EliminacionPendiente,
+    EstadoGC, CuarentenaArchivo
+)
+from file_dedup import CONTENT_KEY_PREFIX, content_sha
+from delete_queue import enqueue_file_deletion
+from image_variants import variant_source_key
+from storage import ObjectInfo
+
+FASE_OBJETOS = "objetos"
+FASE_ALIAS = "alias"
+FASE_CUARENTENA = "cuarentena"
+TIPO_OBJETO = "objeto"
+TIPO_ALIAS = "alias"
+
+PAGE_SIZE = 1000
+LEASE_SECONDS = 600  # Tiempo que una fase queda reservada para el proceso que la recorre
+
+# Columnas que guardan archivos (nombre guardado o URL antigua de R2)
+REFERENCE_COLUMNS = [
+    BaseModel.imagen,
+    BaseModel.patron,
+    Ficha.archivo,
+    Tizado.archivo_tizado,
+    MuestraBase.archivo_costo,
+]
+
+def referenced_names(db: Session, nombres) -> Set[str]:
+    """Nombres que aparecen en alguna columna de archivos (una consulta por columna)"""
+    nombres = set(nombres)
+    if not nombres:
+        return set()
+    referenced = set()
+    for column in REFERENCE_COLUMNS:
+        # Las URLs antiguas (https://.../nombre) se comparan por su último segmento
+        last_segment = func.substring_index(column, '/', -1)
+        rows = db.query(column).filter(or_(
+            column.in_(nombres),
+            and_(column.like('http%'), last_segment.in_(nombres))
+        )).all()
+        for (value,) in rows:
+            referenced.add(value.split('/')[-1] if value.startswith('http') else value)
+    return referenced & nombres
+
+def orphan_keys(db: Session, keys: List[str]) -> Set[str]:
+    """
+    Claves del almacenamiento que no usa nadie: contenidos sin registro,
+    archivos antiguos sin referencias y variantes cuyo original es huérfano.
+    Las que ya están en la cola de eliminación no se cuentan.
+    """
+    sources = {key: variant_source_key(key) or key for key in keys}
+    shas = {
+        source[len(CONTENT_KEY_PREFIX):] for source in sources.values()
+        if source.startswith(CONTENT_KEY_PREFIX)
+    }
+    legacy = {source for source in sources.values() if not source.startswith(CONTENT_KEY_PREFIX)}
+
+    vivos = set()
+    if shas:
+        vivos.update(
+            f"{CONTENT_KEY_PREFIX}{sha}" for (sha,) in
+            db.query(ArchivoContenido.sha256).filter(ArchivoContenido.sha256.in_(shas)).all()
+        )
+    vivos.update(referenced_names(db, legacy))
+
+    candidatas = [key for key, source in sources.items() if source not in vivos]
+    if not candidatas:
+        return set()
+    en_cola = {
+        key for (key,) in db.query(EliminacionPendiente.storage_key)
+        .filter(EliminacionPendiente.storage_key.in_(candidatas)).all()
+    }
+    return set(candidatas) - en_cola
+
+def orphan_aliases(db: Session, nombres: List[str]) -> Set[str]:
+    """Alias (archivos subidos) que no se guardaron en ninguna entidad"""
+    return set(nombres) - referenced_names(db, nombres)
+
+def claim_phase(db: Session, fase: str) -> Optional[str]:
+    """Reserva una fase para este proceso; None si otro la está recorriendo"""
+    if db.get(EstadoGC, fase) is None:
+        try:
+            with db.begin_nested():
+                db.add(EstadoGC(fase=fase, ciclos=0, revisados=0, en_cuarentena=0))
+        except IntegrityError:
+            pass
+    now = datetime.now(timezone.utc)
+    token = str(uuid.uuid4())
+    result = db.execute(
+        update(EstadoGC)
+        .where(EstadoGC.fase == fase, or_(EstadoGC.lease_hasta.is_(None), EstadoGC.lease_hasta < now))
+        .values(token=token, lease_hasta=now + timedelta(seconds=LEASE_SECONDS))
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return token if result.rowcount == 1 else None
+
+def release_phase(db: Session, fase: str, token: str):
+    db.execute(
+        update(EstadoGC)
+        .where(EstadoGC.fase == fase, EstadoGC.token == token)
+        .values(token=None, lease_hasta=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+def quarantine(db: Session, tipo: str, claves, hold: timedelta) -> int:
+    """Pone en cuarentena las claves que todavía no lo estaban (sin hacer commit)"""
+    claves = set(claves)
+    if not claves:
+        return 0
+    existentes = {
+        clave for (clave,) in db.query(CuarentenaArchivo.clave)
+        .filter(CuarentenaArchivo.tipo == tipo, CuarentenaArchivo.clave.in_(claves)).all()
+    }
+    now = datetime.now(timezone.utc)
+    nuevas = sorted(claves - existentes)
+    for clave in nuevas:
+        db.add(CuarentenaArchivo(tipo=tipo, clave=clave, detectado=now, eliminar_despues=now + hold))
+    return len(nuevas)
+
+def purge_quarantine(db: Session, batch_size: int = PAGE_SIZE) -> dict:
+    """
+    Encola la eliminación de lo que cumplió la cuarentena, verificando antes
+    que siga sin referencias (lo que se volvió a usar sale de la cuarentena).
+    """
+    now = datetime.now(timezone.utc)
+    vencidos = db.query(CuarentenaArchivo)\
+        .filter(CuarentenaArchivo.eliminar_despues <= now)\
+        .order_by(CuarentenaArchivo.id_cuarentena)\
+        .limit(batch_size)\
+        .all()
+    if not vencidos:
+        return {"procesados": 0, "encolados": 0, "rescatados": 0}
+
+    objetos = [c.clave for c in vencidos if c.tipo == TIPO_OBJETO]
+    aliases = [c.clave for c in vencidos if c.tipo == TIPO_ALIAS]
+    huerfanos = orphan_keys(db, objetos) if objetos else set()
+    alias_huerfanos = set()
+    if aliases:
+        existentes = [
+            nombre for (nombre,) in
+            db.query(ArchivoAlias.nombre).filter(ArchivoAlias.nombre.in_(aliases)).all()
+        ]
+        alias_huerfanos = orphan_aliases(db, existentes)
+
+    encolados = 0
+    for clave in sorted(huerfanos):
+        # Con el sha el worker vuelve a verificar bajo bloqueo que nadie haya
+        # subido de nuevo el mismo contenido antes de borrarlo
+        db.add(EliminacionPendiente(storage_key=clave, sha256=content_sha(clave), proximo_intento=now))
+        encolados += 1
+    for nombre in sorted(alias_huerfanos):
+        # Libera el alias; el contenido se encola si era su última referencia
+        enqueue_file_deletion(db, nombre)
+        encolados += 1
+    for cuarentena in vencidos:
+        db.delete(cuarentena)
+    db.commit()
+    return {"procesados": len(vencidos), "encolados": encolados, "rescatados": len(vencidos) - encolados}
+
+def gc_stats(db: Session) -> dict:
+    """Avance de los recorridos y tamaño de la cuarentena"""
+    now = datetime.now(timezone.utc)
+    fases = {
+        estado.fase: {
+            "cursor": estado.cursor,
+            "ciclos": estado.ciclos,
+            "revisados": estado.revisados,
+            "en_cuarentena": estado.en_cuarentena,
+            "ciclo_inicio": estado.ciclo_inicio,
+            "actualizado": estado.actualizado,
+            "en_curso": estado.lease_hasta is not None and estado.lease_hasta.replace(tzinfo=timezone.utc) > now
+        }
+        for estado in db.query(EstadoGC).all()
+    }
+    en_cuarentena = db.query(func.count(CuarentenaArchivo.id_cuarentena)).scalar()
+    vencidos = db.query(func.count(CuarentenaArchivo.id_cuarentena))\
+        .filter(CuarentenaArchivo.eliminar_despues <= now).scalar()
+    return {"fases": fases, "en_cuarentena": en_cuarentena, "cuarentena_vencida": vencidos}
+
+class OrphanCollector:
+    """
+    Hilo del proceso que recorre el almacenamiento y los alias buscando huérfanos.
+    list_page(start_after, limit) retorna la siguiente página de archivos del almacenamiento.
+    """
+
+    def __init__(self, session_factory, list_page: Callable[[Optional[str], int], List[ObjectInfo]],
+                 grace: timedelta, hold: timedelta, page_size: int = PAGE_SIZE,
+                 max_pages: int = 100, interval: float = 3600.0,
+                 on_enqueue: Optional[Callable[[], None]] = None):
+        self.session_factory = session_factory
+        self.list_page = list_page
+        self.grace = grace
+        self.hold = hold
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.interval = interval
+        self.on_enqueue = on_enqueue
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="orphan-collector", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _scan_objects_page(self, db: Session, estado: EstadoGC) -> tuple:
+        page = self.list_page(estado.cursor, self.page_size)
+        cutoff = datetime.now(timezone.utc) - self.grace
+        # Los archivos recientes pueden ser subidas en curso
+        candidatas = [o.key for o in page if o.last_modified and o.last_modified < cutoff]
+        nuevas = quarantine(db, TIPO_OBJETO, orphan_keys(db, candidatas) if candidatas else (), self.hold)
+        cursor = page[-1].key if len(page) >= self.page_size else None
+        return len(page), nuevas, cursor
+
+    def _scan_aliases_page(self, db: Session, estado: EstadoGC) -> tuple:
+        query = db.query(ArchivoAlias.nombre)\
+            .filter(ArchivoAlias.created_at < datetime.now(timezone.utc) - self.grace)
+        if estado.cursor:
+            query = query.filter(ArchivoAlias.nombre > estado.cursor)
+        nombres = [nombre for (nombre,) in query.order_by(ArchivoAlias.nombre).limit(self.page_size).all()]
+        nuevas = quarantine(db, TIPO_ALIAS, orphan_aliases(db, nombres), self.hold)
+        cursor = nombres[-1] if len(nombres) >= self.page_size else None
+        return len(nombres), nuevas, cursor
+
+    def scan(self, fase: str, max_pages: Optional[int] = None) -> dict:
+        """Avanza hasta max_pages páginas del recorrido de una fase, guardando el avance"""
+        scan_page = self._scan_objects_page if fase == FASE_OBJETOS else self._scan_aliases_page
+        total = {"paginas": 0, "revisados": 0, "en_cuarentena": 0, "ciclo_completo": False}
+        db = self.session_factory()
+        try:
+            token = claim_phase(db, fase)
+            if token is None:
+                return {**total, "ocupado": True}
+            try:
+                for _ in range(max_pages or self.max_pages):
+                    if self._stop.is_set():
+                        break
+                    estado = db.get(EstadoGC, fase, populate_existing=True)
+                    if estado.token != token:
+                        # Otro proceso tomó la fase (venció la reserva)
+                        break
+                    if estado.cursor is None:
+                        estado.ciclo_inicio = datetime.now(timezone.utc)
+                    revisados, nuevas, cursor = scan_page(db, estado)
+
+                    now = datetime.now(timezone.utc)
+                    estado.cursor = cursor
+                    estado.revisados += revisados
+                    estado.en_cuarentena += nuevas
+                    estado.actualizado = now
+                    estado.lease_hasta = now + timedelta(seconds=LEASE_SECONDS)
+                    if cursor is None:
+                        estado.ciclos += 1
+                    db.commit()
+
+                    total["paginas"] += 1
+                    total["revisados"] += revisados
+                    total["en_cuarentena"] += nuevas
+                    if cursor is None:
+                        total["ciclo_completo"] = True
+                        break
+            finally:
+                db.rollback()
+                release_phase(db, fase, token)
+        finally:
+            db.close()
+        return total
+
+    def purge(self) -> dict:
+        """Encola lo que cumplió la cuarentena"""
+        total = {"procesados": 0, "encolados": 0, "rescatados": 0}
+        db = self.session_factory()
+        try:
+            token = claim_phase(db, FASE_CUARENTENA)
+            if token is None:
+                return {**total, "ocupado": True}
+            try:
+                while not self._stop.is_set():
+                    result = purge_quarantine(db, self.page_size)
+                    for key in total:
+                        total[key] += result[key]
+                    if result["procesados"] < self.page_size:
+                        break
+            finally:
+                db.rollback()
+                release_phase(db, FASE_CUARENTENA, token)
+        finally:
+            db.close()
+        if total["encolados"] and self.on_enqueue:
+            self.on_enqueue()
+        return total
+
+    def run_once(self, max_pages: Optional[int] = None) -> dict:
+        return {
+            FASE_OBJETOS: self.scan(FASE_OBJETOS, max_pages),
+            FASE_ALIAS: self.scan(FASE_ALIAS, max_pages),
+            FASE_CUARENTENA: self.purge()
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                result = self.run_once()
+            except Exception as e:
+                print(f"⚠️ Error en el recolector de archivos huérfanos: {e}")
+                continue
+            en_cuarentena = result[FASE_OBJETOS]["en_cuarentena"] + result[FASE_ALIAS]["en_cuarentena"]
+            if en_cuarentena or result[FASE_CUARENTENA]["encolados"]:
+                print(f"🧹 Archivos huérfanos: {en_cuarentena} en cuarentena, "
+                      f"{result[FASE_CUARENTENA]['encolados']} encolados para eliminar")
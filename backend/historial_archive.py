@@ -0,0 +1,453 @@
+"""
+Archivo del historial por mes
+x_historial_movimiento solo guarda los meses recientes (HISTORIAL_HOT_MONTHS).
+Los meses anteriores se escriben en historial-YYYY-MM.jsonl.gz (un movimiento
+por línea, ordenados por fecha) y se borran de la tabla en lotes; así la
+tabla y sus índices siguen chicos y los listados y estadísticas no recorren
+años de movimientos. x_historial_archivo indica qué movimientos de cada mes
+están en su archivo.
+
+Se usa una tabla caliente en vez de particiones de MariaDB: las tablas
+particionadas no admiten la clave foránea a x_usuario y exigen la fecha en
+la clave primaria.
+
+Antes de borrar un mes, la primera edición posterior de cada registro que
+sea solo de cambios pasa a tener el registro completo, así
+reconstruir_registro sigue funcionando solo con la tabla para los puntos
+posteriores al archivo; los puntos dentro de un mes archivado se
+reconstruyen leyendo su archivo (reconstruir_archivado).
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import and_, delete, func, not_, or_, update
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator, List, Optional
+import gzip
+import json
+import os
+import threading
+import uuid
+
+from models import HistorialMovimiento, HistorialArchivo, AccionEnum
+from audit import ESTADO_ACCIONES, reconstruir_registro, replay_state
+from serializers import to_audit_dict
+
+DELETE_BATCH_SIZE = 5000
+COUNT_CACHE_SIZE = 1024  # (mes, filtro) con la cantidad de movimientos que coinciden
+LEASE_SECONDS = 1800  # Tiempo que un mes queda reservado para el proceso que lo archiva
+
+def month_key(fecha: datetime) -> str:
+    return f"{fecha.year:04d}-{fecha.month:02d}"
+
+def month_bounds(mes: str) -> tuple:
+    """(inicio, inicio del mes siguiente) sin zona horaria, como se guarda fecha_hora"""
+    year, month = int(mes[:4]), int(mes[5:7])
+    inicio = datetime(year, month, 1)
+    fin = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return inicio, fin
+
+def add_months(fecha: datetime, months: int) -> datetime:
+    total = fecha.year * 12 + fecha.month - 1 + months
+    return datetime(total // 12, total % 12 + 1, 1)
+
+def naive_utc(fecha: Optional[datetime]) -> Optional[datetime]:
+    if fecha is not None and fecha.tzinfo is not None:
+        return fecha.astimezone(timezone.utc).replace(tzinfo=None)
+    return fecha
+
+def archive_filename(mes: str) -> str:
+    return f"historial-{mes}.jsonl.gz"
+
+def claim_month(db: Session, mes: str) -> Optional[str]:
+    """Reserva un mes para este proceso; None si otro lo está archivando"""
+    if db.get(HistorialArchivo, mes) is None:
+        try:
+            with db.begin_nested():
+                db.add(HistorialArchivo(mes=mes, filas=0, bytes=0))
+        except IntegrityError:
+            pass
+    now = datetime.now(timezone.utc)
+    token = str(uuid.uuid4())
+    result = db.execute(
+        update(HistorialArchivo)
+        .where(HistorialArchivo.mes == mes,
+               or_(HistorialArchivo.lease_hasta.is_(None), HistorialArchivo.lease_hasta < now))
+        .values(token=token, lease_hasta=now + timedelta(seconds=LEASE_SECONDS))
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return token if result.rowcount == 1 else None
+
+def release_month(db: Session, mes: str, token: str):
+    db.execute(
+        update(HistorialArchivo)
+        .where(HistorialArchivo.mes == mes, HistorialArchivo.token == token)
+        .values(token=None, lease_hasta=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+def write_month(db: Session, directory: Path, mes: str) -> dict:
+    """Escribe los movimientos del mes en su archivo (primero a .tmp, luego se renombra)"""
+    inicio, fin = month_bounds(mes)
+    path = directory / archive_filename(mes)
+    tmp = directory / (path.name + ".tmp")
+    filas, desde_id, hasta_id = 0, None, None
+    movimientos = db.query(HistorialMovimiento)\
+        .filter(HistorialMovimiento.fecha_hora >= inicio, HistorialMovimiento.fecha_hora < fin)\
+        .order_by(HistorialMovimiento.fecha_hora, HistorialMovimiento.id_movimiento)\
+        .yield_per(1000)
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        for movimiento in movimientos:
+            f.write(json.dumps(to_audit_dict(movimiento), ensure_ascii=False, default=str))
+            f.write("\n")
+            filas += 1
+            desde_id = movimiento.id_movimiento if desde_id is None else min(desde_id, movimiento.id_movimiento)
+            hasta_id = movimiento.id_movimiento if hasta_id is None else max(hasta_id, movimiento.id_movimiento)
+    with open(tmp, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return {"archivo": path.name, "filas": filas, "bytes": path.stat().st_size,
+            "desde_id": desde_id, "hasta_id": hasta_id}
+
+def promote_checkpoints(db: Session, mes: str, hasta_id: int) -> int:
+    """
+    La primera edición posterior al mes de cada registro del mes, si es solo
+    de cambios, pasa a guardar el registro completo (sin hacer commit)
+    """
+    inicio, fin = month_bounds(mes)
+    registros = db.query(HistorialMovimiento.tabla, HistorialMovimiento.id_registro)\
+        .filter(HistorialMovimiento.fecha_hora >= inicio, HistorialMovimiento.fecha_hora < fin,
+                HistorialMovimiento.id_movimiento <= hasta_id,
+                HistorialMovimiento.accion.in_(ESTADO_ACCIONES),
+                HistorialMovimiento.id_registro.isnot(None))\
+        .distinct()\
+        .all()
+    promovidos = 0
+    for tabla, id_registro in registros:
+        siguiente = db.query(HistorialMovimiento)\
+            .filter(HistorialMovimiento.tabla == tabla,
+                    HistorialMovimiento.id_registro == id_registro,
+                    HistorialMovimiento.accion.in_(ESTADO_ACCIONES),
+                    HistorialMovimiento.id_movimiento > hasta_id)\
+            .order_by(HistorialMovimiento.id_movimiento)\
+            .first()
+        if siguiente is None or siguiente.datos_completos:
+            continue
+        estado = reconstruir_registro(db, tabla, id_registro, hasta_id=siguiente.id_movimiento)
+        if estado is None or not estado["existe"]:
+            continue
+        siguiente.datos_nuevos = estado["datos"]
+        siguiente.datos_completos = True
+        promovidos += 1
+    return promovidos
+
+def in_archive(mes: str, hasta_id: int):
+    """Condición de los movimientos del mes que están en su archivo"""
+    inicio, fin = month_bounds(mes)
+    return and_(HistorialMovimiento.fecha_hora >= inicio, HistorialMovimiento.fecha_hora < fin,
+                HistorialMovimiento.id_movimiento <= hasta_id)
+
+def exclude_archived(query, meses: List[HistorialArchivo]):
+    """Deja fuera de la consulta lo que se lee del archivo de esos meses, aunque siga en la tabla"""
+    condiciones = [in_archive(m.mes, m.hasta_id) for m in meses if m.hasta_id is not None]
+    return query.filter(not_(or_(*condiciones))) if condiciones else query
+
+def delete_month(db: Session, mes: str, hasta_id: int) -> int:
+    """Borra de la tabla los movimientos del mes que están en el archivo, en lotes"""
+    borrados = 0
+    while True:
+        result = db.execute(
+            delete(HistorialMovimiento)
+            .where(in_archive(mes, hasta_id))
+            .execution_options(synchronize_session=False)
+            .with_dialect_options(mysql_limit=DELETE_BATCH_SIZE)
+        )
+        db.commit()
+        borrados += result.rowcount
+        if result.rowcount < DELETE_BATCH_SIZE:
+            return borrados
+
+def archive_month(db: Session, directory: Path, mes: str) -> Optional[dict]:
+    """Archiva un mes (o retoma uno que quedó a medias); None si otro proceso lo tiene reservado"""
+    token = claim_month(db, mes)
+    if token is None:
+        return None
+    try:
+        registro = db.get(HistorialArchivo, mes, populate_existing=True)
+        if registro.archivado is None:
+            escrito = write_month(db, directory, mes)
+            for key, value in escrito.items():
+                setattr(registro, key, value)
+            registro.archivado = datetime.now(timezone.utc)
+            db.commit()
+        promovidos = borrados = 0
+        if registro.completado is None and registro.hasta_id is not None:
+            promovidos = promote_checkpoints(db, mes, registro.hasta_id)
+            db.commit()
+            borrados = delete_month(db, mes, registro.hasta_id)
+        registro.completado = registro.completado or datetime.now(timezone.utc)
+        db.commit()
+        return {"mes": mes, "filas": registro.filas, "bytes": registro.bytes,
+                "promovidos": promovidos, "borrados": borrados}
+    finally:
+        db.rollback()
+        release_month(db, mes, token)
+
+def months_to_archive(db: Session, hot_months: int, now: Optional[datetime] = None) -> List[str]:
+    """Meses con movimientos anteriores a los hot_months más recientes (el actual cuenta)"""
+    corte = add_months(naive_utc(now or datetime.now(timezone.utc)), -(hot_months - 1))
+    primero = db.query(func.min(HistorialMovimiento.fecha_hora))\
+        .filter(HistorialMovimiento.fecha_hora < corte)\
+        .scalar()
+    meses = []
+    mes = add_months(primero, 0) if primero else corte
+    while mes < corte:
+        meses.append(month_key(mes))
+        mes = add_months(mes, 1)
+    return meses
+
+def archived_months(db: Session, desde: Optional[datetime] = None,
+                    hasta: Optional[datetime] = None) -> List[HistorialArchivo]:
+    """Meses archivados que se cruzan con el rango, del más reciente al más antiguo"""
+    query = db.query(HistorialArchivo).filter(HistorialArchivo.archivado.isnot(None))
+    if desde is not None:
+        query = query.filter(HistorialArchivo.mes >= month_key(naive_utc(desde)))
+    if hasta is not None:
+        query = query.filter(HistorialArchivo.mes <= month_key(naive_utc(hasta)))
+    return query.order_by(HistorialArchivo.mes.desc()).all()
+
+def read_file(path: Path) -> Iterator[dict]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+def read_month(directory: Path, registro: HistorialArchivo) -> Iterator[dict]:
+    return read_file(directory / registro.archivo)
+
+class ArchiveFilter:
+    """Los mismos filtros de /api/historial sobre los movimientos archivados"""
+
+    def __init__(self, usuario: Optional[str] = None, tabla: Optional[str] = None,
+                 accion: Optional[str] = None, desde: Optional[datetime] = None,
+                 hasta: Optional[datetime] = None):
+        self.usuario = usuario.lower() if usuario else None
+        self.tabla = tabla
+        self.accion = accion.value if isinstance(accion, AccionEnum) else accion
+        # Las fechas ISO sin zona horaria se comparan bien como texto
+        self.desde = naive_utc(desde).isoformat() if desde else None
+        self.hasta = naive_utc(hasta).isoformat() if hasta else None
+
+    def __call__(self, movimiento: dict) -> bool:
+        if self.tabla and movimiento["tabla"] != self.tabla:
+            return False
+        if self.accion and movimiento["accion"] != self.accion:
+            return False
+        if self.usuario and self.usuario not in (movimiento["username"] or "").lower():
+            return False
+        fecha = movimiento["fecha_hora"] or ""
+        if self.desde and fecha < self.desde:
+            return False
+        if self.hasta and fecha > self.hasta:
+            return False
+        return True
+
+    def _key(self) -> tuple:
+        return (self.usuario, self.tabla, self.accion, self.desde, self.hasta)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ArchiveFilter) and self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+@lru_cache(maxsize=COUNT_CACHE_SIZE)
+def _count_file(path: Path, size: int, mtime_ns: int, filtro: ArchiveFilter) -> int:
+    # Tamaño y fecha de modificación en la clave: si el archivo se reescribe se vuelve a contar
+    return sum(1 for m in read_file(path) if filtro(m))
+
+def count_month(directory: Path, registro: HistorialArchivo, filtro: ArchiveFilter) -> int:
+    """Movimientos del mes que pasan el filtro (en caché: el archivo de un mes no cambia)"""
+    path = directory / registro.archivo
+    stat = path.stat()
+    return _count_file(path, stat.st_size, stat.st_mtime_ns, filtro)
+
+def search_archive(directory: Path, meses: List[HistorialArchivo], filtro: ArchiveFilter,
+                   skip: int, limit: int) -> List[dict]:
+    """
+    Página de movimientos archivados, por fecha descendente.
+    Con la cantidad de coincidencias de cada mes se saltan los meses enteros
+    sin leerlos; del mes donde cae la página se recorre el archivo sin
+    cargarlo y solo se guardan las filas de la página.
+    """
+    resultado = []
+    for registro in meses:
+        total = count_month(directory, registro, filtro)
+        if skip >= total:
+            skip -= total
+            continue
+        # El archivo está en orden ascendente: la página son las coincidencias [desde, hasta)
+        hasta = total - skip
+        desde = max(hasta - (limit - len(resultado)), 0)
+        pagina = []
+        posicion = 0
+        for movimiento in read_month(directory, registro):
+            if not filtro(movimiento):
+                continue
+            if posicion >= desde:
+                pagina.append(movimiento)
+            posicion += 1
+            if posicion >= hasta:
+                break
+        pagina.reverse()
+        resultado.extend(pagina)
+        skip = 0
+        if len(resultado) >= limit:
+            break
+    return resultado
+
+def find_archived(db: Session, directory: Path, id_movimiento: int) -> Optional[dict]:
+    """Un movimiento archivado por su id"""
+    registro = db.query(HistorialArchivo)\
+        .filter(HistorialArchivo.archivado.isnot(None),
+                HistorialArchivo.desde_id <= id_movimiento,
+                HistorialArchivo.hasta_id >= id_movimiento)\
+        .first()
+    if registro is None:
+        return None
+    return next((m for m in read_month(directory, registro) if m["id_movimiento"] == id_movimiento), None)
+
+def reconstruir_archivado(db: Session, directory: Path, tabla: str, id_registro: int,
+                          hasta_id: Optional[int] = None, hasta_fecha: Optional[datetime] = None) -> Optional[dict]:
+    """
+    Como reconstruir_registro, para un punto que cae en un mes archivado (la
+    tabla ya no tiene movimientos del registro hasta ahí). Lee los archivos de
+    los meses hacia atrás hasta encontrar un movimiento completo del registro
+    y les suma los de la tabla que no están archivados. Cuesta leer esos meses
+    enteros; None si tampoco hay historial completo en el archivo.
+    """
+    acciones = {accion.value for accion in ESTADO_ACCIONES}
+    hasta_texto = naive_utc(hasta_fecha).isoformat() if hasta_fecha else None
+
+    def incluido(m: dict) -> bool:
+        return (m["tabla"] == tabla and m["id_registro"] == id_registro and m["accion"] in acciones
+                and (hasta_id is None or m["id_movimiento"] <= hasta_id)
+                and (hasta_texto is None or m["fecha_hora"] <= hasta_texto))
+
+    archivados = archived_months(db, hasta=hasta_fecha)
+    movimientos = {}
+    for registro in archivados:
+        if hasta_id is not None and (registro.desde_id is None or registro.desde_id > hasta_id):
+            continue
+        del_mes = [m for m in read_month(directory, registro) if incluido(m)]
+        movimientos.update((m["id_movimiento"], m) for m in del_mes)
+        if any(m["datos_completos"] for m in del_mes):
+            break
+
+    query = db.query(HistorialMovimiento)\
+        .filter(HistorialMovimiento.tabla == tabla,
+                HistorialMovimiento.id_registro == id_registro,
+                HistorialMovimiento.accion.in_(ESTADO_ACCIONES))
+    if hasta_id is not None:
+        query = query.filter(HistorialMovimiento.id_movimiento <= hasta_id)
+    if hasta_fecha is not None:
+        query = query.filter(HistorialMovimiento.fecha_hora <= naive_utc(hasta_fecha))
+    movimientos.update((m.id_movimiento, to_audit_dict(m)) for m in exclude_archived(query, archivados))
+
+    ordenados = [movimientos[i] for i in sorted(movimientos)]
+    completos = [i for i, m in enumerate(ordenados) if m["datos_completos"]]
+    if not completos:
+        return None
+    ordenados = ordenados[completos[-1]:]
+    estado = replay_state((AccionEnum(m["accion"]), m["datos_nuevos"], m["datos_completos"]) for m in ordenados)
+    ultimo = ordenados[-1]
+    return {
+        "tabla": tabla,
+        "id_registro": id_registro,
+        "id_movimiento": ultimo["id_movimiento"],
+        "fecha_hora": datetime.fromisoformat(ultimo["fecha_hora"]),
+        "existe": estado is not None,
+        "datos": estado,
+        "movimientos_aplicados": len(ordenados)
+    }
+
+def archive_stats(db: Session) -> dict:
+    meses, filas, tamano = db.query(
+        func.count(HistorialArchivo.mes), func.sum(HistorialArchivo.filas), func.sum(HistorialArchivo.bytes)
+    ).filter(HistorialArchivo.archivado.isnot(None)).one()
+    return {"meses": meses, "movimientos": int(filas or 0), "bytes": int(tamano or 0)}
+
+class HistorialArchiver:
+    """Hilo del proceso que archiva los meses que salen de la ventana caliente"""
+
+    def __init__(self, session_factory, directory: Path, hot_months: int = 6, interval: float = 86400.0):
+        self.session_factory = session_factory
+        self.directory = directory
+        self.hot_months = max(hot_months, 1)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._manual = None
+
+    def start(self):
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="historial-archiver", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        self._wake.set()
+        for thread in (self._thread, self._manual):
+            if thread:
+                thread.join(timeout)
+
+    def trigger(self) -> bool:
+        """Archiva ahora en segundo plano sin esperar el intervalo; False si ya hay una pasada manual en curso"""
+        if self._thread and self._thread.is_alive():
+            self._wake.set()
+            return True
+        # Con el hilo periódico apagado (interval <= 0) la pasada corre en un hilo aparte
+        if self._manual and self._manual.is_alive():
+            return False
+        self._manual = threading.Thread(target=self._archive, name="historial-archiver-manual", daemon=True)
+        self._manual.start()
+        return True
+
+    def run_once(self) -> List[dict]:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        resultados = []
+        db = self.session_factory()
+        try:
+            for mes in months_to_archive(db, self.hot_months):
+                if self._stop.is_set():
+                    break
+                resultado = archive_month(db, self.directory, mes)
+                resultados.append(resultado or {"mes": mes, "ocupado": True})
+        finally:
+            db.close()
+        return resultados
+
+    def _archive(self):
+        try:
+            resultados = self.run_once()
+        except Exception as e:
+            print(f"⚠️ Error archivando el historial: {e}")
+            return
+        for resultado in resultados:
+            if not resultado.get("ocupado"):
+                print(f"🗄️ Historial {resultado['mes']}: {resultado['filas']} movimientos archivados "
+                      f"({resultado['bytes'] / 1024:.0f} KB)")
+
+    def _run(self):
+        while True:
+            # trigger() lo despierta antes de que se cumpla el intervalo
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            self._archive()
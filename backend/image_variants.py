@@ -0,0 +1,133 @@
+"""
+Variantes redimensionadas de imágenes (miniaturas WebP)
+Las variantes se generan la primera vez que se piden (/api/files/{nombre}?w=256)
+en un pool de procesos, para que Pillow no bloquee el event loop, y se guardan
+en el almacenamiento junto al original bajo variants/{ancho}/{clave}.webp.
+Se eliminan junto con el original (ver delete_storage_keys en server.py).
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+import asyncio
+import io
+import multiprocessing
+
+VARIANT_PREFIX = "variants/"
+VARIANT_FORMAT = "WEBP"
+VARIANT_EXTENSION = ".webp"
+VARIANT_MEDIA_TYPE = "image/webp"
+# Extensiones que Pillow puede leer para generar variantes
+VARIANT_SOURCE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff']
+
+def variant_key(key: str, width: int) -> str:
+    """Clave de almacenamiento de una variante"""
+    return f"{VARIANT_PREFIX}{width}/{key}{VARIANT_EXTENSION}"
+
+def variant_keys(key: str, widths) -> List[str]:
+    """Claves de todas las variantes posibles de un archivo"""
+    if key.startswith(VARIANT_PREFIX):
+        return []
+    return [variant_key(key, width) for width in widths]
+
+def variant_source_key(key: str) -> Optional[str]:
+    """Clave del original de una variante (None si la clave no es una variante)"""
+    if not key.startswith(VARIANT_PREFIX) or not key.endswith(VARIANT_EXTENSION):
+        return None
+    width, _, source = key[len(VARIANT_PREFIX):].partition('/')
+    if not width.isdigit() or not source:
+        return None
+    return source[:-len(VARIANT_EXTENSION)]
+
+def variant_filename(filename: str) -> str:
+    """Nombre con el que se descarga la variante (foto.jpg -> foto.webp)"""
+    return str(Path(filename).with_suffix(VARIANT_EXTENSION))
+
+def is_variant_source(filename: str) -> bool:
+    """Indica si se pueden generar variantes de este archivo"""
+    return Path(filename).suffix.lower() in VARIANT_SOURCE_EXTENSIONS
+
+def render_variant(data: bytes, width: int, quality: int = 80) -> bytes:
+    """
+    Redimensiona una imagen al ancho indicado (sin agrandarla) y la convierte a WebP.
+    Se ejecuta en un proceso del pool.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft('RGB', (width, width))  # JPEG: decodificar ya reducida
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            has_alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+        if image.width > width:
+            height = max(round(image.height * width / image.width), 1)
+            image = image.resize((width, height), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, VARIANT_FORMAT, quality=quality, method=4)
+    return output.getvalue()
+
+class VariantGenerator:
+    """Genera variantes en un pool de procesos, una sola vez por variante"""
+
+    def __init__(self, max_workers: int = 2, quality: int = 80):
+        self.max_workers = max_workers
+        self.quality = quality
+        self._pool = None
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.generated = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: el servidor tiene hilos (worker de eliminación, threadpool)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    async def generate(
+        self,
+        key: str,
+        width: int,
+        load_source: Callable[[], Awaitable[bytes]],
+        store: Callable[[bytes], Awaitable[None]]
+    ) -> bytes:
+        """
+        Genera y guarda la variante con clave `key`. Si ya se está generando
+        en este proceso, espera ese resultado en lugar de repetir el trabajo.
+        """
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._in_flight[key] = future
+        try:
+            source = await load_source()
+            data = await loop.run_in_executor(
+                self._get_pool(), render_variant, source, width, self.quality
+            )
+            await store(data)
+            self.generated += 1
+            future.set_result(data)
+            return data
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # Un proceso murió (p. ej. sin memoria): el próximo pedido crea otro pool
+                self.shutdown()
+            future.set_exception(e)
+            # Evitar el aviso de "exception was never retrieved" si nadie esperaba
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
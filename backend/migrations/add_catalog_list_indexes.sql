@@ -0,0 +1,10 @@
+-- Índices para ordenar y paginar por cursor los listados de catálogos
+-- (las columnas id_base / id_muestra_base ya tienen índice por sus claves foráneas)
+-- Ejecutar en la base de datos MariaDB/MySQL
+
+CREATE INDEX IF NOT EXISTS idx_nombre_tela ON x_tela_desarrollo (nombre_tela);
+CREATE INDEX IF NOT EXISTS idx_nombre_entalle ON x_entalle_desarrollo (nombre_entalle);
+CREATE INDEX IF NOT EXISTS idx_nombre_tipo ON x_tipo_producto (nombre_tipo);
+CREATE INDEX IF NOT EXISTS idx_nombre_marca ON x_marca (nombre_marca);
+CREATE INDEX IF NOT EXISTS idx_modelo ON x_base (modelo);
+CREATE INDEX IF NOT EXISTS idx_nombre_ficha ON x_ficha (nombre_ficha);
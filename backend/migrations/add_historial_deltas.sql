@@ -0,0 +1,12 @@
+-- Historial con solo los campos modificados en las ediciones
+-- datos_completos = 1 marca los movimientos con el registro entero (altas,
+-- bajas, puntos de control periódicos y todos los movimientos anteriores a
+-- este cambio); las demás ediciones guardan solo las columnas que cambiaron.
+-- El índice sirve para reconstruir el estado de un registro y para decidir
+-- cuándo guardar un punto de control.
+-- Ejecutar en la base de datos MariaDB/MySQL
+
+ALTER TABLE x_historial_movimiento
+    ADD COLUMN IF NOT EXISTS datos_completos TINYINT(1) NOT NULL DEFAULT 1;
+
+CREATE INDEX IF NOT EXISTS idx_registro ON x_historial_movimiento (tabla, id_registro, id_movimiento);
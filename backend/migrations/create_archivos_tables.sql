@@ -0,0 +1,22 @@
+-- Script para crear las tablas de almacenamiento deduplicado de archivos
+-- Cada contenido se guarda una sola vez (por su SHA-256) y los nombres
+-- uuid_nombreoriginal.ext son alias que apuntan a él.
+-- Ejecutar en la base de datos MariaDB/MySQL
+
+CREATE TABLE IF NOT EXISTS x_archivo_contenido (
+    sha256 CHAR(64) PRIMARY KEY,
+    storage_key VARCHAR(500) NOT NULL,
+    tamano BIGINT NOT NULL,
+    content_type VARCHAR(255),
+    ref_count INT NOT NULL DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS x_archivo_alias (
+    nombre VARCHAR(500) PRIMARY KEY,
+    sha256 CHAR(64) NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    
+    FOREIGN KEY (sha256) REFERENCES x_archivo_contenido(sha256),
+    INDEX idx_sha256 (sha256)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
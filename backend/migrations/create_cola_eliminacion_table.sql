@@ -0,0 +1,17 @@
+-- Script para crear la cola de eliminación de archivos en segundo plano
+-- Los handlers encolan aquí las claves a borrar y un worker las elimina de R2
+-- Ejecutar en la base de datos MariaDB/MySQL
+
+CREATE TABLE IF NOT EXISTS x_cola_eliminacion (
+    id_eliminacion INT AUTO_INCREMENT PRIMARY KEY,
+    storage_key VARCHAR(500) NOT NULL,
+    sha256 CHAR(64) NULL,
+    intentos INT NOT NULL DEFAULT 0,
+    proximo_intento DATETIME NOT NULL,
+    token VARCHAR(36) NULL,
+    ultimo_error TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    
+    INDEX idx_proximo_intento (proximo_intento),
+    INDEX idx_token (token)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -0,0 +1,27 @@
+-- Script para crear las tablas del recolector de archivos huérfanos
+-- x_gc_estado guarda el punto de avance de cada recorrido (para retomarlo)
+-- y x_gc_cuarentena los archivos sin referencias que se eliminarán más adelante
+-- Ejecutar en la base de datos MariaDB/MySQL
+
+CREATE TABLE IF NOT EXISTS x_gc_estado (
+    fase VARCHAR(20) PRIMARY KEY,
+    cursor VARCHAR(500) NULL,
+    ciclos INT NOT NULL DEFAULT 0,
+    revisados BIGINT NOT NULL DEFAULT 0,
+    en_cuarentena BIGINT NOT NULL DEFAULT 0,
+    ciclo_inicio DATETIME NULL,
+    actualizado DATETIME NULL,
+    token VARCHAR(36) NULL,
+    lease_hasta DATETIME NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS x_gc_cuarentena (
+    id_cuarentena INT AUTO_INCREMENT PRIMARY KEY,
+    tipo VARCHAR(20) NOT NULL,
+    clave VARCHAR(500) NOT NULL,
+    detectado DATETIME DEFAULT CURRENT_TIMESTAMP,
+    eliminar_despues DATETIME NOT NULL,
+    
+    UNIQUE KEY uq_tipo_clave (tipo, clave),
+    INDEX idx_eliminar_despues (eliminar_despues)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -0,0 +1,19 @@
+-- Script para crear la tabla de meses archivados del historial
+-- Los movimientos más antiguos que HISTORIAL_HOT_MONTHS se pasan a archivos
+-- historial-YYYY-MM.jsonl.gz (HISTORIAL_ARCHIVE_DIR) y se borran de
+-- x_historial_movimiento, que queda con los meses recientes. Cada fila
+-- indica qué movimientos de un mes están en su archivo.
+-- Ejecutar en la base de datos MariaDB/MySQL
+
+CREATE TABLE IF NOT EXISTS x_historial_archivo (
+    mes CHAR(7) PRIMARY KEY,
+    archivo VARCHAR(255) NULL,
+    filas INT NOT NULL DEFAULT 0,
+    bytes BIGINT NOT NULL DEFAULT 0,
+    desde_id INT NULL,
+    hasta_id INT NULL,
+    archivado DATETIME NULL,
+    completado DATETIME NULL,
+    token VARCHAR(36) NULL,
+    lease_hasta DATETIME NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -0,0 +1,32 @@
+-- Script para crear las tablas de subidas reanudables por partes
+-- Cada sesión guarda las partes recibidas para poder retomar la subida
+-- después de un corte; las sesiones abandonadas vencen y se limpian solas
+-- Ejecutar en la base de datos MariaDB/MySQL
+
+CREATE TABLE IF NOT EXISTS x_subida_sesion (
+    id_sesion VARCHAR(36) PRIMARY KEY,
+    id_usuario INT NOT NULL,
+    nombre_original VARCHAR(500) NOT NULL,
+    content_type VARCHAR(255),
+    tamano BIGINT NOT NULL,
+    tamano_parte INT NOT NULL,
+    total_partes INT NOT NULL,
+    storage_key VARCHAR(500) NOT NULL,
+    upload_id VARCHAR(255) NOT NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'activa',
+    expira DATETIME NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    
+    FOREIGN KEY (id_usuario) REFERENCES x_usuario(id_usuario) ON DELETE CASCADE,
+    INDEX idx_expira (expira)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE IF NOT EXISTS x_subida_parte (
+    id_sesion VARCHAR(36) NOT NULL,
+    numero INT NOT NULL,
+    tamano INT NOT NULL,
+    etag VARCHAR(255) NOT NULL,
+    
+    PRIMARY KEY (id_sesion, numero),
+    FOREIGN KEY (id_sesion) REFERENCES x_subida_sesion(id_sesion) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -0,0 +1,21 @@
+-- Script para crear la tabla de versiones por tabla
+-- Cada alta, edición o baja aumenta la versión de la tabla en la misma
+-- transacción; los procesos comparan esta versión para saber si sus datos
+-- en memoria siguen vigentes
+-- Ejecutar en la base de datos MariaDB/MySQL
+
+CREATE TABLE IF NOT EXISTS x_version_tabla (
+    tabla VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    actualizado DATETIME NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+INSERT IGNORE INTO x_version_tabla (tabla, version) VALUES
+    ('telas', 0),
+    ('marcas', 0),
+    ('entalles', 0),
+    ('tipos_producto', 0),
+    ('muestras_base', 0),
+    ('bases', 0),
+    ('tizados', 0),
+    ('fichas', 0);
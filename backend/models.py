@@ -1,8 +1,9 @@
-from sqlalchemy import Column, Integer, String, Numeric, Boolean, ForeignKey, Text, Enum, DateTime, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, Numeric, Boolean, ForeignKey, Text, Enum, DateTime, JSON, event
 from sqlalchemy.orm import relationship
 from database import Base
 import enum
 from datetime import datetime, timezone
+from decimal import Decimal, ROUND_HALF_UP
 
 class RolEnum(str, enum.Enum):
     super_admin = "super_admin"
@@ -33,6 +34,7 @@ class HistorialMovimiento(Base):
     descripcion = Column(Text)  # Descripción legible de la acción
     datos_anteriores = Column(JSON, nullable=True)  # Valores antes del cambio
     datos_nuevos = Column(JSON, nullable=True)  # Valores después del cambio
+    datos_completos = Column(Boolean, nullable=False, default=True)  # False: solo las columnas que cambiaron
     ip_address = Column(String(50), nullable=True)
     user_agent = Column(String(500), nullable=True)
     
@@ -118,7 +120,7 @@ class Tela(Base):
     __tablename__ = 'x_tela_desarrollo'
     
     id_tela = Column(Integer, primary_key=True, autoincrement=True)
-    nombre_tela = Column(String(255), nullable=False)
+    nombre_tela = Column(String(255), nullable=False, index=True)
     gramaje = Column(Numeric(10, 2))
     elasticidad = Column(String(100))
     proveedor = Column(String(255))
@@ -133,7 +135,7 @@ class Marca(Base):
     __tablename__ = 'x_marca'
     
     id_marca = Column(Integer, primary_key=True, autoincrement=True)
-    nombre_marca = Column(String(255), nullable=False)
+    nombre_marca = Column(String(255), nullable=False, index=True)
     
     muestras_base = relationship('MuestraBase', back_populates='marca')
 
@@ -141,7 +143,7 @@ class Entalle(Base):
     __tablename__ = 'x_entalle_desarrollo'
     
     id_entalle = Column(Integer, primary_key=True, autoincrement=True)
-    nombre_entalle = Column(String(255), nullable=False)
+    nombre_entalle = Column(String(255), nullable=False, index=True)
     
     muestras_base = relationship('MuestraBase', back_populates='entalle')
 
@@ -149,7 +151,7 @@ class TipoProducto(Base):
     __tablename__ = 'x_tipo_producto'
     
     id_tipo = Column(Integer, primary_key=True, autoincrement=True)
-    nombre_tipo = Column(String(255), nullable=False)
+    nombre_tipo = Column(String(255), nullable=False, index=True)
     
     muestras_base = relationship('MuestraBase', back_populates='tipo_producto')
 
@@ -178,7 +180,7 @@ class BaseModel(Base):
     
     id_base = Column(Integer, primary_key=True, autoincrement=True)
     id_muestra_base = Column(Integer, ForeignKey('x_muestra_base.id_muestra_base'), nullable=False)
-    modelo = Column(String(255))
+    modelo = Column(String(255), index=True)
     patron = Column(String(500))
     imagen = Column(String(500))
     aprobado = Column(Boolean, default=False)
@@ -194,7 +196,7 @@ class Ficha(Base):
     
     id_ficha = Column(Integer, primary_key=True, autoincrement=True)
     id_base = Column(Integer, ForeignKey('x_base.id_base'), nullable=False)
-    nombre_ficha = Column(String(255))
+    nombre_ficha = Column(String(255), index=True)
     archivo = Column(String(500))
     
     base = relationship('BaseModel', back_populates='fichas')
@@ -208,4 +210,125 @@ class Tizado(Base):
     archivo_tizado = Column(String(500))
     curva = Column(Text)
     
-    base = relationship('BaseModel', back_populates='tizados')
\ No newline at end of file
+    base = relationship('BaseModel', back_populates='tizados')
+
+class ArchivoContenido(Base):
+    __tablename__ = 'x_archivo_contenido'
+    
+    sha256 = Column(String(64), primary_key=True)  # Hash del contenido
+    storage_key = Column(String(500), nullable=False)  # Clave en R2 o ruta en uploads/
+    tamano = Column(BigInteger, nullable=False)
+    content_type = Column(String(255))
+    ref_count = Column(Integer, nullable=False, default=0)  # Cantidad de alias que lo usan
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    aliases = relationship('ArchivoAlias', back_populates='contenido')
+
+class ArchivoAlias(Base):
+    __tablename__ = 'x_archivo_alias'
+    
+    nombre = Column(String(500), primary_key=True)  # Nombre guardado: uuid_nombreoriginal.ext
+    sha256 = Column(String(64), ForeignKey('x_archivo_contenido.sha256'), nullable=False, index=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    contenido = relationship('ArchivoContenido', back_populates='aliases')
+
+class EliminacionPendiente(Base):
+    __tablename__ = 'x_cola_eliminacion'
+    
+    id_eliminacion = Column(Integer, primary_key=True, autoincrement=True)
+    storage_key = Column(String(500), nullable=False)  # Clave en R2 o ruta en uploads/
+    sha256 = Column(String(64), nullable=True)  # Contenido deduplicado (se verifica que siga sin referencias)
+    intentos = Column(Integer, nullable=False, default=0)
+    proximo_intento = Column(DateTime, nullable=False, index=True)
+    token = Column(String(36), nullable=True, index=True)  # Lote del worker que la tomó
+    ultimo_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+class EstadoGC(Base):
+    __tablename__ = 'x_gc_estado'
+    
+    fase = Column(String(20), primary_key=True)  # objetos | alias
+    cursor = Column(String(500), nullable=True)  # Última clave revisada (None = inicio de un ciclo)
+    ciclos = Column(Integer, nullable=False, default=0)  # Recorridos completos terminados
+    revisados = Column(BigInteger, nullable=False, default=0)
+    en_cuarentena = Column(BigInteger, nullable=False, default=0)
+    ciclo_inicio = Column(DateTime, nullable=True)
+    actualizado = Column(DateTime, nullable=True)
+    token = Column(String(36), nullable=True)  # Proceso que está recorriendo esta fase
+    lease_hasta = Column(DateTime, nullable=True)
+
+class CuarentenaArchivo(Base):
+    __tablename__ = 'x_gc_cuarentena'
+    
+    id_cuarentena = Column(Integer, primary_key=True, autoincrement=True)
+    tipo = Column(String(20), nullable=False)  # objeto (clave del almacenamiento) | alias
+    clave = Column(String(500), nullable=False)
+    detectado = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    eliminar_despues = Column(DateTime, nullable=False, index=True)
+
+class SubidaSesion(Base):
+    __tablename__ = 'x_subida_sesion'
+    
+    id_sesion = Column(String(36), primary_key=True)
+    id_usuario = Column(Integer, ForeignKey('x_usuario.id_usuario', ondelete='CASCADE'), nullable=False)
+    nombre_original = Column(String(500), nullable=False)
+    content_type = Column(String(255))
+    tamano = Column(BigInteger, nullable=False)  # Tamaño total declarado al crear la sesión
+    tamano_parte = Column(Integer, nullable=False)
+    total_partes = Column(Integer, nullable=False)
+    storage_key = Column(String(500), nullable=False)  # Clave temporal donde se unen las partes
+    upload_id = Column(String(255), nullable=False)  # Id de la subida por partes en el almacenamiento
+    estado = Column(String(20), nullable=False, default='activa')  # activa | finalizando
+    expira = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    partes = relationship('SubidaParte', cascade='all, delete-orphan', order_by='SubidaParte.numero')
+
+class SubidaParte(Base):
+    __tablename__ = 'x_subida_parte'
+    
+    id_sesion = Column(String(36), ForeignKey('x_subida_sesion.id_sesion', ondelete='CASCADE'), primary_key=True)
+    numero = Column(Integer, primary_key=True)  # Desde 0
+    tamano = Column(Integer, nullable=False)
+    etag = Column(String(255), nullable=False)
+
+class VersionTabla(Base):
+    __tablename__ = 'x_version_tabla'
+    
+    tabla = Column(String(50), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)  # Aumenta con cada alta, edición o baja
+    actualizado = Column(DateTime, nullable=True)
+
+class HistorialArchivo(Base):
+    __tablename__ = 'x_historial_archivo'
+    
+    mes = Column(String(7), primary_key=True)  # YYYY-MM
+    archivo = Column(String(255), nullable=True)  # historial-YYYY-MM.jsonl.gz en HISTORIAL_ARCHIVE_DIR
+    filas = Column(Integer, nullable=False, default=0)
+    bytes = Column(BigInteger, nullable=False, default=0)
+    desde_id = Column(Integer, nullable=True)
+    hasta_id = Column(Integer, nullable=True)  # Los movimientos del mes hasta este id están en el archivo
+    archivado = Column(DateTime, nullable=True)  # Archivo escrito
+    completado = Column(DateTime, nullable=True)  # Movimientos borrados de x_historial_movimiento
+    token = Column(String(36), nullable=True)  # Proceso que está archivando el mes
+    lease_hasta = Column(DateTime, nullable=True)
+
+def numeric_quantizer(scale: int):
+    """Listener "set" que redondea el valor a la escala de la columna (como MariaDB al guardarlo)"""
+    exponent = Decimal(1).scaleb(-scale)
+
+    def quantize(target, value, oldvalue, initiator):
+        if value is None:
+            return value
+        if not isinstance(value, Decimal):
+            value = Decimal(str(value))
+        return value.quantize(exponent, rounding=ROUND_HALF_UP)
+    return quantize
+
+# Los Numeric se redondean al asignarlos: la respuesta y el historial muestran
+# el valor que queda guardado (12.345 -> 12.35) sin tener que refrescar la fila
+for _mapper in list(Base.registry.mappers):
+    for _column in _mapper.class_.__table__.columns:
+        if isinstance(_column.type, Numeric) and _column.type.scale is not None:
+            event.listen(getattr(_mapper.class_, _column.key), "set", numeric_quantizer(_column.type.scale), retval=True)
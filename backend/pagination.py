@@ -0,0 +1,141 @@
+"""
+Paginación por cursor (keyset), orden y búsqueda para los listados
+Los parámetros son opcionales: sin ellos los endpoints siguen devolviendo la
+lista completa. Con `limit` se devuelve una página y el cursor de la
+siguiente va en el header X-Next-Cursor. La página siguiente se busca con
+WHERE (orden, id) > (último valor, último id) sobre columnas indexadas, así
+el costo no crece con el número de página como con OFFSET. El total
+(X-Total-Count) solo se calcula si se pide con include_total=true.
+"""
+from fastapi import HTTPException, Query, Response
+from sqlalchemy import Select, and_, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Query as OrmQuery
+from decimal import Decimal
+from typing import Dict, List, NamedTuple, Optional
+import base64
+import json
+
+MAX_PAGE_SIZE = 500
+
+class ListParams(NamedTuple):
+    limit: Optional[int] = None
+    cursor: Optional[str] = None
+    sort: Optional[str] = None
+    q: Optional[str] = None
+    include_total: bool = False
+
+def list_params(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Tamaño de página"),
+    cursor: Optional[str] = Query(None, description="Cursor de la página siguiente (header X-Next-Cursor)"),
+    sort: Optional[str] = Query(None, description="Columna de orden; con '-' delante es descendente"),
+    q: Optional[str] = Query(None, min_length=1, max_length=100, description="Texto a buscar"),
+    include_total: bool = Query(False, description="Calcular el total (header X-Total-Count)")
+) -> ListParams:
+    return ListParams(limit, cursor, sort, q, include_total)
+
+class ListSpec(NamedTuple):
+    """Columnas por las que se puede ordenar (indexadas) y en las que busca `q`"""
+    pk: object
+    sort_columns: Dict[str, object]
+    search_columns: List[object]
+
+def encode_cursor(sort: str, value, pk) -> str:
+    if isinstance(value, Decimal):
+        value = str(value)
+    raw = json.dumps({"s": sort, "v": value, "id": pk}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        value, pk = data["v"], data["id"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    if data.get("s") != sort:
+        raise HTTPException(status_code=400, detail="El cursor corresponde a otro orden")
+    return value, pk
+
+def parse_sort(spec: ListSpec, sort: Optional[str]) -> tuple:
+    """(nombre normalizado, columna, descendente)"""
+    pk_name = spec.pk.key
+    sort = sort or pk_name
+    descending = sort.startswith("-")
+    name = sort.lstrip("-")
+    if name == pk_name:
+        return sort, spec.pk, descending
+    column = spec.sort_columns.get(name)
+    if column is None:
+        permitidas = ", ".join([pk_name, *spec.sort_columns])
+        raise HTTPException(status_code=400, detail=f"No se puede ordenar por '{name}'. Columnas: {permitidas}")
+    return sort, column, descending
+
+def sort_column_key(spec: ListSpec, params: ListParams) -> str:
+    """Atributo de la columna de orden (para cargarlo aunque no se pida en fields=)"""
+    return parse_sort(spec, params.sort)[1].key
+
+def seek_condition(column, pk, value, last_pk, descending: bool):
+    """Filas posteriores a (value, last_pk) en el orden (column, pk); los NULL van primero en ASC"""
+    if column is pk:
+        return pk < last_pk if descending else pk > last_pk
+    if descending:
+        if value is None:
+            return and_(column.is_(None), pk < last_pk)
+        return or_(column < value, and_(column == value, pk < last_pk), column.is_(None))
+    if value is None:
+        return or_(and_(column.is_(None), pk > last_pk), column.isnot(None))
+    return or_(column > value, and_(column == value, pk > last_pk))
+
+def search_condition(spec: ListSpec, q: str):
+    pattern = "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    return or_(*[column.ilike(pattern, escape="\\") for column in spec.search_columns])
+
+def filter_search(query, spec: ListSpec, params: ListParams):
+    if params.q and spec.search_columns:
+        query = query.filter(search_condition(spec, params.q))
+    return query
+
+def order_and_seek(query, spec: ListSpec, params: ListParams) -> tuple:
+    """Orden y posición del cursor (sirve igual para Query y para select()); (query, sort, columna)"""
+    sort, column, descending = parse_sort(spec, params.sort)
+    if params.cursor:
+        value, last_pk = decode_cursor(params.cursor, sort)
+        query = query.filter(seek_condition(column, spec.pk, value, last_pk, descending))
+    order = [column.desc() if descending else column.asc()]
+    if column is not spec.pk:
+        order.append(spec.pk.desc() if descending else spec.pk.asc())
+    query = query.order_by(*order)
+    if params.limit is not None:
+        # Se pide una fila de más para saber si hay página siguiente
+        query = query.limit(params.limit + 1)
+    return query, sort, column
+
+def finish_page(rows: list, spec: ListSpec, params: ListParams, sort: str, column, response: Response) -> list:
+    if params.limit is None or len(rows) <= params.limit:
+        return rows
+    rows = rows[:params.limit]
+    last = rows[-1]
+    response.headers["X-Next-Cursor"] = encode_cursor(
+        sort, getattr(last, column.key), getattr(last, spec.pk.key)
+    )
+    return rows
+
+def apply_list_params(query: OrmQuery, spec: ListSpec, params: ListParams, response: Response) -> list:
+    """Aplica búsqueda, orden y página a la consulta; deja los headers de paginación en response"""
+    query = filter_search(query, spec, params)
+    if params.include_total:
+        response.headers["X-Total-Count"] = str(query.order_by(None).count())
+    query, sort, column = order_and_seek(query, spec, params)
+    return finish_page(query.all(), spec, params, sort, column, response)
+
+async def apply_list_params_async(db: AsyncSession, stmt: Select, spec: ListSpec, params: ListParams,
+                                  response: Response) -> list:
+    """Igual que apply_list_params para un select() con AsyncSession"""
+    stmt = filter_search(stmt, spec, params)
+    if params.include_total:
+        total = await db.scalar(select(func.count()).select_from(stmt.order_by(None).subquery()))
+        response.headers["X-Total-Count"] = str(total)
+    stmt, sort, column = order_and_seek(stmt, spec, params)
+    rows = (await db.scalars(stmt)).unique().all()
+    return finish_page(list(rows), spec, params, sort, column, response)
@@ -0,0 +1,174 @@
+"""
+Subidas reanudables por partes
+Para archivos grandes (patrones y tizados de CAD) el cliente crea una sesión,
+sube las partes con PUT (en cualquier orden, y puede repetirlas), consulta
+qué partes ya llegaron para retomar después de un corte y al final confirma
+la subida. Las partes se guardan como partes de una subida multipart de R2
+(o en uploads/.multipart/ en modo local) bajo una clave temporal.
+
+Las sesiones vencen si no reciben partes durante UPLOAD_SESSION_TTL_HOURS;
+UploadSessionReaper descarta sus partes y las elimina.
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import update
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional
+import threading
+
+from models import SubidaSesion, SubidaParte
+
+STAGING_PREFIX = "staging/"
+MAX_PARTS = 10000  # Límite de partes de una subida multipart de S3/R2
+ESTADO_ACTIVA = "activa"
+ESTADO_FINALIZANDO = "finalizando"
+FINALIZE_LEASE_SECONDS = 900  # Una finalización interrumpida se puede reintentar después de este tiempo
+
+def staging_key(id_sesion: str) -> str:
+    """Clave temporal donde se unen las partes antes de mover el archivo a su clave final"""
+    return f"{STAGING_PREFIX}{id_sesion}"
+
+def part_count(size: int, part_size: int) -> int:
+    return max((size + part_size - 1) // part_size, 1)
+
+def expected_part_size(sesion: SubidaSesion, numero: int) -> int:
+    """Tamaño que debe tener la parte `numero` (todas iguales salvo la última)"""
+    if numero < sesion.total_partes - 1:
+        return sesion.tamano_parte
+    return sesion.tamano - sesion.tamano_parte * (sesion.total_partes - 1)
+
+def received_parts(sesion: SubidaSesion) -> List[int]:
+    return [parte.numero for parte in sesion.partes]
+
+def missing_parts(sesion: SubidaSesion) -> List[int]:
+    recibidas = set(received_parts(sesion))
+    return [n for n in range(sesion.total_partes) if n not in recibidas]
+
+def contiguous_offset(sesion: SubidaSesion) -> int:
+    """Bytes recibidos sin huecos desde el inicio (para clientes que suben en orden)"""
+    offset = 0
+    for numero, parte in enumerate(sesion.partes):
+        if parte.numero != numero:
+            break
+        offset += parte.tamano
+    return offset
+
+def session_status(sesion: SubidaSesion) -> dict:
+    return {
+        "upload_id": sesion.id_sesion,
+        "filename": sesion.nombre_original,
+        "size": sesion.tamano,
+        "chunk_size": sesion.tamano_parte,
+        "total_chunks": sesion.total_partes,
+        "received_chunks": received_parts(sesion),
+        "offset": contiguous_offset(sesion),
+        "expires_at": sesion.expira,
+        "estado": sesion.estado
+    }
+
+def get_session(db: Session, id_sesion: str, id_usuario: int) -> Optional[SubidaSesion]:
+    """Sesión del usuario (None si no existe, venció o es de otro usuario)"""
+    sesion = db.query(SubidaSesion).filter(
+        SubidaSesion.id_sesion == id_sesion,
+        SubidaSesion.id_usuario == id_usuario
+    ).first()
+    if sesion is None or sesion.expira.replace(tzinfo=timezone.utc) <= datetime.now(timezone.utc):
+        return None
+    return sesion
+
+def count_active_sessions(db: Session, id_usuario: int) -> int:
+    return db.query(SubidaSesion).filter(
+        SubidaSesion.id_usuario == id_usuario,
+        SubidaSesion.expira > datetime.now(timezone.utc)
+    ).count()
+
+def record_part(db: Session, sesion: SubidaSesion, numero: int, tamano: int, etag: str, ttl: timedelta):
+    """Registra una parte recibida (o la reemplaza) y extiende el vencimiento de la sesión"""
+    db.merge(SubidaParte(id_sesion=sesion.id_sesion, numero=numero, tamano=tamano, etag=etag))
+    sesion.expira = datetime.now(timezone.utc) + ttl
+    db.commit()
+    db.refresh(sesion)
+
+def claim_finalize(db: Session, id_sesion: str) -> bool:
+    """Marca la sesión como finalizando; False si otra petición ya la está finalizando"""
+    now = datetime.now(timezone.utc)
+    result = db.execute(
+        update(SubidaSesion)
+        .where(SubidaSesion.id_sesion == id_sesion, SubidaSesion.estado == ESTADO_ACTIVA)
+        .values(estado=ESTADO_FINALIZANDO, expira=now + timedelta(seconds=FINALIZE_LEASE_SECONDS))
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+def release_finalize(db: Session, id_sesion: str, ttl: timedelta):
+    """Vuelve a dejar la sesión activa después de una finalización fallida"""
+    db.rollback()
+    db.execute(
+        update(SubidaSesion)
+        .where(SubidaSesion.id_sesion == id_sesion)
+        .values(estado=ESTADO_ACTIVA, expira=datetime.now(timezone.utc) + ttl)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+def expire_sessions(db: Session, discard: Callable[[str, str], None], limit: int = 100) -> int:
+    """
+    Elimina las sesiones vencidas. discard(storage_key, upload_id) descarta
+    las partes y la clave temporal en el almacenamiento.
+    """
+    vencidas = db.query(SubidaSesion)\
+        .filter(SubidaSesion.expira <= datetime.now(timezone.utc))\
+        .order_by(SubidaSesion.expira)\
+        .limit(limit)\
+        .all()
+    eliminadas = 0
+    for sesion in vencidas:
+        try:
+            discard(sesion.storage_key, sesion.upload_id)
+        except Exception as e:
+            # Se reintenta en la próxima pasada
+            print(f"⚠️ No se pudo descartar la subida {sesion.id_sesion}: {e}")
+            continue
+        db.delete(sesion)
+        db.commit()
+        eliminadas += 1
+    return eliminadas
+
+class UploadSessionReaper:
+    """Hilo del proceso que limpia las subidas abandonadas"""
+
+    def __init__(self, session_factory, discard: Callable[[str, str], None], interval: float = 900.0):
+        self.session_factory = session_factory
+        self.discard = discard
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="upload-session-reaper", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def run_once(self) -> int:
+        db = self.session_factory()
+        try:
+            return expire_sessions(db, self.discard)
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ Error limpiando subidas vencidas: {e}")
+            return 0
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            eliminadas = self.run_once()
+            if eliminadas:
+                print(f"🧹 Subidas abandonadas eliminadas: {eliminadas}")
@@ -31,6 +31,7 @@ class HistorialBase(BaseModel):
     descripcion: Optional[str] = None
     datos_anteriores: Optional[dict] = None
     datos_nuevos: Optional[dict] = None
+    datos_completos: bool = True
 
 class HistorialSchema(HistorialBase):
     model_config = ConfigDict(from_attributes=True)
@@ -139,6 +140,13 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     username: Optional[str] = None
 
+# ==================== UPLOAD SCHEMAS ====================
+
+class SubidaCreate(BaseModel):
+    filename: str
+    size: int
+    content_type: Optional[str] = None
+
 # ==================== EXISTING SCHEMAS ====================
 
 class TelaBase(BaseModel):
@@ -0,0 +1,353 @@
+"""
+Índice de búsqueda en memoria del catálogo de desarrollo
+Índice invertido (palabra -> documentos) más un índice de trigramas sobre
+el vocabulario para encontrar palabras mal escritas. Cada tipo de entidad
+(tela, base, tizado, ...) guarda la versión de su tabla (x_version_tabla):
+antes de buscar se comparan las versiones y solo se reconstruye el tipo que
+cambió en otro proceso. Los cambios hechos en este proceso se aplican al
+índice al confirmar el commit, sin reconstruir.
+
+Puntaje por término: palabra exacta 3, prefijo 2, parecida (trigramas)
+entre 0 y 1, multiplicado por el peso del campo (el primero, el nombre,
+pesa el doble). Todos los términos de la búsqueda tienen que aparecer.
+
+Benchmark con un catálogo sintético:
+
+    python search_index.py [filas]
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy import event
+from bisect import bisect_left, insort
+from collections import defaultdict
+from itertools import chain
+from operator import itemgetter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+import heapq
+import re
+import threading
+import time
+import unicodedata
+
+from table_versions import get_versions
+
+PENDING_KEY = "busqueda_pendiente"
+MAX_PREFIX_WORDS = 200  # Palabras del vocabulario que se expanden por prefijo
+TITLE_WEIGHT = 1.0
+FIELD_WEIGHT = 0.5
+
+DocKey = Tuple[str, int]
+
+class SearchSource(NamedTuple):
+    """Entidad indexada; el primer campo es el título del resultado"""
+    tipo: str
+    tabla: str  # Nombre de la versión en x_version_tabla
+    model: object
+    fields: Tuple[str, ...]
+
+def normalize(text: str) -> str:
+    """Minúsculas y sin acentos"""
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c)).lower()
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return re.findall(r"[a-z0-9]+", normalize(str(text)))
+
+def trigrams(word: str) -> Set[str]:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class SearchIndex:
+    def __init__(self, sources: Iterable[SearchSource], min_similarity: float = 0.4):
+        self.sources = {source.tipo: source for source in sources}
+        self._by_table = {source.model.__table__.name: source for source in self.sources.values()
+                          if source.model is not None}
+        self.min_similarity = min_similarity
+        self.versions: Dict[str, Optional[int]] = {}  # tabla -> versión indexada
+        self._docs: Dict[DocKey, Dict[str, str]] = {}
+        self._doc_tokens: Dict[DocKey, Dict[str, float]] = {}
+        self._postings: Dict[str, Dict[DocKey, float]] = {}
+        self._trigrams: Dict[str, Set[str]] = defaultdict(set)
+        self._vocab: List[str] = []  # Ordenado, para buscar por prefijo
+        self._lock = threading.RLock()
+        self.rebuilds = 0
+        self.last_rebuild_seconds = 0.0
+
+    # Documentos
+
+    def add(self, tipo: str, id_: int, values: Dict[str, Optional[str]]):
+        source = self.sources[tipo]
+        key = (tipo, id_)
+        tokens: Dict[str, float] = {}
+        for position, field in enumerate(source.fields):
+            weight = TITLE_WEIGHT if position == 0 else FIELD_WEIGHT
+            for token in tokenize(values.get(field)):
+                tokens[token] = max(tokens.get(token, 0), weight)
+        with self._lock:
+            self.remove(tipo, id_)
+            self._docs[key] = {field: values.get(field) for field in source.fields}
+            self._doc_tokens[key] = tokens
+            for token, weight in tokens.items():
+                docs = self._postings.get(token)
+                if docs is None:
+                    docs = self._postings[token] = {}
+                    insort(self._vocab, token)
+                    for trigram in trigrams(token):
+                        self._trigrams[trigram].add(token)
+                docs[key] = weight
+
+    def remove(self, tipo: str, id_: int):
+        key = (tipo, id_)
+        with self._lock:
+            self._docs.pop(key, None)
+            for token in self._doc_tokens.pop(key, {}):
+                docs = self._postings[token]
+                docs.pop(key, None)
+                if docs:
+                    continue
+                del self._postings[token]
+                del self._vocab[bisect_left(self._vocab, token)]
+                for trigram in trigrams(token):
+                    words = self._trigrams[trigram]
+                    words.discard(token)
+                    if not words:
+                        del self._trigrams[trigram]
+
+    def clear(self, tipo: str):
+        with self._lock:
+            for key in [key for key in self._docs if key[0] == tipo]:
+                self.remove(*key)
+
+    # Sincronización con la base de datos
+
+    def load(self, db: Session, source: SearchSource, version: Optional[int]):
+        """Reconstruye los documentos de un tipo desde la tabla"""
+        pk = source.model.__mapper__.primary_key[0]
+        columns = [getattr(source.model, field) for field in source.fields]
+        rows = db.query(pk, *columns).all()
+        with self._lock:
+            self.clear(source.tipo)
+            for row in rows:
+                self.add(source.tipo, row[0], dict(zip(source.fields, row[1:])))
+            self.versions[source.tabla] = version
+
+    def refresh(self, db: Session) -> List[str]:
+        """Reconstruye los tipos cuya tabla cambió desde la última carga; devuelve cuáles"""
+        tablas = {source.tabla for source in self.sources.values()}
+        versions = get_versions(db, tablas)
+        stale = [source for source in self.sources.values()
+                 if self.versions.get(source.tabla) != versions[source.tabla]]
+        if not stale:
+            return []
+        start = time.perf_counter()
+        with self._lock:
+            for source in stale:
+                self.load(db, source, versions[source.tabla])
+            self.rebuilds += 1
+            self.last_rebuild_seconds = time.perf_counter() - start
+        return [source.tipo for source in stale]
+
+    def rebuild(self, db: Session) -> List[str]:
+        with self._lock:
+            self.versions.clear()
+            return self.refresh(db)
+
+    def watch(self, session_factory):
+        """
+        Junta los cambios de cada sesión (alta, edición, baja) para aplicarlos
+        al índice en committed(); los delete masivos marcan el tipo para
+        reconstruir porque no se conocen las filas.
+        """
+        def pending(session) -> dict:
+            return session.info.setdefault(PENDING_KEY, {})
+
+        @event.listens_for(session_factory, "after_flush")
+        def collect_flushed(session, flush_context):
+            for obj in chain(session.new, session.dirty, session.deleted):
+                source = self._by_table.get(obj.__table__.name) if hasattr(obj, "__table__") else None
+                if source is None:
+                    continue
+                id_ = source.model.__mapper__.primary_key_from_instance(obj)[0]
+                if obj in session.deleted:
+                    pending(session)[(source.tipo, id_)] = None
+                else:
+                    pending(session)[(source.tipo, id_)] = {field: getattr(obj, field) for field in source.fields}
+
+        @event.listens_for(session_factory, "do_orm_execute")
+        def collect_bulk(orm_execute_state):
+            if orm_execute_state.is_delete or orm_execute_state.is_update:
+                mapper = orm_execute_state.bind_mapper
+                source = self._by_table.get(mapper.local_table.name) if mapper is not None else None
+                if source is not None:
+                    pending(orm_execute_state.session)[(source.tipo, None)] = None
+
+        @event.listens_for(session_factory, "after_rollback")
+        def discard_pending(session):
+            session.info.pop(PENDING_KEY, None)
+
+    def committed(self, session: Session, versions: Dict[str, int]):
+        """
+        Aplica los cambios del commit (table_versions.track_versions). Si otro
+        proceso cambió la tabla en el medio, el tipo queda para reconstruir.
+        """
+        changes = session.info.pop(PENDING_KEY, {})
+        with self._lock:
+            for (tipo, id_), values in changes.items():
+                source = self.sources[tipo]
+                if id_ is None:
+                    self.versions[source.tabla] = None
+                elif values is None:
+                    self.remove(tipo, id_)
+                else:
+                    self.add(tipo, id_, values)
+            for source in self.sources.values():
+                version = versions.get(source.tabla)
+                if version is None:
+                    continue
+                indexed = self.versions.get(source.tabla)
+                self.versions[source.tabla] = version if indexed == version - 1 else None
+
+    # Búsqueda
+
+    def _similar_words(self, term: str) -> Dict[str, float]:
+        """Palabras del vocabulario parecidas a term (similitud de Jaccard de trigramas)"""
+        term_grams = trigrams(term)
+        counts: Dict[str, int] = defaultdict(int)
+        for gram in term_grams:
+            for word in self._trigrams.get(gram, ()):
+                counts[word] += 1
+        similar = {}
+        for word, common in counts.items():
+            similarity = common / (len(term_grams) + len(word) + 2 - common)
+            if similarity >= self.min_similarity:
+                similar[word] = similarity
+        return similar
+
+    def _term_matches(self, term: str) -> Dict[DocKey, float]:
+        matches: Dict[DocKey, float] = {}
+
+        def score(word: str, factor: float):
+            for key, weight in self._postings[word].items():
+                if weight * factor > matches.get(key, 0):
+                    matches[key] = weight * factor
+
+        if term in self._postings:
+            matches = {key: weight * 3.0 for key, weight in self._postings[term].items()}
+        start = bisect_left(self._vocab, term)
+        for word in self._vocab[start:start + MAX_PREFIX_WORDS]:
+            if not word.startswith(term):
+                break
+            if word != term:
+                score(word, 2.0)
+        if len(term) >= 3:
+            for word, similarity in self._similar_words(term).items():
+                if word != term:
+                    score(word, similarity)
+        return matches
+
+    def search(self, query: str, tipos: Optional[Iterable[str]] = None, limit: int = 20) -> List[dict]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        tipos = set(tipos) if tipos else None
+        with self._lock:
+            scores: Optional[Dict[DocKey, float]] = None
+            for term in terms:
+                matches = self._term_matches(term)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {key: value + matches[key] for key, value in scores.items() if key in matches}
+                if not scores:
+                    return []
+            if tipos is not None:
+                scores = {key: value for key, value in scores.items() if key[0] in tipos}
+            best = heapq.nlargest(limit, scores.items(), key=itemgetter(1))
+            return [
+                {
+                    "tipo": tipo,
+                    "id": id_,
+                    "titulo": self._docs[(tipo, id_)][self.sources[tipo].fields[0]],
+                    "campos": self._docs[(tipo, id_)],
+                    "score": round(score, 3)
+                }
+                for (tipo, id_), score in best
+            ]
+
+    def stats(self) -> dict:
+        with self._lock:
+            documentos: Dict[str, int] = defaultdict(int)
+            for tipo, _ in self._docs:
+                documentos[tipo] += 1
+            return {
+                "documentos": dict(documentos),
+                "palabras": len(self._vocab),
+                "trigramas": len(self._trigrams),
+                "versiones": dict(self.versions),
+                "reconstrucciones": self.rebuilds,
+                "ultima_reconstruccion_ms": round(self.last_rebuild_seconds * 1000, 2)
+            }
+
+def catalog_sources() -> List[SearchSource]:
+    from models import Tela, BaseModel, Tizado, Ficha, Marca, TipoProducto, Entalle
+    return [
+        SearchSource("tela", "telas", Tela, ("nombre_tela", "proveedor", "clasificacion")),
+        SearchSource("base", "bases", BaseModel, ("modelo",)),
+        SearchSource("tizado", "tizados", Tizado, ("curva",)),
+        SearchSource("ficha", "fichas", Ficha, ("nombre_ficha",)),
+        SearchSource("marca", "marcas", Marca, ("nombre_marca",)),
+        SearchSource("tipo_producto", "tipos_producto", TipoProducto, ("nombre_tipo",)),
+        SearchSource("entalle", "entalles", Entalle, ("nombre_entalle",)),
+    ]
+
+def benchmark(rows: int = 100_000, queries: int = 200):
+    """Construye un índice con un catálogo sintético y mide búsquedas exactas, por prefijo y difusas"""
+    import random
+    random.seed(7)
+    sources = catalog_sources()
+    index = SearchIndex(sources)
+    palabras = ["jean", "denim", "slim", "regular", "skinny", "recto", "oxford", "gabardina", "lino",
+                "algodon", "stretch", "rigido", "bengalina", "chino", "cargo", "mom", "wide", "leg",
+                "bermuda", "short", "pollera", "campera", "camisa", "remera", "talle", "curva"]
+    silabas = ["ba", "ca", "de", "fi", "go", "lu", "ma", "ne", "po", "ra", "si", "to", "vel", "zar"]
+    nombres = sorted({"".join(random.choices(silabas, k=3)) for _ in range(5000)})
+    proveedores = [f"proveedor{i}" for i in range(300)]
+
+    def nombre():
+        # Una palabra común (muy repetida), un nombre propio y un código
+        return f"{random.choice(palabras)} {random.choice(nombres)} {random.randint(1, 9999)}"
+
+    start = time.perf_counter()
+    per_source = rows // len(sources)
+    for source in sources:
+        for id_ in range(1, per_source + 1):
+            values = {field: nombre() for field in source.fields}
+            if source.tipo == "tela":
+                values["proveedor"] = random.choice(proveedores)
+            index.add(source.tipo, id_, values)
+    build = time.perf_counter() - start
+    print(f"📦 {per_source * len(sources)} documentos, {len(index._vocab)} palabras en {build:.2f}s")
+
+    consultas = {
+        "comun": lambda: random.choice(palabras),
+        "exacta": lambda: random.choice(nombres),
+        "dos palabras": lambda: f"{random.choice(palabras)} {random.choice(nombres)}",
+        "prefijo": lambda: random.choice(nombres)[:4],
+        "difusa": lambda: (lambda w: w[:2] + w[3:])(random.choice(nombres)),
+        "proveedor": lambda: random.choice(proveedores),
+    }
+    for nombre_consulta, generar in consultas.items():
+        tiempos = []
+        for _ in range(queries):
+            query = generar()
+            start = time.perf_counter()
+            index.search(query, limit=20)
+            tiempos.append((time.perf_counter() - start) * 1000)
+        tiempos.sort()
+        print(f"🔎 {nombre_consulta:<13} p50={tiempos[len(tiempos) // 2]:.2f}ms "
+              f"p95={tiempos[int(len(tiempos) * 0.95)]:.2f}ms")
+
+if __name__ == "__main__":
+    import sys
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,141 @@
+"""
+Serializadores por modelo generados una sola vez
+Para cada clase mapeada se arma al importar una función con una línea por
+columna y el conversor que le toca según su tipo (Numeric, DateTime, Enum),
+así convertir una fila no recorre __table__.columns ni hace isinstance por
+columna en cada llamada. Hay dos variantes que solo difieren en Decimal:
+
+    to_audit_dict(obj)  # Decimal como float (historial de auditoría)
+    to_json_dict(obj)   # Decimal como texto, igual que las respuestas con response_model
+
+    python serializers.py [filas]  # compara con la versión reflexiva anterior
+"""
+from sqlalchemy import Date, DateTime, Enum, Numeric, Time
+from typing import Callable, Dict, Optional
+import enum
+import time
+
+from database import Base
+import models  # noqa: F401 (registra las clases mapeadas)
+
+_MISSING = object()
+
+def _enum_value(value):
+    # Al editar la columna puede tener el texto que mandó el cliente en vez del Enum
+    return value.value if isinstance(value, enum.Enum) else value
+
+def _isoformat(value):
+    return value.isoformat()
+
+def _converter(column, decimal: Callable) -> Optional[Callable]:
+    """Conversor de la columna a un valor JSON, o None si ya lo es"""
+    column_type = column.type
+    if isinstance(column_type, Enum):
+        return _enum_value
+    if isinstance(column_type, (DateTime, Date, Time)):
+        return _isoformat
+    if isinstance(column_type, Numeric) and column_type.asdecimal:
+        return decimal
+    return None
+
+def column_converters(model, decimal: Callable = str) -> Dict[str, Optional[Callable]]:
+    """{atributo: conversor o None} de las columnas del modelo, en su orden"""
+    return {
+        attr.key: _converter(attr.columns[0], decimal)
+        for attr in model.__mapper__.column_attrs
+    }
+
+def compile_serializer(model, decimal: Callable = str) -> Callable[[object], dict]:
+    """Genera la función que convierte una instancia del modelo en dict"""
+    converters = column_converters(model, decimal)
+    namespace = {"_missing": _MISSING}
+    # Los valores cargados se leen del __dict__ de la instancia; solo los que
+    # faltan (expirados o diferidos) pasan por el atributo, que los carga
+    body = ["    d = obj.__dict__"]
+    items = []
+    for i, (key, converter) in enumerate(converters.items()):
+        body.append(f"    v{i} = d.get({key!r}, _missing)")
+        body.append(f"    if v{i} is _missing: v{i} = obj.{key}")
+        if converter is None:
+            items.append(f"{key!r}: v{i}")
+            continue
+        namespace[f"_c{i}"] = converter
+        items.append(f"{key!r}: None if v{i} is None else _c{i}(v{i})")
+    source = "\n".join(
+        [f"def serialize_{model.__name__}(obj):", *body, "    return {" + ", ".join(items) + "}"]
+    )
+    exec(compile(source, f"<serializer {model.__name__}>", "exec"), namespace)
+    return namespace[f"serialize_{model.__name__}"]
+
+class SerializerSet:
+    """Serializadores de todas las clases mapeadas para una forma de convertir Decimal"""
+
+    def __init__(self, decimal: Callable):
+        self.decimal = decimal
+        self._serializers: Dict[type, Callable[[object], dict]] = {}
+        for mapper in Base.registry.mappers:
+            self._serializers[mapper.class_] = compile_serializer(mapper.class_, decimal)
+
+    def __call__(self, obj) -> dict:
+        serializer = self._serializers.get(type(obj))
+        if serializer is None:
+            # Subclases o modelos registrados después de importar este módulo
+            serializer = self._serializers[type(obj)] = compile_serializer(type(obj), self.decimal)
+        return serializer(obj)
+
+to_audit_dict = SerializerSet(float)
+to_json_dict = SerializerSet(str)
+
+def benchmark(rows: int = 100_000):
+    """Compara los serializadores generados con la conversión reflexiva y con jsonable_encoder"""
+    from datetime import datetime, timezone
+    from decimal import Decimal
+    from fastapi.encoders import jsonable_encoder
+    from models import Tela, BaseModel, HistorialMovimiento, AccionEnum, ColorEnum
+
+    def reflective_to_dict(obj) -> dict:
+        # Implementación anterior de audit.model_to_dict
+        result = {}
+        for column in obj.__table__.columns:
+            value = getattr(obj, column.name)
+            if isinstance(value, Decimal):
+                value = float(value)
+            elif isinstance(value, datetime):
+                value = value.isoformat()
+            elif hasattr(value, 'value'):
+                value = value.value
+            result[column.name] = value
+        return result
+
+    def fila(model, **values):
+        # Como una fila leída de la base: todas las columnas cargadas
+        return model(**{attr.key: values.get(attr.key) for attr in model.__mapper__.column_attrs})
+
+    now = datetime.now(timezone.utc)
+    muestras = {
+        "Tela": [fila(Tela, id_tela=i, nombre_tela=f"tela {i}", gramaje=Decimal("180.50"), proveedor="proveedor",
+                      ancho_estandar=Decimal("1.50"), color=ColorEnum.Azul, precio=Decimal("12.30"))
+                 for i in range(rows)],
+        "BaseModel": [fila(BaseModel, id_base=i, id_muestra_base=1, modelo=f"modelo {i}", aprobado=False)
+                      for i in range(rows)],
+        "HistorialMovimiento": [fila(HistorialMovimiento, id_movimiento=i, username="admin", fecha_hora=now,
+                                     tabla="telas", accion=AccionEnum.editar, id_registro=i, datos_nuevos={"a": 1})
+                                for i in range(rows)],
+    }
+    variantes = {
+        "reflexivo": reflective_to_dict,
+        "generado": to_audit_dict,
+        "jsonable_encoder": lambda obj: jsonable_encoder(reflective_to_dict(obj)),
+        "generado json": to_json_dict,
+    }
+    for nombre_modelo, objs in muestras.items():
+        for nombre, serialize in variantes.items():
+            start = time.perf_counter()
+            for obj in objs:
+                serialize(obj)
+            elapsed = time.perf_counter() - start
+            print(f"⏱️  {nombre_modelo:<20} {nombre:<17} {elapsed * 1e6 / rows:6.2f}µs por fila")
+
+if __name__ == "__main__":
+    import sys
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
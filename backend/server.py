@@ -1,20 +1,27 @@
 from fastapi import FastAPI, APIRouter, Depends, HTTPException, UploadFile, File, Request, Query
-from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse, Response
+from fastapi.concurrency import run_in_threadpool
 from starlette.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import desc
-from typing import List, Optional
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import desc, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, List, Optional
 import os
 import logging
 from pathlib import Path
 import shutil
 import uuid
+import hashlib
+import asyncio
+import aiofiles
+import aiofiles.os
 import boto3
 from botocore.config import Config as BotoConfig
-import io
+import mimetypes
+from email.utils import formatdate, format_datetime, parsedate_to_datetime
 from datetime import timedelta, datetime, timezone
 
-from database import get_db, engine, Base
+from database import get_db, get_async_db, engine, async_engine, Base, SessionLocal
 from models import Tela as TelaModel, Entalle as EntalleModel, TipoProducto as TipoProductoModel, Marca as MarcaModel
 from models import MuestraBase as MuestraBaseModel, BaseModel as BaseDBModel, Tizado as TizadoModel, Ficha as FichaModel
 from models import Usuario as UsuarioModel, PermisoUsuario as PermisoModel, RolEnum, HistorialMovimiento, AccionEnum
@@ -28,14 +35,47 @@ from schemas import (
     Tizado, TizadoCreate, TizadoUpdate,
     Ficha, FichaCreate, FichaUpdate,
     UsuarioSchema, UsuarioCreate, UsuarioUpdate, UsuarioLogin, Token, PermisoBase,
-    HistorialSchema, AccionEnum as AccionEnumSchema
+    HistorialSchema, AccionEnum as AccionEnumSchema,
+    SubidaCreate
 )
 from auth import (
     verify_password, get_password_hash, create_access_token,
     get_current_user, get_current_user_optional, require_admin, require_super_admin,
     get_user_permissions, create_default_permissions, ACCESS_TOKEN_EXPIRE_MINUTES
 )
-from audit import audit_create, audit_update, audit_delete, audit_file_action, audit_login, model_to_dict
+from file_cache import DiskCache, aiter_and_cache
+from storage import Storage, LocalStorage, S3Storage, ObjectInfo, StoredObject, open_local_file
+from file_dedup import (
+    acquire_content, create_content, add_alias, content_key, resolve_alias, resolve_aliases,
+    CONTENT_KEY_PREFIX
+)
+from zip_export import ZipMember, stream_zip, unique_arcname
+from spreadsheet_preview import SpreadsheetPreviewer, PreviewError, is_previewable, paginate_sheet
+from image_variants import (
+    VariantGenerator, variant_key, variant_keys, variant_filename, is_variant_source, VARIANT_MEDIA_TYPE
+)
+from delete_queue import (
+    DeletionWorker, enqueue_file_deletion, enqueue_file_deletions, queue_stats, get_file_key
+)
+from file_gc import OrphanCollector, gc_stats
+from pagination import ListParams, ListSpec, list_params, apply_list_params, apply_list_params_async, sort_column_key
+from sparse_fields import SparseParams, ModelSpec, sparse_params, parse_selection, load_options, sparse_response
+from catalog_cache import CatalogCache
+from table_versions import get_versions, get_versions_async, track_versions, versions_etag
+from search_index import SearchIndex, catalog_sources
+from historial_archive import (
+    HistorialArchiver, ArchiveFilter, archived_months, exclude_archived, search_archive, find_archived, archive_stats,
+    reconstruir_archivado
+)
+from resumable_upload import (
+    MAX_PARTS, ESTADO_ACTIVA, UploadSessionReaper, staging_key, part_count, expected_part_size, missing_parts,
+    session_status, get_session, count_active_sessions, record_part, claim_finalize, release_finalize
+)
+from models import SubidaSesion
+from audit import (
+    audit_create, audit_update, audit_delete, audit_file_action, audit_login, model_to_dict, unit_of_work,
+    AuditWriter, set_audit_writer, reconstruir_registro
+)
 from mini_erp_sync import (
     get_modelos_mini_erp, get_modelo_by_id, get_registros_mini_erp, 
     get_registro_by_id, sync_base_to_registro, unlink_base_from_registro,
@@ -57,50 +97,202 @@ R2_BUCKET_NAME = os.environ.get("R2_BUCKET_NAME")
 
 USE_R2 = R2_ACCOUNT_ID is not None and R2_ACCESS_KEY_ID is not None
 
-# Cliente S3 para R2
-s3_client = None
+# Almacenamiento: server.py solo usa la interfaz Storage (ver storage.py)
+# R2_ENDPOINT_URL permite apuntar a un S3 local (MinIO, moto) en pruebas
+R2_ENDPOINT_URL = os.environ.get("R2_ENDPOINT_URL")
+STORAGE_IO_THREADS = int(os.environ.get("STORAGE_IO_THREADS", 16))
+
+# Los archivos antiguos subidos antes de usar R2 siguen en uploads/
+local_storage = LocalStorage(UPLOAD_DIR)
 if USE_R2:
     s3_client = boto3.client(
         's3',
-        endpoint_url=f"https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com",
+        endpoint_url=R2_ENDPOINT_URL or f"https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com",
         aws_access_key_id=R2_ACCESS_KEY_ID,
         aws_secret_access_key=R2_SECRET_ACCESS_KEY,
-        config=BotoConfig(signature_version='s3v4'),
+        config=BotoConfig(signature_version='s3v4', max_pool_connections=STORAGE_IO_THREADS),
         region_name='auto'
     )
+    storage = S3Storage(
+        s3_client, R2_BUCKET_NAME, max_threads=STORAGE_IO_THREADS,
+        part_size=int(os.environ.get("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024))
+    )
     print("✅ Almacenamiento configurado: CLOUDFLARE R2")
 else:
+    storage = local_storage
     print("⚠️  Almacenamiento configurado: LOCAL (uploads/)")
 
-# Función para eliminar archivos de R2
-def delete_file_from_r2(file_url: str) -> bool:
-    """Elimina un archivo de Cloudflare R2 basado en su URL"""
-    if not file_url or not USE_R2 or not s3_client:
-        return False
-    
-    try:
-        # Extraer el nombre del archivo de la URL
-        # URL formato: https://bucket.account.r2.cloudflarestorage.com/filename
-        # o puede ser solo el filename guardado
-        if file_url.startswith('http'):
-            file_key = file_url.split('/')[-1]
-        else:
-            file_key = file_url
-        
-        s3_client.delete_object(Bucket=R2_BUCKET_NAME, Key=file_key)
-        print(f"✅ Archivo eliminado de R2: {file_key}")
-        return True
-    except Exception as e:
-        print(f"⚠️ Error eliminando archivo de R2: {e}")
-        return False
+# Caché local en disco delante de R2 (FILE_CACHE_MAX_BYTES=0 la desactiva)
+FILE_CACHE_DIR = Path(os.environ.get('FILE_CACHE_DIR', str(UPLOAD_DIR / '.cache')))
+FILE_CACHE_MAX_BYTES = int(os.environ.get('FILE_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+FILE_CACHE_MAX_ENTRY_BYTES = int(os.environ.get('FILE_CACHE_MAX_ENTRY_BYTES', 100 * 1024 * 1024))
+
+file_cache = None
+if USE_R2 and FILE_CACHE_MAX_BYTES > 0:
+    file_cache = DiskCache(FILE_CACHE_DIR, FILE_CACHE_MAX_BYTES, FILE_CACHE_MAX_ENTRY_BYTES)
+    print(f"✅ Caché de archivos: {FILE_CACHE_DIR} ({FILE_CACHE_MAX_BYTES // (1024 * 1024)} MB)")
 
-def delete_multiple_files_from_r2(file_urls: list) -> int:
-    """Elimina múltiples archivos de R2"""
-    deleted_count = 0
-    for url in file_urls:
-        if url and delete_file_from_r2(url):
-            deleted_count += 1
-    return deleted_count
+# Variantes de imágenes (miniaturas WebP servidas con /api/files/{nombre}?w=256)
+IMAGE_VARIANT_WIDTHS = sorted(
+    int(w) for w in os.environ.get("IMAGE_VARIANT_WIDTHS", "256,1024").split(",") if w.strip()
+)
+IMAGE_VARIANT_MAX_SOURCE_BYTES = int(os.environ.get("IMAGE_VARIANT_MAX_SOURCE_BYTES", 50 * 1024 * 1024))
+
+variant_generator = VariantGenerator(
+    max_workers=int(os.environ.get("IMAGE_VARIANT_WORKERS", 2)),
+    quality=int(os.environ.get("IMAGE_VARIANT_QUALITY", 80))
+)
+
+# Vista previa de planillas (/api/files/{nombre}/preview), procesadas una vez por contenido
+PREVIEW_MAX_FILE_BYTES = int(os.environ.get("PREVIEW_MAX_FILE_BYTES", 50 * 1024 * 1024))
+spreadsheet_previewer = SpreadsheetPreviewer(
+    Path(os.environ.get('PREVIEW_CACHE_DIR', str(UPLOAD_DIR / '.previews'))),
+    max_workers=int(os.environ.get("PREVIEW_WORKERS", 2)),
+    timeout=int(os.environ.get("PREVIEW_TIMEOUT", 30)),
+    max_memory_bytes=int(os.environ.get("PREVIEW_MAX_MEMORY_MB", 512)) * 1024 * 1024,
+    max_rows=int(os.environ.get("PREVIEW_MAX_ROWS", 5000)),
+    max_cols=int(os.environ.get("PREVIEW_MAX_COLS", 100))
+)
+
+# Eliminación de archivos: los handlers encolan y un worker borra en lotes
+async def delete_from_storage(keys: list) -> dict:
+    """Elimina claves del almacenamiento en lote; retorna {clave: error} de las que fallaron"""
+    # Las variantes se eliminan junto con su original
+    variantes = {vkey: key for key in keys for vkey in variant_keys(key, IMAGE_VARIANT_WIDTHS)}
+    todas = list(keys) + list(variantes)
+    errores = await storage.delete_many(todas)
+    if storage is not local_storage:
+        # También eliminar de local si existe (copias antiguas de antes de R2)
+        errores.update(await local_storage.delete_many([key for key in todas if key not in errores]))
+    
+    for key in todas:
+        if key in errores:
+            continue
+        if file_cache:
+            file_cache.invalidate(key)
+        if key.startswith(CONTENT_KEY_PREFIX):
+            spreadsheet_previewer.invalidate(key[len(CONTENT_KEY_PREFIX):])
+    
+    # Si falló una variante se reintenta el original (y con él sus variantes)
+    for vkey, key in variantes.items():
+        if vkey in errores:
+            errores.setdefault(key, errores.pop(vkey))
+    return {key: errores[key] for key in keys if key in errores}
+
+def delete_storage_keys(keys: list) -> dict:
+    """Versión síncrona para el worker de eliminación (corre en su propio hilo)"""
+    return asyncio.run(delete_from_storage(keys))
+
+def collect_base_files(db_base: BaseDBModel) -> list:
+    """Archivos de una base y de sus fichas y tizados"""
+    files = [db_base.imagen, db_base.patron]
+    files.extend(ficha.archivo for ficha in db_base.fichas)
+    files.extend(tizado.archivo_tizado for tizado in db_base.tizados)
+    return [f for f in files if f]
+
+deletion_worker = DeletionWorker(
+    SessionLocal, delete_storage_keys,
+    interval=float(os.environ.get("DELETE_QUEUE_INTERVAL", 5))
+)
+
+# Recolector de archivos huérfanos (GC_INTERVAL=0 lo desactiva)
+def list_storage_page(start_after: Optional[str], limit: int) -> list:
+    """Versión síncrona para el hilo del recolector"""
+    return asyncio.run(storage.list_page(start_after, limit))
+
+orphan_collector = OrphanCollector(
+    SessionLocal, list_storage_page,
+    grace=timedelta(hours=float(os.environ.get("GC_GRACE_HOURS", 24))),
+    hold=timedelta(hours=float(os.environ.get("GC_QUARANTINE_HOURS", 168))),
+    page_size=int(os.environ.get("GC_PAGE_SIZE", 1000)),
+    max_pages=int(os.environ.get("GC_MAX_PAGES", 100)),
+    interval=float(os.environ.get("GC_INTERVAL", 3600)),
+    on_enqueue=deletion_worker.notify
+)
+
+# Auditoría: "sync" confirma cada movimiento al registrarlo; "batch" escribe
+# en lotes los movimientos sueltos (logins, subidas) desde un hilo propio
+AUDIT_WRITE_MODE = os.environ.get("AUDIT_WRITE_MODE", "sync")
+audit_writer = AuditWriter(
+    SessionLocal,
+    batch_size=int(os.environ.get("AUDIT_BATCH_SIZE", 500)),
+    interval=float(os.environ.get("AUDIT_FLUSH_INTERVAL", 1.0)),
+    max_queue=int(os.environ.get("AUDIT_QUEUE_SIZE", 10000)),
+    enqueue_timeout=float(os.environ.get("AUDIT_ENQUEUE_TIMEOUT", 0.5)),
+    retries=int(os.environ.get("AUDIT_WRITE_RETRIES", 3)),
+    retry_backoff=float(os.environ.get("AUDIT_RETRY_BACKOFF", 0.5))
+) if AUDIT_WRITE_MODE == "batch" else None
+
+# Historial: los meses fuera de la ventana caliente se archivan en archivos
+# comprimidos (HISTORIAL_ARCHIVE_INTERVAL=0 desactiva el archivado automático)
+HISTORIAL_ARCHIVE_DIR = Path(os.environ.get('HISTORIAL_ARCHIVE_DIR', '/app/backend/historial_archivo'))
+historial_archiver = HistorialArchiver(
+    SessionLocal, HISTORIAL_ARCHIVE_DIR,
+    hot_months=int(os.environ.get("HISTORIAL_HOT_MONTHS", 6)),
+    interval=float(os.environ.get("HISTORIAL_ARCHIVE_INTERVAL", 86400))
+)
+
+# Catálogos chicos servidos desde memoria (JSON ya serializado)
+catalog_cache = CatalogCache()
+catalog_cache.register("telas", lambda db: db.query(TelaModel).order_by(TelaModel.id_tela).all(), Tela)
+catalog_cache.register("entalles", lambda db: db.query(EntalleModel).order_by(EntalleModel.id_entalle).all(), Entalle)
+catalog_cache.register(
+    "tipos_producto", lambda db: db.query(TipoProductoModel).order_by(TipoProductoModel.id_tipo).all(), TipoProducto
+)
+catalog_cache.register("marcas", lambda db: db.query(MarcaModel).order_by(MarcaModel.id_marca).all(), Marca)
+
+# Búsqueda en el catálogo de desarrollo (índice en memoria de este proceso)
+search_index = SearchIndex(catalog_sources())
+search_index.watch(SessionLocal)
+
+def tables_committed(session: Session, versions: Dict[str, int]):
+    """Después de cada commit que modificó tablas versionadas"""
+    catalog_cache.invalidate(versions)
+    search_index.committed(session, versions)
+
+# Versión por tabla: sube en el mismo commit que cada alta, edición o baja
+track_versions(SessionLocal, {
+    TelaModel: "telas",
+    EntalleModel: "entalles",
+    TipoProductoModel: "tipos_producto",
+    MarcaModel: "marcas",
+    MuestraBaseModel: "muestras_base",
+    BaseDBModel: "bases",
+    TizadoModel: "tizados",
+    FichaModel: "fichas"
+}, on_commit=tables_committed)
+
+# Tablas de las que depende cada respuesta (para el ETag)
+BASE_TABLES = ("bases", "tizados", "fichas")
+MUESTRA_BASE_TABLES = ("muestras_base", "tipos_producto", "entalles", "telas", "marcas") + BASE_TABLES
+
+def versioned(*tablas: str):
+    """
+    Dependencia de los endpoints de lectura: ETag a partir de las versiones de
+    las tablas que arman la respuesta. Si el navegador ya tiene esa versión
+    (If-None-Match) responde 304 sin ejecutar la consulta principal.
+    """
+    def check_versions(request: Request, response: Response, db: Session = Depends(get_db)) -> Dict[str, int]:
+        return check_etag(request, response, get_versions(db, tablas))
+    return check_versions
+
+def versioned_async(*tablas: str):
+    """versioned() para los endpoints async (lee las versiones con la sesión async)"""
+    async def check_versions(
+        request: Request,
+        response: Response,
+        db: AsyncSession = Depends(get_async_db)
+    ) -> Dict[str, int]:
+        return check_etag(request, response, await get_versions_async(db, tablas))
+    return check_versions
+
+def check_etag(request: Request, response: Response, versions: Dict[str, int]) -> Dict[str, int]:
+    etag = versions_etag(versions, f"{request.url.path}?{request.url.query}")
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if is_not_modified(request, etag, None):
+        raise HTTPException(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return versions
 
 @api_router.get("/")
 def root():
@@ -116,13 +308,84 @@ def get_client_ip(request: Request) -> str:
 def get_user_agent(request: Request) -> str:
     return request.headers.get("User-Agent", "unknown")[:500]
 
+# Listados: columnas de orden (indexadas) y de búsqueda
+TELA_LIST = ListSpec(
+    TelaModel.id_tela,
+    {'nombre_tela': TelaModel.nombre_tela},
+    [TelaModel.nombre_tela, TelaModel.proveedor, TelaModel.clasificacion]
+)
+ENTALLE_LIST = ListSpec(EntalleModel.id_entalle, {'nombre_entalle': EntalleModel.nombre_entalle}, [EntalleModel.nombre_entalle])
+TIPO_PRODUCTO_LIST = ListSpec(TipoProductoModel.id_tipo, {'nombre_tipo': TipoProductoModel.nombre_tipo}, [TipoProductoModel.nombre_tipo])
+MARCA_LIST = ListSpec(MarcaModel.id_marca, {'nombre_marca': MarcaModel.nombre_marca}, [MarcaModel.nombre_marca])
+BASE_LIST = ListSpec(
+    BaseDBModel.id_base,
+    {'modelo': BaseDBModel.modelo, 'id_muestra_base': BaseDBModel.id_muestra_base},
+    [BaseDBModel.modelo]
+)
+TIZADO_LIST = ListSpec(TizadoModel.id_tizado, {'id_base': TizadoModel.id_base}, [TizadoModel.archivo_tizado, TizadoModel.curva])
+FICHA_LIST = ListSpec(
+    FichaModel.id_ficha,
+    {'nombre_ficha': FichaModel.nombre_ficha, 'id_base': FichaModel.id_base},
+    [FichaModel.nombre_ficha, FichaModel.archivo]
+)
+
+# Campos y relaciones que se pueden pedir con fields= / expand=
+TELA_FIELDS = ModelSpec(TelaModel)
+ENTALLE_FIELDS = ModelSpec(EntalleModel)
+TIPO_PRODUCTO_FIELDS = ModelSpec(TipoProductoModel)
+MARCA_FIELDS = ModelSpec(MarcaModel)
+TIZADO_FIELDS = ModelSpec(TizadoModel)
+FICHA_FIELDS = ModelSpec(FichaModel)
+BASE_FIELDS = ModelSpec(BaseDBModel, {'tizados': TIZADO_FIELDS, 'fichas': FICHA_FIELDS})
+MUESTRA_BASE_FIELDS = ModelSpec(MuestraBaseModel, {
+    'tipo_producto': TIPO_PRODUCTO_FIELDS,
+    'entalle': ENTALLE_FIELDS,
+    'tela': TELA_FIELDS,
+    'marca': MARCA_FIELDS,
+    'bases': BASE_FIELDS
+})
+
+def list_response(query, default_options: list, list_spec: ListSpec, model_spec: ModelSpec,
+                  params: ListParams, sparse: SparseParams, response: Response):
+    """Listado con paginación opcional y, si se piden, solo algunos campos y relaciones"""
+    if not sparse.active:
+        return apply_list_params(query.options(*default_options), list_spec, params, response)
+    selection = parse_selection(model_spec, sparse)
+    query = query.options(*load_options(selection, [sort_column_key(list_spec, params)]))
+    return sparse_response(apply_list_params(query, list_spec, params, response), selection, response)
+
+async def list_response_async(db: AsyncSession, stmt, default_options: list, list_spec: ListSpec,
+                              model_spec: ModelSpec, params: ListParams, sparse: SparseParams, response: Response):
+    """list_response para los endpoints async"""
+    if not sparse.active:
+        return await apply_list_params_async(db, stmt.options(*default_options), list_spec, params, response)
+    selection = parse_selection(model_spec, sparse)
+    stmt = stmt.options(*load_options(selection, [sort_column_key(list_spec, params)]))
+    items = await apply_list_params_async(db, stmt, list_spec, params, response)
+    return sparse_response(items, selection, response)
+
+def is_full_list(params: ListParams, sparse: SparseParams) -> bool:
+    """Lista completa en el orden por defecto (la que se sirve desde catalog_cache)"""
+    return params == ListParams() and not sparse.active
+
+def cached_catalog_response(db: Session, tabla: str, versions: Dict[str, int], response: Response) -> Response:
+    body = catalog_cache.get(db, tabla, versions[tabla])
+    return Response(body, media_type="application/json", headers=dict(response.headers))
+
 # TELA Endpoints
 @api_router.get("/telas", response_model=List[Tela])
-def get_telas(db: Session = Depends(get_db)):
-    telas = db.query(TelaModel).all()
-    return telas
+def get_telas(
+    response: Response,
+    params: ListParams = Depends(list_params),
+    sparse: SparseParams = Depends(sparse_params),
+    versions: Dict[str, int] = Depends(versioned("telas")),
+    db: Session = Depends(get_db)
+):
+    if is_full_list(params, sparse):
+        return cached_catalog_response(db, "telas", versions, response)
+    return list_response(db.query(TelaModel), [], TELA_LIST, TELA_FIELDS, params, sparse, response)
 
-@api_router.get("/telas/{id_tela}", response_model=Tela)
+@api_router.get("/telas/{id_tela}", response_model=Tela, dependencies=[Depends(versioned("telas"))])
 def get_tela(id_tela: int, db: Session = Depends(get_db)):
     tela = db.query(TelaModel).filter(TelaModel.id_tela == id_tela).first()
     if not tela:
@@ -137,13 +400,12 @@ def create_tela(
     current_user: UsuarioModel = Depends(get_current_user)
 ):
     db_tela = TelaModel(**tela.model_dump())
-    db.add(db_tela)
-    db.commit()
-    db.refresh(db_tela)
-    
-    audit_create(db, current_user, "telas", db_tela, db_tela.id_tela,
-                 f"Creó tela: {db_tela.nombre_tela}",
-                 get_client_ip(request), get_user_agent(request))
+    with unit_of_work(db):
+        db.add(db_tela)
+        db.flush()
+        audit_create(db, current_user, "telas", db_tela, db_tela.id_tela,
+                     f"Creó tela: {db_tela.nombre_tela}",
+                     get_client_ip(request), get_user_agent(request))
     return db_tela
 
 @api_router.put("/telas/{id_tela}", response_model=Tela)
@@ -160,15 +422,13 @@ def update_tela(
     
     datos_anteriores = model_to_dict(db_tela)
     
-    for key, value in tela.model_dump(exclude_unset=True).items():
-        setattr(db_tela, key, value)
-    
-    db.commit()
-    db.refresh(db_tela)
-    
-    audit_update(db, current_user, "telas", datos_anteriores, db_tela, id_tela,
-                 f"Editó tela: {db_tela.nombre_tela}",
-                 get_client_ip(request), get_user_agent(request))
+    with unit_of_work(db):
+        for key, value in tela.model_dump(exclude_unset=True).items():
+            setattr(db_tela, key, value)
+        
+        audit_update(db, current_user, "telas", datos_anteriores, db_tela, id_tela,
+                     f"Editó tela: {db_tela.nombre_tela}",
+                     get_client_ip(request), get_user_agent(request))
     return db_tela
 
 @api_router.delete("/telas/{id_tela}")
@@ -183,21 +443,28 @@ def delete_tela(
         raise HTTPException(status_code=404, detail="Tela no encontrada")
     
     nombre_tela = db_tela.nombre_tela
-    audit_delete(db, current_user, "telas", db_tela, id_tela,
-                 f"Eliminó tela: {nombre_tela}",
-                 get_client_ip(request), get_user_agent(request))
-    
-    db.delete(db_tela)
-    db.commit()
+    with unit_of_work(db):
+        audit_delete(db, current_user, "telas", db_tela, id_tela,
+                     f"Eliminó tela: {nombre_tela}",
+                     get_client_ip(request), get_user_agent(request))
+        
+        db.delete(db_tela)
     return {"message": "Tela eliminada"}
 
 # ENTALLE Endpoints
 @api_router.get("/entalles", response_model=List[Entalle])
-def get_entalles(db: Session = Depends(get_db)):
-    entalles = db.query(EntalleModel).all()
-    return entalles
+def get_entalles(
+    response: Response,
+    params: ListParams = Depends(list_params),
+    sparse: SparseParams = Depends(sparse_params),
+    versions: Dict[str, int] = Depends(versioned("entalles")),
+    db: Session = Depends(get_db)
+):
+    if is_full_list(params, sparse):
+        return cached_catalog_response(db, "entalles", versions, response)
+    return list_response(db.query(EntalleModel), [], ENTALLE_LIST, ENTALLE_FIELDS, params, sparse, response)
 
-@api_router.get("/entalles/{id_entalle}", response_model=Entalle)
+@api_router.get("/entalles/{id_entalle}", response_model=Entalle, dependencies=[Depends(versioned("entalles"))])
 def get_entalle(id_entalle: int, db: Session = Depends(get_db)):
     entalle = db.query(EntalleModel).filter(EntalleModel.id_entalle == id_entalle).first()
     if not entalle:
@@ -212,13 +479,12 @@ def create_entalle(
     current_user: UsuarioModel = Depends(get_current_user)
 ):
     db_entalle = EntalleModel(**entalle.model_dump())
-    db.add(db_entalle)
-    db.commit()
-    db.refresh(db_entalle)
-    
-    audit_create(db, current_user, "entalles", db_entalle, db_entalle.id_entalle,
-                 f"Creó entalle: {db_entalle.nombre_entalle}",
-                 get_client_ip(request), get_user_agent(request))
+    with unit_of_work(db):
+        db.add(db_entalle)
+        db.flush()
+        audit_create(db, current_user, "entalles", db_entalle, db_entalle.id_entalle,
+                     f"Creó entalle: {db_entalle.nombre_entalle}",
+                     get_client_ip(request), get_user_agent(request))
     return db_entalle
 
 @api_router.put("/entalles/{id_entalle}", response_model=Entalle)
@@ -235,15 +501,13 @@ def update_entalle(
     
     datos_anteriores = model_to_dict(db_entalle)
     
-    for key, value in entalle.model_dump(exclude_unset=True).items():
-        setattr(db_entalle, key, value)
-    
-    db.commit()
-    db.refresh(db_entalle)
-    
-    audit_update(db, current_user, "entalles", datos_anteriores, db_entalle, id_entalle,
-                 f"Editó entalle: {db_entalle.nombre_entalle}",
-                 get_client_ip(request), get_user_agent(request))
+    with unit_of_work(db):
+        for key, value in entalle.model_dump(exclude_unset=True).items():
+            setattr(db_entalle, key, value)
+        
+        audit_update(db, current_user, "entalles", datos_anteriores, db_entalle, id_entalle,
+                     f"Editó entalle: {db_entalle.nombre_entalle}",
+                     get_client_ip(request), get_user_agent(request))
     return db_entalle
 
 @api_router.delete("/entalles/{id_entalle}")
@@ -258,21 +522,28 @@ def delete_entalle(
         raise HTTPException(status_code=404, detail="Entalle no encontrado")
     
     nombre = db_entalle.nombre_entalle
-    audit_delete(db, current_user, "entalles", db_entalle, id_entalle,
-                 f"Eliminó entalle: {nombre}",
-                 get_client_ip(request), get_user_agent(request))
-    
-    db.delete(db_entalle)
-    db.commit()
+    with unit_of_work(db):
+        audit_delete(db, current_user, "entalles", db_entalle, id_entalle,
+                     f"Eliminó entalle: {nombre}",
+                     get_client_ip(request), get_user_agent(request))
+        
+        db.delete(db_entalle)
     return {"message": "Entalle eliminado"}
 
 # TIPO_PRODUCTO Endpoints
 @api_router.get("/tipos-producto", response_model=List[TipoProducto])
-def get_tipos_producto(db: Session = Depends(get_db)):
-    tipos = db.query(TipoProductoModel).all()
-    return tipos
+def get_tipos_producto(
+    response: Response,
+    params: ListParams = Depends(list_params),
+    sparse: SparseParams = Depends(sparse_params),
+    versions: Dict[str, int] = Depends(versioned("tipos_producto")),
+    db: Session = Depends(get_db)
+):
+    if is_full_list(params, sparse):
+        return cached_catalog_response(db, "tipos_producto", versions, response)
+    return list_response(db.query(TipoProductoModel), [], TIPO_PRODUCTO_LIST, TIPO_PRODUCTO_FIELDS, params, sparse, response)
 
-@api_router.get("/tipos-producto/{id_tipo}", response_model=TipoProducto)
+@api_router.get("/tipos-producto/{id_tipo}", response_model=TipoProducto, dependencies=[Depends(versioned("tipos_producto"))])
 def get_tipo_producto(id_tipo: int, db: Session = Depends(get_db)):
     tipo = db.query(TipoProductoModel).filter(TipoProductoModel.id_tipo == id_tipo).first()
     if not tipo:
@@ -287,13 +558,12 @@ def create_tipo_producto(
     current_user: UsuarioModel = Depends(get_current_user)
 ):
     db_tipo = TipoProductoModel(**tipo.model_dump())
-    db.add(db_tipo)
-    db.commit()
-    db.refresh(db_tipo)
-    
-    audit_create(db, current_user, "tipos_producto", db_tipo, db_tipo.id_tipo,
-                 f"Creó tipo de producto: {db_tipo.nombre_tipo}",
-                 get_client_ip(request), get_user_agent(request))
+    with unit_of_work(db):
+        db.add(db_tipo)
+        db.flush()
+        audit_create(db, current_user, "tipos_producto", db_tipo, db_tipo.id_tipo,
+                     f"Creó tipo de producto: {db_tipo.nombre_tipo}",
+                     get_client_ip(request), get_user_agent(request))
     return db_tipo
 
 @api_router.put("/tipos-producto/{id_tipo}", response_model=TipoProducto)
@@ -310,15 +580,13 @@ def update_tipo_producto(
     
     datos_anteriores = model_to_dict(db_tipo)
     
-    for key, value in tipo.model_dump(exclude_unset=True).items():
-        setattr(db_tipo, key, value)
-    
-    db.commit()
-    db.refresh(db_tipo)
-    
-    audit_update(db, current_user, "tipos_producto", datos_anteriores, db_tipo, id_tipo,
-                 f"Editó tipo de producto: {db_tipo.nombre_tipo}",
-                 get_client_ip(request), get_user_agent(request))
+    with unit_of_work(db):
+        for key, value in tipo.model_dump(exclude_unset=True).items():
+            setattr(db_tipo, key, value)
+        
+        audit_update(db, current_user, "tipos_producto", datos_anteriores, db_tipo, id_tipo,
+                     f"Editó tipo de producto: {db_tipo.nombre_tipo}",
+                     get_client_ip(request), get_user_agent(request))
     return db_tipo
 
 @api_router.delete("/tipos-producto/{id_tipo}")
@@ -333,21 +601,28 @@ def delete_tipo_producto(
         raise HTTPException(status_code=404, detail="Tipo de producto no encontrado")
     
     nombre = db_tipo.nombre_tipo
-    audit_delete(db, current_user, "tipos_producto", db_tipo, id_tipo,
-                 f"Eliminó tipo de producto: {nombre}",
-                 get_client_ip(request), get_user_agent(request))
-    
-    db.delete(db_tipo)
-    db.commit()
+    with unit_of_work(db):
+        audit_delete(db, current_user, "tipos_producto", db_tipo, id_tipo,
+                     f"Eliminó tipo de producto: {nombre}",
+                     get_client_ip(request), get_user_agent(request))
+        
+        db.delete(db_tipo)
     return {"message": "Tipo de producto eliminado"}
 
 # MARCA Endpoints
 @api_router.get("/marcas", response_model=List[Marca])
-def get_marcas(db: Session = Depends(get_db)):
-    marcas = db.query(MarcaModel).all()
-    return marcas
+def get_marcas(
+    response: Response,
+    params: ListParams = Depends(list_params),
+    sparse: SparseParams = Depends(sparse_params),
+    versions: Dict[str, int] = Depends(versioned("marcas")),
+    db: Session = Depends(get_db)
+):
+    if is_full_list(params, sparse):
+        return cached_catalog_response(db, "marcas", versions, response)
+    return list_response(db.query(MarcaModel), [], MARCA_LIST, MARCA_FIELDS, params, sparse, response)
 
-@api_router.get("/marcas/{id_marca}", response_model=Marca)
+@api_router.get("/marcas/{id_marca}", response_model=Marca, dependencies=[Depends(versioned("marcas"))])
 def get_marca(id_marca: int, db: Session = Depends(get_db)):
     marca = db.query(MarcaModel).filter(MarcaModel.id_marca == id_marca).first()
     if not marca:
@@ -362,13 +637,12 @@ def create_marca(
     current_user: UsuarioModel = Depends(get_current_user)
 ):
     db_marca = MarcaModel(**marca.model_dump())
-    db.add(db_marca)
-    db.commit()
-    db.refresh(db_marca)
-    
-    audit_create(db, current_user, "marcas", db_marca, db_marca.id_marca,
-                 f"Creó marca: {db_marca.nombre_marca}",
-                 get_client_ip(request), get_user_agent(request))
+    with unit_of_work(db):
+        db.add(db_marca)
+        db.flush()
+        audit_create(db, current_user, "marcas", db_marca, db_marca.id_marca,
+                     f"Creó marca: {db_marca.nombre_marca}",
+                     get_client_ip(request), get_user_agent(request))
     return db_marca
 
 @api_router.put("/marcas/{id_marca}", response_model=Marca)
@@ -385,15 +659,13 @@ def update_marca(
     
     datos_anteriores = model_to_dict(db_marca)
     
-    for key, value in marca.model_dump(exclude_unset=True).items():
-        setattr(db_marca, key, value)
-    
-    db.commit()
-    db.refresh(db_marca)
-    
-    audit_update(db, current_user, "marcas", datos_anteriores, db_marca, id_marca,
-                 f"Editó marca: {db_marca.nombre_marca}",
-                 get_client_ip(request), get_user_agent(request))
+    with unit_of_work(db):
+        for key, value in marca.model_dump(exclude_unset=True).items():
+            setattr(db_marca, key, value)
+        
+        audit_update(db, current_user, "marcas", datos_anteriores, db_marca, id_marca,
+                     f"Editó marca: {db_marca.nombre_marca}",
+                     get_client_ip(request), get_user_agent(request))
     return db_marca
 
 @api_router.delete("/marcas/{id_marca}")
@@ -408,39 +680,70 @@ def delete_marca(
         raise HTTPException(status_code=404, detail="Marca no encontrada")
     
     nombre = db_marca.nombre_marca
-    audit_delete(db, current_user, "marcas", db_marca, id_marca,
-                 f"Eliminó marca: {nombre}",
-                 get_client_ip(request), get_user_agent(request))
-    
-    db.delete(db_marca)
-    db.commit()
+    with unit_of_work(db):
+        audit_delete(db, current_user, "marcas", db_marca, id_marca,
+                     f"Eliminó marca: {nombre}",
+                     get_client_ip(request), get_user_agent(request))
+        
+        db.delete(db_marca)
     return {"message": "Marca eliminada"}
 
 
 # MUESTRA_BASE Endpoints
-@api_router.get("/muestras-base", response_model=List[MuestraBase])
-def get_muestras_base(db: Session = Depends(get_db)):
-    muestras = db.query(MuestraBaseModel).options(
-        joinedload(MuestraBaseModel.tipo_producto),
-        joinedload(MuestraBaseModel.entalle),
+MUESTRA_BASE_PARENTS = {
+    "id_tipo": "tipo_producto",
+    "id_entalle": "entalle",
+    "id_tela": "tela",
+    "id_marca": "marca"
+}
+
+def muestra_base_parent_options() -> list:
+    """Padres de la muestra (muchos a uno) en el mismo SELECT, con solo las columnas que se muestran"""
+    return [
+        joinedload(MuestraBaseModel.tipo_producto).load_only(TipoProductoModel.id_tipo, TipoProductoModel.nombre_tipo),
+        joinedload(MuestraBaseModel.entalle).load_only(EntalleModel.id_entalle, EntalleModel.nombre_entalle),
         joinedload(MuestraBaseModel.tela),
-        joinedload(MuestraBaseModel.marca),
-        joinedload(MuestraBaseModel.bases).joinedload(BaseDBModel.tizados)
-    ).all()
-    return muestras
+        joinedload(MuestraBaseModel.marca).load_only(MarcaModel.id_marca, MarcaModel.nombre_marca)
+    ]
+
+def muestra_base_load_options() -> list:
+    """
+    Carga del árbol de una muestra base en un número fijo de consultas:
+    los padres (muchos a uno) van en el mismo SELECT con solo sus columnas
+    y las colecciones en consultas IN aparte (selectinload), así las filas
+    no se multiplican muestras x bases x tizados.
+    """
+    return muestra_base_parent_options() + [
+        selectinload(MuestraBaseModel.bases).selectinload(BaseDBModel.tizados),
+        selectinload(MuestraBaseModel.bases).selectinload(BaseDBModel.fichas)
+    ]
+
+@api_router.get("/muestras-base", response_model=List[MuestraBase], dependencies=[Depends(versioned_async(*MUESTRA_BASE_TABLES))])
+async def get_muestras_base(
+    response: Response,
+    sparse: SparseParams = Depends(sparse_params),
+    db: AsyncSession = Depends(get_async_db)
+):
+    selection = parse_selection(MUESTRA_BASE_FIELDS, sparse) if sparse.active else None
+    options = load_options(selection) if selection else muestra_base_load_options()
+    muestras = (await db.scalars(select(MuestraBaseModel).options(*options))).unique().all()
+    return sparse_response(muestras, selection, response) if selection else muestras
 
-@api_router.get("/muestras-base/{id_muestra_base}", response_model=MuestraBase)
-def get_muestra_base(id_muestra_base: int, db: Session = Depends(get_db)):
-    muestra = db.query(MuestraBaseModel).options(
-        joinedload(MuestraBaseModel.tipo_producto),
-        joinedload(MuestraBaseModel.entalle),
-        joinedload(MuestraBaseModel.tela),
-        joinedload(MuestraBaseModel.marca),
-        joinedload(MuestraBaseModel.bases).joinedload(BaseDBModel.tizados)
-    ).filter(MuestraBaseModel.id_muestra_base == id_muestra_base).first()
+@api_router.get("/muestras-base/{id_muestra_base}", response_model=MuestraBase, dependencies=[Depends(versioned_async(*MUESTRA_BASE_TABLES))])
+async def get_muestra_base(
+    id_muestra_base: int,
+    response: Response,
+    sparse: SparseParams = Depends(sparse_params),
+    db: AsyncSession = Depends(get_async_db)
+):
+    selection = parse_selection(MUESTRA_BASE_FIELDS, sparse) if sparse.active else None
+    options = load_options(selection) if selection else muestra_base_load_options()
+    muestra = (await db.scalars(
+        select(MuestraBaseModel).options(*options).filter(MuestraBaseModel.id_muestra_base == id_muestra_base)
+    )).first()
     if not muestra:
         raise HTTPException(status_code=404, detail="Muestra base no encontrada")
-    return muestra
+    return sparse_response(muestra, selection, response) if selection else muestra
 
 @api_router.post("/muestras-base", response_model=MuestraBase)
 def create_muestra_base(
@@ -449,23 +752,18 @@ def create_muestra_base(
     db: Session = Depends(get_db),
     current_user: UsuarioModel = Depends(get_current_user)
 ):
-    db_muestra = MuestraBaseModel(**muestra.model_dump())
-    db.add(db_muestra)
-    db.commit()
-    db.refresh(db_muestra)
-    
-    audit_create(db, current_user, "muestras_base", db_muestra, db_muestra.id_muestra_base,
-                 f"Creó muestra base ID: {db_muestra.id_muestra_base}",
-                 get_client_ip(request), get_user_agent(request))
-    
-    muestra_result = db.query(MuestraBaseModel).options(
-        joinedload(MuestraBaseModel.tipo_producto),
-        joinedload(MuestraBaseModel.entalle),
-        joinedload(MuestraBaseModel.tela),
-        joinedload(MuestraBaseModel.marca),
-        joinedload(MuestraBaseModel.bases)
-    ).filter(MuestraBaseModel.id_muestra_base == db_muestra.id_muestra_base).first()
-    return muestra_result
+    # Una muestra nueva no tiene bases: la colección se arma vacía sin consultarla
+    db_muestra = MuestraBaseModel(**muestra.model_dump(), bases=[])
+    with unit_of_work(db):
+        db.add(db_muestra)
+        db.flush()
+        audit_create(db, current_user, "muestras_base", db_muestra, db_muestra.id_muestra_base,
+                     f"Creó muestra base ID: {db_muestra.id_muestra_base}",
+                     get_client_ip(request), get_user_agent(request))
+        # Los padres para la respuesta, en un solo SELECT sobre la misma instancia
+        db.query(MuestraBaseModel).options(*muestra_base_parent_options())\
+            .filter(MuestraBaseModel.id_muestra_base == db_muestra.id_muestra_base).one()
+    return db_muestra
 
 @api_router.put("/muestras-base/{id_muestra_base}", response_model=MuestraBase)
 def update_muestra_base(
@@ -475,33 +773,37 @@ def update_muestra_base(
     db: Session = Depends(get_db),
     current_user: UsuarioModel = Depends(get_current_user)
 ):
-    db_muestra = db.query(MuestraBaseModel).filter(MuestraBaseModel.id_muestra_base == id_muestra_base).first()
+    # Se carga con todo lo que lleva la respuesta
+    db_muestra = db.query(MuestraBaseModel).options(*muestra_base_load_options())\
+        .filter(MuestraBaseModel.id_muestra_base == id_muestra_base).first()
     if not db_muestra:
         raise HTTPException(status_code=404, detail="Muestra base no encontrada")
     
     datos_anteriores = model_to_dict(db_muestra)
-    old_archivo = db_muestra.archivo
-    
-    for key, value in muestra.model_dump(exclude_unset=True).items():
-        setattr(db_muestra, key, value)
-    
-    db.commit()
+    old_archivo = db_muestra.archivo_costo
+    cambios = muestra.model_dump(exclude_unset=True)
     
-    # Si el archivo cambió y había uno anterior, eliminar de R2
-    if old_archivo and old_archivo != db_muestra.archivo:
-        delete_file_from_r2(old_archivo)
-    
-    audit_update(db, current_user, "muestras_base", datos_anteriores, db_muestra, id_muestra_base,
-                 f"Editó muestra base ID: {id_muestra_base}",
-                 get_client_ip(request), get_user_agent(request))
-    
-    muestra_result = db.query(MuestraBaseModel).options(
-        joinedload(MuestraBaseModel.tipo_producto),
-        joinedload(MuestraBaseModel.entalle),
-        joinedload(MuestraBaseModel.tela),
-        joinedload(MuestraBaseModel.bases)
-    ).filter(MuestraBaseModel.id_muestra_base == id_muestra_base).first()
-    return muestra_result
+    with unit_of_work(db):
+        for key, value in cambios.items():
+            setattr(db_muestra, key, value)
+        
+        # Si el archivo cambió y había uno anterior, encolarlo para eliminar
+        if old_archivo and old_archivo != db_muestra.archivo_costo:
+            enqueue_file_deletion(db, old_archivo)
+        
+        audit_update(db, current_user, "muestras_base", datos_anteriores, db_muestra, id_muestra_base,
+                     f"Editó muestra base ID: {id_muestra_base}",
+                     get_client_ip(request), get_user_agent(request))
+        
+        # Si cambió algún padre se vuelve a leer solo ese
+        padres = [relacion for columna, relacion in MUESTRA_BASE_PARENTS.items() if columna in cambios]
+        if padres:
+            db.flush()
+            db.expire(db_muestra, padres)
+            for relacion in padres:
+                getattr(db_muestra, relacion)
+    deletion_worker.notify()
+    return db_muestra
 
 @api_router.delete("/muestras-base/{id_muestra_base}")
 def delete_muestra_base(
@@ -514,40 +816,52 @@ def delete_muestra_base(
     if not db_muestra:
         raise HTTPException(status_code=404, detail="Muestra base no encontrada")
     
-    # Guardar archivo para eliminar
-    archivo_to_delete = db_muestra.archivo
+    # Recopilar archivos para eliminar (cascada a bases, fichas y tizados)
+    files_to_delete = [db_muestra.archivo_costo]
+    for db_base in db_muestra.bases:
+        files_to_delete.extend(collect_base_files(db_base))
     
-    audit_delete(db, current_user, "muestras_base", db_muestra, id_muestra_base,
-                 f"Eliminó muestra base ID: {id_muestra_base}",
-                 get_client_ip(request), get_user_agent(request))
-    
-    db.delete(db_muestra)
-    db.commit()
-    
-    # Eliminar archivo de R2
-    if archivo_to_delete:
-        delete_file_from_r2(archivo_to_delete)
+    with unit_of_work(db):
+        audit_delete(db, current_user, "muestras_base", db_muestra, id_muestra_base,
+                     f"Eliminó muestra base ID: {id_muestra_base}",
+                     get_client_ip(request), get_user_agent(request))
+        
+        # Los archivos se eliminan en segundo plano, en la misma transacción que la muestra
+        enqueue_file_deletions(db, files_to_delete)
+        db.delete(db_muestra)
+    deletion_worker.notify()
     
     return {"message": "Muestra base eliminada"}
 
 # BASE Endpoints
-@api_router.get("/bases", response_model=List[BaseSchema])
-def get_bases(db: Session = Depends(get_db)):
-    bases = db.query(BaseDBModel).options(
-        joinedload(BaseDBModel.tizados),
-        joinedload(BaseDBModel.fichas)
-    ).all()
-    return bases
+@api_router.get("/bases", response_model=List[BaseSchema], dependencies=[Depends(versioned_async(*BASE_TABLES))])
+async def get_bases(
+    response: Response,
+    params: ListParams = Depends(list_params),
+    sparse: SparseParams = Depends(sparse_params),
+    db: AsyncSession = Depends(get_async_db)
+):
+    default_options = [selectinload(BaseDBModel.tizados), selectinload(BaseDBModel.fichas)]
+    return await list_response_async(
+        db, select(BaseDBModel), default_options, BASE_LIST, BASE_FIELDS, params, sparse, response
+    )
 
-@api_router.get("/bases/{id_base}", response_model=BaseSchema)
-def get_base(id_base: int, db: Session = Depends(get_db)):
-    base = db.query(BaseDBModel).options(
-        joinedload(BaseDBModel.tizados),
-        joinedload(BaseDBModel.fichas)
-    ).filter(BaseDBModel.id_base == id_base).first()
+@api_router.get("/bases/{id_base}", response_model=BaseSchema, dependencies=[Depends(versioned_async(*BASE_TABLES))])
+async def get_base(
+    id_base: int,
+    response: Response,
+    sparse: SparseParams = Depends(sparse_params),
+    db: AsyncSession = Depends(get_async_db)
+):
+    selection = parse_selection(BASE_FIELDS, sparse) if sparse.active else None
+    options = load_options(selection) if selection else [
+        selectinload(BaseDBModel.tizados),
+        selectinload(BaseDBModel.fichas)
+    ]
+    base = (await db.scalars(select(BaseDBModel).options(*options).filter(BaseDBModel.id_base == id_base))).first()
     if not base:
         raise HTTPException(status_code=404, detail="Base no encontrada")
-    return base
+    return sparse_response(base, selection, response) if selection else base
 
 @api_router.post("/bases", response_model=BaseSchema)
 def create_base(
@@ -556,20 +870,15 @@ def create_base(
     db: Session = Depends(get_db),
     current_user: UsuarioModel = Depends(get_current_user)
 ):
-    db_base = BaseDBModel(**base.model_dump())
-    db.add(db_base)
-    db.commit()
-    db.refresh(db_base)
-    
-    audit_create(db, current_user, "bases", db_base, db_base.id_base,
-                 f"Creó base modelo: {db_base.modelo or 'Sin modelo'}",
-                 get_client_ip(request), get_user_agent(request))
-    
-    base_result = db.query(BaseDBModel).options(
-        joinedload(BaseDBModel.tizados),
-        joinedload(BaseDBModel.fichas)
-    ).filter(BaseDBModel.id_base == db_base.id_base).first()
-    return base_result
+    # Una base nueva no tiene tizados ni fichas: se arman vacíos sin consultarlos
+    db_base = BaseDBModel(**base.model_dump(), tizados=[], fichas=[])
+    with unit_of_work(db):
+        db.add(db_base)
+        db.flush()
+        audit_create(db, current_user, "bases", db_base, db_base.id_base,
+                     f"Creó base modelo: {db_base.modelo or 'Sin modelo'}",
+                     get_client_ip(request), get_user_agent(request))
+    return db_base
 
 @api_router.put("/bases/{id_base}", response_model=BaseSchema)
 def update_base(
@@ -579,36 +888,36 @@ def update_base(
     db: Session = Depends(get_db),
     current_user: UsuarioModel = Depends(get_current_user)
 ):
-    db_base = db.query(BaseDBModel).filter(BaseDBModel.id_base == id_base).first()
+    # Se carga con los tizados y fichas que lleva la respuesta
+    db_base = db.query(BaseDBModel).options(
+        joinedload(BaseDBModel.tizados),
+        joinedload(BaseDBModel.fichas)
+    ).filter(BaseDBModel.id_base == id_base).first()
     if not db_base:
         raise HTTPException(status_code=404, detail="Base no encontrada")
     
     datos_anteriores = model_to_dict(db_base)
     
-    # Guardar imagen anterior para comparar
-    old_imagen = db_base.imagen
+    # Guardar imagen y patrón anteriores para comparar
+    old_files = {"imagen": db_base.imagen, "patron": db_base.patron}
     new_data = base.model_dump(exclude_unset=True)
     
-    for key, value in new_data.items():
-        setattr(db_base, key, value)
-    
-    db.commit()
-    
-    # Si había imagen anterior y ahora cambió (incluyendo a None/vacío), eliminar de R2
-    new_imagen = db_base.imagen
-    if old_imagen and old_imagen != new_imagen:
-        print(f"🗑️ Eliminando imagen anterior: {old_imagen} (nueva: {new_imagen})")
-        delete_file_from_r2(old_imagen)
-    
-    audit_update(db, current_user, "bases", datos_anteriores, db_base, id_base,
-                 f"Editó base modelo: {db_base.modelo or 'Sin modelo'}",
-                 get_client_ip(request), get_user_agent(request))
-    
-    base_result = db.query(BaseDBModel).options(
-        joinedload(BaseDBModel.tizados),
-        joinedload(BaseDBModel.fichas)
-    ).filter(BaseDBModel.id_base == id_base).first()
-    return base_result
+    with unit_of_work(db):
+        for key, value in new_data.items():
+            setattr(db_base, key, value)
+        
+        # Si había archivo anterior y ahora cambió (incluyendo a None/vacío), encolarlo para eliminar
+        for campo, old_file in old_files.items():
+            new_file = getattr(db_base, campo)
+            if old_file and old_file != new_file:
+                print(f"🗑️ Eliminando {campo} anterior: {old_file} (nuevo: {new_file})")
+                enqueue_file_deletion(db, old_file)
+        
+        audit_update(db, current_user, "bases", datos_anteriores, db_base, id_base,
+                     f"Editó base modelo: {db_base.modelo or 'Sin modelo'}",
+                     get_client_ip(request), get_user_agent(request))
+    deletion_worker.notify()
+    return db_base
 
 @api_router.delete("/bases/{id_base}")
 def delete_base(
@@ -621,51 +930,39 @@ def delete_base(
     if not db_base:
         raise HTTPException(status_code=404, detail="Base no encontrada")
     
-    # Recopilar archivos para eliminar de R2 (cascada)
-    files_to_delete = []
-    
-    # Imagen de la base
-    if db_base.imagen:
-        files_to_delete.append(db_base.imagen)
-    
-    # Archivos de fichas relacionadas
-    fichas = db.query(FichaModel).filter(FichaModel.id_base == id_base).all()
-    for ficha in fichas:
-        if ficha.archivo:
-            files_to_delete.append(ficha.archivo)
-    
-    # Archivos de tizados relacionados
-    tizados = db.query(TizadoModel).filter(TizadoModel.id_base == id_base).all()
-    for tizado in tizados:
-        if tizado.archivo:
-            files_to_delete.append(tizado.archivo)
+    # Recopilar archivos para eliminar (cascada)
+    files_to_delete = collect_base_files(db_base)
     
     modelo = db_base.modelo or 'Sin modelo'
-    audit_delete(db, current_user, "bases", db_base, id_base,
-                 f"Eliminó base modelo: {modelo}",
-                 get_client_ip(request), get_user_agent(request))
-    
-    # Eliminar fichas y tizados primero (cascada manual)
-    db.query(FichaModel).filter(FichaModel.id_base == id_base).delete()
-    db.query(TizadoModel).filter(TizadoModel.id_base == id_base).delete()
-    
-    db.delete(db_base)
-    db.commit()
-    
-    # Eliminar archivos de R2 después del commit
-    deleted_files = delete_multiple_files_from_r2(files_to_delete)
+    with unit_of_work(db):
+        audit_delete(db, current_user, "bases", db_base, id_base,
+                     f"Eliminó base modelo: {modelo}",
+                     get_client_ip(request), get_user_agent(request))
+        
+        # Los archivos se eliminan en segundo plano, en la misma transacción que la base
+        deleted_files = enqueue_file_deletions(db, files_to_delete)
+        
+        # Las fichas y tizados ya cargados en collect_base_files se borran en cascada
+        db.delete(db_base)
+    deletion_worker.notify()
     
     return {"message": "Base eliminada", "archivos_eliminados": deleted_files}
 
 # TIZADO Endpoints
-@api_router.get("/tizados", response_model=List[Tizado])
-def get_tizados(db: Session = Depends(get_db)):
-    tizados = db.query(TizadoModel).all()
-    return tizados
-
-@api_router.get("/tizados/{id_tizado}", response_model=Tizado)
-def get_tizado(id_tizado: int, db: Session = Depends(get_db)):
-    tizado = db.query(TizadoModel).filter(TizadoModel.id_tizado == id_tizado).first()
+@api_router.get("/tizados", response_model=List[Tizado], dependencies=[Depends(versioned_async("tizados"))])
+async def get_tizados(
+    response: Response,
+    params: ListParams = Depends(list_params),
+    sparse: SparseParams = Depends(sparse_params),
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await list_response_async(
+        db, select(TizadoModel), [], TIZADO_LIST, TIZADO_FIELDS, params, sparse, response
+    )
+
+@api_router.get("/tizados/{id_tizado}", response_model=Tizado, dependencies=[Depends(versioned_async("tizados"))])
+async def get_tizado(id_tizado: int, db: AsyncSession = Depends(get_async_db)):
+    tizado = await db.get(TizadoModel, id_tizado)
     if not tizado:
         raise HTTPException(status_code=404, detail="Tizado no encontrado")
     return tizado
@@ -678,13 +975,12 @@ def create_tizado(
     current_user: UsuarioModel = Depends(get_current_user)
 ):
     db_tizado = TizadoModel(**tizado.model_dump())
-    db.add(db_tizado)
-    db.commit()
-    db.refresh(db_tizado)
-    
-    audit_create(db, current_user, "tizados", db_tizado, db_tizado.id_tizado,
-                 f"Creó tizado ID: {db_tizado.id_tizado} (ancho: {db_tizado.ancho})",
-                 get_client_ip(request), get_user_agent(request))
+    with unit_of_work(db):
+        db.add(db_tizado)
+        db.flush()
+        audit_create(db, current_user, "tizados", db_tizado, db_tizado.id_tizado,
+                     f"Creó tizado ID: {db_tizado.id_tizado} (ancho: {db_tizado.ancho})",
+                     get_client_ip(request), get_user_agent(request))
     return db_tizado
 
 @api_router.put("/tizados/{id_tizado}", response_model=Tizado)
@@ -700,21 +996,20 @@ def update_tizado(
         raise HTTPException(status_code=404, detail="Tizado no encontrado")
     
     datos_anteriores = model_to_dict(db_tizado)
-    old_archivo = db_tizado.archivo
-    
-    for key, value in tizado.model_dump(exclude_unset=True).items():
-        setattr(db_tizado, key, value)
-    
-    db.commit()
-    db.refresh(db_tizado)
+    old_archivo = db_tizado.archivo_tizado
     
-    # Si el archivo cambió y había uno anterior, eliminar de R2
-    if old_archivo and old_archivo != db_tizado.archivo:
-        delete_file_from_r2(old_archivo)
-    
-    audit_update(db, current_user, "tizados", datos_anteriores, db_tizado, id_tizado,
-                 f"Editó tizado ID: {id_tizado}",
-                 get_client_ip(request), get_user_agent(request))
+    with unit_of_work(db):
+        for key, value in tizado.model_dump(exclude_unset=True).items():
+            setattr(db_tizado, key, value)
+        
+        # Si el archivo cambió y había uno anterior, encolarlo para eliminar
+        if old_archivo and old_archivo != db_tizado.archivo_tizado:
+            enqueue_file_deletion(db, old_archivo)
+        
+        audit_update(db, current_user, "tizados", datos_anteriores, db_tizado, id_tizado,
+                     f"Editó tizado ID: {id_tizado}",
+                     get_client_ip(request), get_user_agent(request))
+    deletion_worker.notify()
     return db_tizado
 
 @api_router.delete("/tizados/{id_tizado}")
@@ -728,31 +1023,33 @@ def delete_tizado(
     if not db_tizado:
         raise HTTPException(status_code=404, detail="Tizado no encontrado")
     
-    # Guardar archivo para eliminar
-    archivo_to_delete = db_tizado.archivo
-    
-    audit_delete(db, current_user, "tizados", db_tizado, id_tizado,
-                 f"Eliminó tizado ID: {id_tizado}",
-                 get_client_ip(request), get_user_agent(request))
-    
-    db.delete(db_tizado)
-    db.commit()
-    
-    # Eliminar archivo de R2
-    if archivo_to_delete:
-        delete_file_from_r2(archivo_to_delete)
+    with unit_of_work(db):
+        audit_delete(db, current_user, "tizados", db_tizado, id_tizado,
+                     f"Eliminó tizado ID: {id_tizado}",
+                     get_client_ip(request), get_user_agent(request))
+        
+        # El archivo se elimina en segundo plano, en la misma transacción que el tizado
+        enqueue_file_deletion(db, db_tizado.archivo_tizado)
+        db.delete(db_tizado)
+    deletion_worker.notify()
     
     return {"message": "Tizado eliminado"}
 
 # FICHA Endpoints
-@api_router.get("/fichas", response_model=List[Ficha])
-def get_fichas(db: Session = Depends(get_db)):
-    fichas = db.query(FichaModel).all()
-    return fichas
+@api_router.get("/fichas", response_model=List[Ficha], dependencies=[Depends(versioned_async("fichas"))])
+async def get_fichas(
+    response: Response,
+    params: ListParams = Depends(list_params),
+    sparse: SparseParams = Depends(sparse_params),
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await list_response_async(
+        db, select(FichaModel), [], FICHA_LIST, FICHA_FIELDS, params, sparse, response
+    )
 
-@api_router.get("/fichas/base/{id_base}", response_model=List[Ficha])
-def get_fichas_by_base(id_base: int, db: Session = Depends(get_db)):
-    fichas = db.query(FichaModel).filter(FichaModel.id_base == id_base).all()
+@api_router.get("/fichas/base/{id_base}", response_model=List[Ficha], dependencies=[Depends(versioned_async("fichas"))])
+async def get_fichas_by_base(id_base: int, db: AsyncSession = Depends(get_async_db)):
+    fichas = (await db.scalars(select(FichaModel).filter(FichaModel.id_base == id_base))).all()
     return fichas
 
 @api_router.post("/fichas", response_model=Ficha)
@@ -763,13 +1060,12 @@ def create_ficha(
     current_user: UsuarioModel = Depends(get_current_user)
 ):
     db_ficha = FichaModel(**ficha.model_dump())
-    db.add(db_ficha)
-    db.commit()
-    db.refresh(db_ficha)
-    
-    audit_create(db, current_user, "fichas", db_ficha, db_ficha.id_ficha,
-                 f"Creó ficha: {db_ficha.nombre_ficha or 'Sin nombre'}",
-                 get_client_ip(request), get_user_agent(request))
+    with unit_of_work(db):
+        db.add(db_ficha)
+        db.flush()
+        audit_create(db, current_user, "fichas", db_ficha, db_ficha.id_ficha,
+                     f"Creó ficha: {db_ficha.nombre_ficha or 'Sin nombre'}",
+                     get_client_ip(request), get_user_agent(request))
     return db_ficha
 
 @api_router.put("/fichas/{id_ficha}", response_model=Ficha)
@@ -787,19 +1083,18 @@ def update_ficha(
     datos_anteriores = model_to_dict(db_ficha)
     old_archivo = db_ficha.archivo
     
-    for key, value in ficha.model_dump(exclude_unset=True).items():
-        setattr(db_ficha, key, value)
-    
-    db.commit()
-    db.refresh(db_ficha)
-    
-    # Si el archivo cambió y había uno anterior, eliminar de R2
-    if old_archivo and old_archivo != db_ficha.archivo:
-        delete_file_from_r2(old_archivo)
-    
-    audit_update(db, current_user, "fichas", datos_anteriores, db_ficha, id_ficha,
-                 f"Editó ficha: {db_ficha.nombre_ficha or 'Sin nombre'}",
-                 get_client_ip(request), get_user_agent(request))
+    with unit_of_work(db):
+        for key, value in ficha.model_dump(exclude_unset=True).items():
+            setattr(db_ficha, key, value)
+        
+        # Si el archivo cambió y había uno anterior, encolarlo para eliminar
+        if old_archivo and old_archivo != db_ficha.archivo:
+            enqueue_file_deletion(db, old_archivo)
+        
+        audit_update(db, current_user, "fichas", datos_anteriores, db_ficha, id_ficha,
+                     f"Editó ficha: {db_ficha.nombre_ficha or 'Sin nombre'}",
+                     get_client_ip(request), get_user_agent(request))
+    deletion_worker.notify()
     return db_ficha
 
 @api_router.delete("/fichas/{id_ficha}")
@@ -813,20 +1108,16 @@ def delete_ficha(
     if not db_ficha:
         raise HTTPException(status_code=404, detail="Ficha no encontrada")
     
-    # Guardar archivo para eliminar
-    archivo_to_delete = db_ficha.archivo
-    
     nombre = db_ficha.nombre_ficha or 'Sin nombre'
-    audit_delete(db, current_user, "fichas", db_ficha, id_ficha,
-                 f"Eliminó ficha: {nombre}",
-                 get_client_ip(request), get_user_agent(request))
-    
-    db.delete(db_ficha)
-    db.commit()
-    
-    # Eliminar archivo de R2
-    if archivo_to_delete:
-        delete_file_from_r2(archivo_to_delete)
+    with unit_of_work(db):
+        audit_delete(db, current_user, "fichas", db_ficha, id_ficha,
+                     f"Eliminó ficha: {nombre}",
+                     get_client_ip(request), get_user_agent(request))
+        
+        # El archivo se elimina en segundo plano, en la misma transacción que la ficha
+        enqueue_file_deletion(db, db_ficha.archivo)
+        db.delete(db_ficha)
+    deletion_worker.notify()
     
     return {"message": "Ficha eliminada"}
 
@@ -848,6 +1139,84 @@ def extract_original_name(stored_filename: str) -> str:
         return parts[1]  # Retorna nombreoriginal.ext
     return stored_filename  # Si no tiene el formato esperado, retorna el nombre tal cual
 
+# Configuración de subidas por bloques (R2 exige partes de al menos 5 MB, salvo la última)
+UPLOAD_CHUNK_SIZE = max(int(os.environ.get("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024)), 5 * 1024 * 1024)
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", 500 * 1024 * 1024))
+
+async def iter_upload_chunks(file: UploadFile, hasher=None, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    """Lee el archivo subido por bloques, calculando el hash y validando el tamaño máximo"""
+    total = 0
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > MAX_UPLOAD_SIZE:
+            raise HTTPException(
+                status_code=413,
+                detail=f"El archivo excede el tamaño máximo permitido ({MAX_UPLOAD_SIZE // (1024 * 1024)} MB)"
+            )
+        if hasher is not None:
+            hasher.update(chunk)
+        yield chunk
+
+async def hash_upload_file(file: UploadFile) -> tuple:
+    """Calcula el SHA-256 y el tamaño del archivo subido, y lo deja listo para releerlo"""
+    hasher = hashlib.sha256()
+    size = 0
+    async for chunk in iter_upload_chunks(file, hasher):
+        size += len(chunk)
+    await file.seek(0)
+    return hasher.hexdigest(), size
+
+def new_upload_filename(filename: str) -> str:
+    """Nombre guardado uuid_nombreoriginal.ext"""
+    # Limpiar y preservar el nombre original
+    original_name = sanitize_filename(filename)
+    unique_id = str(uuid.uuid4())[:8]  # Solo 8 caracteres del UUID
+    return f"{unique_id}_{original_name}"
+
+def register_upload(db: Session, request: Request, current_user: UsuarioModel, unique_filename: str,
+                    sha256: str, size: int, duplicado: bool) -> dict:
+    """Crea el alias del archivo subido, lo audita y arma la respuesta de /upload"""
+    with unit_of_work(db):
+        add_alias(db, unique_filename, sha256)
+        # Auditar subida de archivo
+        audit_file_action(db, current_user, AccionEnum.subir_archivo, unique_filename,
+                         ip_address=get_client_ip(request), user_agent=get_user_agent(request))
+    
+    return {
+        "filename": unique_filename,
+        "url": f"/api/files/{unique_filename}",
+        "size": size,
+        "sha256": sha256,
+        "duplicado": duplicado
+    }
+
+def register_existing_content(db: Session, request: Request, current_user: UsuarioModel, unique_filename: str,
+                              sha256: str, size: int, sesion: Optional[SubidaSesion] = None) -> Optional[dict]:
+    """
+    Si el contenido ya está almacenado suma la referencia y registra el alias en una transacción
+    (borrando la sesión de subida reanudable, si la hay).
+    Retorna None, sin dejar bloqueos abiertos, si hay que escribir el contenido.
+    """
+    if not acquire_content(db, sha256):
+        # El UPDATE sin filas bloquea el rango del índice: se suelta antes de escribir en el almacenamiento
+        db.rollback()
+        return None
+    if sesion is not None:
+        db.delete(sesion)
+    return register_upload(db, request, current_user, unique_filename, sha256, size, True)
+
+def register_new_content(db: Session, request: Request, current_user: UsuarioModel, unique_filename: str,
+                         sha256: str, size: int, content_type: Optional[str],
+                         sesion: Optional[SubidaSesion] = None) -> dict:
+    """Registra un contenido que ya se escribió en el almacenamiento junto con su alias"""
+    create_content(db, sha256, size, content_type)
+    if sesion is not None:
+        db.delete(sesion)
+    return register_upload(db, request, current_user, unique_filename, sha256, size, False)
+
 @api_router.post("/upload")
 async def upload_file(
     request: Request,
@@ -856,119 +1225,921 @@ async def upload_file(
     current_user: UsuarioModel = Depends(get_current_user)
 ):
     try:
-        # Limpiar y preservar el nombre original
-        original_name = sanitize_filename(file.filename)
-        unique_id = str(uuid.uuid4())[:8]  # Solo 8 caracteres del UUID
-        unique_filename = f"{unique_id}_{original_name}"
+        unique_filename = new_upload_filename(file.filename)
+        content_type = file.content_type or "application/octet-stream"
         
-        # Leer contenido del archivo
-        file_content = await file.read()
+        # El contenido se identifica por su hash: si ya existe solo se crea el alias
+        sha256, size = await hash_upload_file(file)
+        # Las escrituras en la base van al threadpool y ninguna transacción queda
+        # abierta mientras se espera al almacenamiento
+        registro = await run_in_threadpool(
+            register_existing_content, db, request, current_user, unique_filename, sha256, size
+        )
+        if registro is not None:
+            print(f"♻️ Contenido ya almacenado, solo se registra el alias: {unique_filename}")
+            return registro
         
-        if USE_R2:
-            # Subir a Cloudflare R2 usando boto3
-            s3_client.put_object(
-                Bucket=R2_BUCKET_NAME,
-                Key=unique_filename,
-                Body=file_content,
-                ContentType=file.content_type or "application/octet-stream"
-            )
-            print(f"✅ Archivo subido a R2: {unique_filename}")
-        else:
-            # Guardar localmente
-            file_path = UPLOAD_DIR / unique_filename
-            with open(file_path, 'wb') as f:
-                f.write(file_content)
-            print(f"✅ Archivo guardado localmente: {unique_filename}")
+        storage_key = content_key(sha256)
+        # R2 por partes (multipart) o disco local, sin cargar el archivo en memoria
+        await storage.put_stream(storage_key, iter_upload_chunks(file), content_type)
+        print(f"✅ Archivo guardado ({storage.name}): {unique_filename} -> {storage_key} ({size} bytes)")
+        # La referencia se toma recién cuando el objeto ya está escrito
+        return await run_in_threadpool(
+            register_new_content, db, request, current_user, unique_filename, sha256, size, content_type
+        )
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error en upload: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# RESUMABLE UPLOAD Endpoints
+# 1) POST /uploads  2) PUT /uploads/{id}/chunks/{n}  3) GET /uploads/{id}  4) POST /uploads/{id}/complete
+UPLOAD_SESSION_TTL = timedelta(hours=float(os.environ.get("UPLOAD_SESSION_TTL_HOURS", 24)))
+MAX_UPLOAD_SESSIONS_PER_USER = int(os.environ.get("MAX_UPLOAD_SESSIONS_PER_USER", 20))
+
+def discard_upload_session(storage_key: str, upload_id: str):
+    """Descarta las partes y la clave temporal de una subida (hilo de limpieza)"""
+    async def discard():
+        await storage.abort_multipart(storage_key, upload_id)
+        errores = await storage.delete_many([storage_key])
+        if errores:
+            raise RuntimeError(errores[storage_key])
+    asyncio.run(discard())
+
+upload_session_reaper = UploadSessionReaper(
+    SessionLocal, discard_upload_session,
+    interval=float(os.environ.get("UPLOAD_SESSION_CLEANUP_INTERVAL", 900))
+)
+
+def get_upload_session_or_404(db: Session, id_sesion: str, current_user: UsuarioModel) -> SubidaSesion:
+    sesion = get_session(db, id_sesion, current_user.id_usuario)
+    if sesion is None:
+        raise HTTPException(status_code=404, detail="Sesión de subida no encontrada o vencida")
+    return sesion
+
+# Pasos de base de datos de las subidas reanudables: los handlers son async por el
+# almacenamiento y el hash, así que estos corren con run_in_threadpool
+
+def save_upload_session(db: Session, sesion: SubidaSesion) -> dict:
+    try:
+        db.add(sesion)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return session_status(sesion)
+
+def save_upload_part(db: Session, sesion: SubidaSesion, numero: int, tamano: int, etag: str) -> dict:
+    record_part(db, sesion, numero, tamano, etag, UPLOAD_SESSION_TTL)
+    return session_status(sesion)
+
+def claim_upload_session(db: Session, id_sesion: str, current_user: UsuarioModel, completar: bool) -> SubidaSesion:
+    """Toma la sesión para completarla o cancelarla; sale con las partes ya cargadas"""
+    sesion = get_upload_session_or_404(db, id_sesion, current_user)
+    if completar:
+        faltantes = missing_parts(sesion)
+        if faltantes:
+            raise HTTPException(status_code=409, detail={"message": "Faltan partes", "missing_chunks": faltantes[:100]})
+    if not claim_finalize(db, id_sesion):
+        detail = "La subida ya se está finalizando" if completar else "La subida se está finalizando"
+        raise HTTPException(status_code=409, detail=detail)
+    db.refresh(sesion)
+    sesion.partes  # Se cargan aquí y no desde el event loop
+    return sesion
+
+def delete_upload_session(db: Session, sesion: SubidaSesion):
+    db.delete(sesion)
+    db.commit()
+
+@api_router.post("/uploads", status_code=201)
+async def create_upload_session(
+    subida: SubidaCreate,
+    db: Session = Depends(get_db),
+    current_user: UsuarioModel = Depends(get_current_user)
+):
+    """Crea una sesión de subida reanudable; el cliente sube luego las partes de chunk_size bytes"""
+    if subida.size < 0 or subida.size > MAX_UPLOAD_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"El archivo excede el tamaño máximo permitido ({MAX_UPLOAD_SIZE // (1024 * 1024)} MB)"
+        )
+    total_partes = part_count(subida.size, UPLOAD_CHUNK_SIZE)
+    if total_partes > MAX_PARTS:
+        raise HTTPException(status_code=413, detail="El archivo tiene demasiadas partes")
+    if await run_in_threadpool(count_active_sessions, db, current_user.id_usuario) >= MAX_UPLOAD_SESSIONS_PER_USER:
+        raise HTTPException(status_code=429, detail="Demasiadas subidas en curso")
+    
+    id_sesion = str(uuid.uuid4())
+    key = staging_key(id_sesion)
+    content_type = subida.content_type or mimetypes.guess_type(subida.filename)[0] or "application/octet-stream"
+    upload_id = await storage.create_multipart(key, content_type)
+    sesion = SubidaSesion(
+        id_sesion=id_sesion,
+        id_usuario=current_user.id_usuario,
+        nombre_original=subida.filename,
+        content_type=content_type,
+        tamano=subida.size,
+        tamano_parte=UPLOAD_CHUNK_SIZE,
+        total_partes=total_partes,
+        storage_key=key,
+        upload_id=upload_id,
+        expira=datetime.now(timezone.utc) + UPLOAD_SESSION_TTL
+    )
+    try:
+        estado = await run_in_threadpool(save_upload_session, db, sesion)
+    except Exception:
+        await storage.abort_multipart(key, upload_id)
+        raise
+    print(f"📤 Subida reanudable iniciada: {subida.filename} ({subida.size} bytes, {total_partes} partes)")
+    return estado
+
+@api_router.put("/uploads/{id_sesion}/chunks/{numero}")
+async def upload_chunk(
+    id_sesion: str,
+    numero: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: UsuarioModel = Depends(get_current_user)
+):
+    """Sube (o vuelve a subir) la parte `numero` (desde 0) con el cuerpo crudo de la petición"""
+    sesion = await run_in_threadpool(get_upload_session_or_404, db, id_sesion, current_user)
+    if sesion.estado != ESTADO_ACTIVA:
+        raise HTTPException(status_code=409, detail="La subida se está finalizando")
+    if numero < 0 or numero >= sesion.total_partes:
+        raise HTTPException(status_code=400, detail=f"Parte fuera de rango (0 a {sesion.total_partes - 1})")
+    
+    esperado = expected_part_size(sesion, numero)
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) != esperado:
+        raise HTTPException(status_code=400, detail=f"La parte {numero} debe tener {esperado} bytes")
+    data = bytearray()
+    async for chunk in request.stream():
+        data.extend(chunk)
+        if len(data) > esperado:
+            raise HTTPException(status_code=400, detail=f"La parte {numero} debe tener {esperado} bytes")
+    if len(data) != esperado:
+        raise HTTPException(status_code=400, detail=f"La parte {numero} debe tener {esperado} bytes")
+    
+    etag = await storage.put_part(sesion.storage_key, sesion.upload_id, numero + 1, bytes(data))
+    return await run_in_threadpool(save_upload_part, db, sesion, numero, len(data), etag)
+
+@api_router.get("/uploads/{id_sesion}")
+def get_upload_session(
+    id_sesion: str,
+    db: Session = Depends(get_db),
+    current_user: UsuarioModel = Depends(get_current_user)
+):
+    """Partes recibidas y offset, para retomar una subida interrumpida"""
+    return session_status(get_upload_session_or_404(db, id_sesion, current_user))
+
+@api_router.post("/uploads/{id_sesion}/complete")
+async def complete_upload_session(
+    id_sesion: str,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: UsuarioModel = Depends(get_current_user)
+):
+    """Une las partes y registra el archivo; responde igual que /upload"""
+    sesion = await run_in_threadpool(claim_upload_session, db, id_sesion, current_user, True)
+    key = sesion.storage_key
+    nombre_original, content_type, total_partes = sesion.nombre_original, sesion.content_type, sesion.total_partes
+    try:
+        if await storage.head(key) is None:
+            # Si ya existe, las partes se unieron en un intento anterior que falló después
+            await storage.complete_multipart(key, sesion.upload_id, [(p.numero + 1, p.etag) for p in sesion.partes])
         
-        # Auditar subida de archivo
-        audit_file_action(db, current_user, AccionEnum.subir_archivo, unique_filename,
-                         ip_address=get_client_ip(request), user_agent=get_user_agent(request))
+        # El hash del contenido se calcula leyendo el archivo ya unido
+        stored = await storage.open(key, chunk_size=UPLOAD_CHUNK_SIZE)
+        if stored is None:
+            raise RuntimeError("No se encontró el archivo unido")
+        hasher = hashlib.sha256()
+        size = 0
+        async for chunk in stored:
+            await run_in_threadpool(hasher.update, chunk)
+            size += len(chunk)
+        if size != sesion.tamano:
+            raise RuntimeError(f"Tamaño inesperado: {size} de {sesion.tamano} bytes")
+        sha256 = hasher.hexdigest()
+        
+        unique_filename = new_upload_filename(nombre_original)
+        # Igual que /upload: ninguna transacción queda abierta mientras se espera al almacenamiento
+        registro = await run_in_threadpool(
+            register_existing_content, db, request, current_user, unique_filename, sha256, size, sesion
+        )
+        if registro is not None:
+            print(f"♻️ Contenido ya almacenado, solo se registra el alias: {unique_filename}")
+            # La sesión ya no existe: si falla, la copia temporal solo se informa
+            errores = await storage.delete_many([key])
+            if errores:
+                print(f"⚠️ No se pudo borrar la subida temporal {key}: {errores[key]}")
+            return registro
         
-        return {"filename": unique_filename, "url": f"/api/files/{unique_filename}"}
+        storage_key = content_key(sha256)
+        await storage.move(key, storage_key)
+        print(f"✅ Archivo guardado ({storage.name}): {unique_filename} -> {storage_key} ({size} bytes, {total_partes} partes)")
+        return await run_in_threadpool(
+            register_new_content, db, request, current_user, unique_filename, sha256, size, content_type, sesion
+        )
     except Exception as e:
-        print(f"❌ Error en upload: {str(e)}")
+        print(f"❌ Error finalizando la subida {id_sesion}: {str(e)}")
+        # La sesión vuelve a quedar activa; si las partes ya se unieron, vence y se limpia
+        await run_in_threadpool(release_finalize, db, id_sesion, UPLOAD_SESSION_TTL)
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.delete("/uploads/{id_sesion}")
+async def cancel_upload_session(
+    id_sesion: str,
+    db: Session = Depends(get_db),
+    current_user: UsuarioModel = Depends(get_current_user)
+):
+    """Cancela una subida y descarta las partes recibidas"""
+    sesion = await run_in_threadpool(claim_upload_session, db, id_sesion, current_user, False)
+    await storage.abort_multipart(sesion.storage_key, sesion.upload_id)
+    await run_in_threadpool(delete_upload_session, db, sesion)
+    return {"message": "Subida cancelada", "upload_id": id_sesion}
+
 # FILE DOWNLOAD Endpoint
-@api_router.get("/files/{filename:path}")
-async def get_file(filename: str):
-    # Extraer nombre original para la descarga
+FILE_STREAM_CHUNK_SIZE = int(os.environ.get("FILE_STREAM_CHUNK_SIZE", 256 * 1024))
+# Modo de descarga desde R2: "proxy" (el backend transmite el archivo) o
+# "redirect" (redirige a una URL firmada de R2 y el backend no transfiere bytes)
+FILE_DOWNLOAD_MODE = os.environ.get("FILE_DOWNLOAD_MODE", "proxy").lower()
+PRESIGNED_URL_EXPIRES = int(os.environ.get("PRESIGNED_URL_EXPIRES", 300))  # segundos
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp']
+# Cache-Control de los archivos uuid_nombre (inmutables): 1 año por defecto
+FILE_MAX_AGE = int(os.environ.get("FILE_MAX_AGE", 365 * 24 * 3600))
+# uuid8_nombre.ext (actual) o uuid-completo.ext / uuid-completo_nombre.ext (archivos antiguos)
+UUID_FILENAME_PATTERN = re.compile(
+    r'^[0-9a-f]{8}(?:_|-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}(?:[_.]|$))', re.IGNORECASE
+)
+
+def get_disposition_type(filename: str) -> str:
+    """Imágenes se muestran en el navegador, el resto se descarga"""
+    return 'inline' if Path(filename).suffix.lower() in IMAGE_EXTENSIONS else 'attachment'
+
+def build_content_disposition(filename: str) -> str:
+    """Arma el header Content-Disposition con el nombre original del archivo"""
     original_name = extract_original_name(filename)
     # Codificar para el header (soporta caracteres especiales)
     encoded_name = urllib.parse.quote(original_name)
+    return f"{get_disposition_type(filename)}; filename=\"{original_name}\"; filename*=UTF-8''{encoded_name}"
+
+def mtime_size_etag(mtime: float, size: int) -> str:
+    """ETag a partir de fecha y tamaño (mismo formato que usa FileResponse)"""
+    etag_base = f"{float(mtime)}-{size}"
+    return f'"{hashlib.md5(etag_base.encode(), usedforsecurity=False).hexdigest()}"'
+
+def local_file_etag(stat_result: os.stat_result) -> str:
+    """ETag del archivo local"""
+    return mtime_size_etag(stat_result.st_mtime, stat_result.st_size)
+
+def r2_object_etag(last_modified: Optional[datetime], size: int) -> Optional[str]:
+    """
+    ETag de un objeto de R2 sin hash de contenido (archivos antiguos). Se
+    calcula igual que el de su copia en la caché local (que conserva la
+    fecha de R2), así no cambia según de dónde se sirva.
+    """
+    if last_modified is None:
+        return None
+    return mtime_size_etag(last_modified.timestamp(), size)
+
+def resolve_byte_range(request: Request, size: int, etag: Optional[str] = None,
+                       last_modified: Optional[datetime] = None) -> Optional[tuple]:
+    """
+    Interpreta los headers Range / If-Range de la petición.
+    
+    Retorna (inicio, fin) inclusivos si se debe responder 206, o None si se
+    debe enviar el archivo completo. Lanza 416 si el rango no es satisfacible.
+    """
+    range_header = request.headers.get("range")
+    if not range_header:
+        return None
+    
+    # If-Range: solo aplicar el rango si el archivo no cambió
+    if_range = request.headers.get("if-range")
+    if if_range:
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            # Comparación fuerte: los ETags débiles nunca coinciden
+            if not etag or if_range.startswith('W/') or if_range != etag:
+                return None
+        else:
+            try:
+                if_range_date = parsedate_to_datetime(if_range)
+            except (TypeError, ValueError):
+                return None
+            if last_modified is None or if_range_date is None:
+                return None
+            if int(last_modified.timestamp()) != int(if_range_date.timestamp()):
+                return None
+    
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        # Unidad desconocida o múltiples rangos: se envía el archivo completo
+        return None
+    
+    start_text, sep, end_text = ranges.strip().partition("-")
+    start_text, end_text = start_text.strip(), end_text.strip()
+    if not sep or (start_text and not start_text.isdigit()) or (end_text and not end_text.isdigit()):
+        return None
+    if start_text:
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+        if end_text and end < start:
+            return None
+    elif end_text:
+        # Rango sufijo: últimos N bytes ("-0" nunca es satisfacible)
+        suffix = int(end_text)
+        start = max(size - suffix, 0) if suffix else size
+        end = size - 1
+    else:
+        return None
+    
+    if start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Rango no satisfacible",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, min(end, size - 1)
+
+def iter_local_file(file_path: Path, start: int, end: int, chunk_size: int = FILE_STREAM_CHUNK_SIZE):
+    """Lee un archivo local por bloques entre dos posiciones (inclusivas)"""
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def is_not_modified(request: Request, etag: Optional[str], last_modified: Optional[datetime]) -> bool:
+    """Evalúa If-None-Match / If-Modified-Since (If-None-Match tiene prioridad)"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        if not etag:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        # Comparación débil: W/"x" coincide con "x"
+        current = etag[2:] if etag.startswith('W/') else etag
+        return any(
+            (tag.strip()[2:] if tag.strip().startswith('W/') else tag.strip()) == current
+            for tag in if_none_match.split(",")
+        )
     
-    if USE_R2:
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
         try:
-            # Obtener el archivo directamente de R2 y servirlo
-            response = s3_client.get_object(
-                Bucket=R2_BUCKET_NAME,
-                Key=filename
-            )
-            
-            # Obtener el contenido y tipo
-            file_content = response['Body'].read()
-            content_type = response.get('ContentType', 'application/octet-stream')
-            
-            # Determinar el content-disposition basado en la extensión
-            extension = Path(filename).suffix.lower()
-            if extension in ['.jpg', '.jpeg', '.png', '.gif', '.webp']:
-                disposition = 'inline'
-            else:
-                disposition = 'attachment'
-            
-            return StreamingResponse(
-                io.BytesIO(file_content),
-                media_type=content_type,
-                headers={
-                    'Content-Disposition': f"{disposition}; filename=\"{original_name}\"; filename*=UTF-8''{encoded_name}",
-                    'Content-Length': str(len(file_content))
-                }
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since is None:
+            return False
+        return int(last_modified.timestamp()) <= int(since.timestamp())
+    return False
+
+def file_cache_control(filename: str) -> str:
+    """Los archivos uuid_nombre nunca se reescriben: el navegador puede guardarlos sin revalidar"""
+    if UUID_FILENAME_PATTERN.match(filename):
+        return f"public, max-age={FILE_MAX_AGE}, immutable"
+    return "no-cache"
+
+def content_etag(contenido, width: Optional[int] = None) -> Optional[str]:
+    """ETag fuerte a partir del hash del contenido (sin consultar el almacenamiento)"""
+    if contenido is None:
+        return None
+    if width is not None:
+        return f'"{contenido.sha256}-w{width}"'
+    return f'"{contenido.sha256}"'
+
+def not_modified_response(etag: Optional[str], last_modified: Optional[str], cache_control: str) -> Response:
+    headers = {'Cache-Control': cache_control}
+    if etag:
+        headers['ETag'] = etag
+    if last_modified:
+        headers['Last-Modified'] = last_modified
+    return Response(status_code=304, headers=headers)
+
+def storage_object_etag(info: ObjectInfo) -> Optional[str]:
+    """ETag de un archivo sin hash de contenido (ver r2_object_etag)"""
+    return r2_object_etag(info.last_modified, info.size) or info.etag
+
+async def serve_local_file(request: Request, filename: str, file_path: Path, etag: Optional[str] = None):
+    """Sirve un archivo local, respondiendo 304 o 206 según los headers de la petición"""
+    stat_result = await aiofiles.os.stat(file_path)
+    size = stat_result.st_size
+    last_modified = datetime.fromtimestamp(stat_result.st_mtime, tz=timezone.utc)
+    etag = etag or local_file_etag(stat_result)
+    cache_control = file_cache_control(filename)
+    last_modified_header = formatdate(stat_result.st_mtime, usegmt=True)
+    
+    if is_not_modified(request, etag, last_modified):
+        return not_modified_response(etag, last_modified_header, cache_control)
+    
+    byte_range = resolve_byte_range(request, size, etag, last_modified)
+    
+    if byte_range is None:
+        return FileResponse(
+            file_path,
+            filename=extract_original_name(filename),
+            content_disposition_type=get_disposition_type(filename),
+            stat_result=stat_result,
+            headers={'Accept-Ranges': 'bytes', 'ETag': etag, 'Cache-Control': cache_control}
+        )
+    
+    start, end = byte_range
+    return StreamingResponse(
+        iter_local_file(file_path, start, end),
+        status_code=206,
+        media_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+        headers={
+            'Content-Disposition': build_content_disposition(filename),
+            'Content-Range': f"bytes {start}-{end}/{size}",
+            'Content-Length': str(end - start + 1),
+            'Accept-Ranges': 'bytes',
+            'ETag': etag,
+            'Last-Modified': last_modified_header,
+            'Cache-Control': cache_control
+        }
+    )
+
+async def serve_storage_file(request: Request, filename: str, key: str, etag: Optional[str] = None,
+                             source: Optional[Storage] = None) -> Optional[Response]:
+    """
+    Sirve un archivo del almacenamiento por bloques, sin cargarlo completo en
+    memoria. Retorna None si el archivo no existe.
+    """
+    source = source or storage
+    file_path = source.local_path(key)
+    if file_path is not None:
+        if await source.head(key) is None:
+            return None
+        return await serve_local_file(request, filename, file_path, etag)
+    
+    byte_range = None
+    cache_control = file_cache_control(filename)
+    conditional = request.headers.get("if-none-match") or request.headers.get("if-modified-since")
+    if request.headers.get("range") or (conditional and not etag):
+        # Se necesita el tamaño y el ETag para validar el rango o la petición condicional
+        info = await source.head(key)
+        if info is None:
+            return None
+        info_etag = etag or storage_object_etag(info)
+        if is_not_modified(request, info_etag, info.last_modified):
+            return not_modified_response(
+                info_etag,
+                format_datetime(info.last_modified, usegmt=True) if info.last_modified else None,
+                cache_control
             )
-        except s3_client.exceptions.NoSuchKey:
-            print(f"⚠️ Archivo no encontrado en R2: {filename}")
-            # Fallback a archivo local
-            file_path = UPLOAD_DIR / filename
-            if file_path.exists():
-                return FileResponse(file_path, filename=original_name)
-            raise HTTPException(status_code=404, detail="Archivo no encontrado")
-        except Exception as e:
-            print(f"⚠️ Error obteniendo de R2: {e}")
-            # Fallback a archivo local
-            file_path = UPLOAD_DIR / filename
-            if file_path.exists():
-                print(f"⚠️ R2 falló, sirviendo archivo local: {filename}")
-                return FileResponse(file_path, filename=original_name)
-            raise HTTPException(status_code=404, detail="Archivo no encontrado")
+        byte_range = resolve_byte_range(request, info.size, info_etag, info.last_modified)
+    
+    if byte_range is not None:
+        stored = await source.open(key, byte_range[0], byte_range[1], FILE_STREAM_CHUNK_SIZE)
     else:
-        # Servir archivo local
-        file_path = UPLOAD_DIR / filename
-        if not file_path.exists():
-            raise HTTPException(status_code=404, detail="Archivo no encontrado")
-        return FileResponse(file_path, filename=original_name)
+        stored = await source.open(key, chunk_size=FILE_STREAM_CHUNK_SIZE)
+    if stored is None:
+        return None
+    info = stored.info
+    
+    headers = {
+        'Content-Disposition': build_content_disposition(filename),
+        'Content-Length': str(byte_range[1] - byte_range[0] + 1 if byte_range else info.size),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': cache_control
+    }
+    etag = etag or storage_object_etag(info)
+    if etag:
+        headers['ETag'] = etag
+    if info.last_modified:
+        headers['Last-Modified'] = format_datetime(info.last_modified, usegmt=True)
+    if byte_range is not None:
+        headers['Content-Range'] = stored.content_range or f"bytes {byte_range[0]}-{byte_range[1]}/{info.size}"
+    
+    body = stored
+    if byte_range is None and file_cache and file_cache.accepts(info.size):
+        # Guardar en caché mientras se transmite (solo descargas completas)
+        writer = await run_in_threadpool(
+            file_cache.open_writer, key, info.size,
+            info.last_modified.timestamp() if info.last_modified else None
+        )
+        body = aiter_and_cache(stored, writer)
+    
+    return StreamingResponse(
+        body,
+        status_code=206 if byte_range is not None else 200,
+        media_type=info.content_type or 'application/octet-stream',
+        headers=headers
+    )
+
+async def serve_stored_file(request: Request, filename: str, key: str, etag: Optional[str] = None) -> Response:
+    """Sirve un archivo desde la caché local, el almacenamiento o uploads/ (archivos antiguos)"""
+    if file_cache:
+        cached_path = await run_in_threadpool(file_cache.get, key)
+        if cached_path:
+            return await serve_local_file(request, filename, cached_path, etag)
+    
+    try:
+        response = await serve_storage_file(request, filename, key, etag)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"⚠️ Error obteniendo de {storage.name}: {e}")
+        response = None
+    
+    if response is None and storage is not local_storage:
+        # Archivos antiguos subidos antes de usar R2
+        response = await serve_storage_file(request, filename, filename, etag, source=local_storage)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    return response
+
+async def open_stored_file(filename: str, key: str) -> Optional[StoredObject]:
+    """Abre un archivo guardado para leerlo (caché local, almacenamiento o uploads/)"""
+    if file_cache:
+        cached_path = await run_in_threadpool(file_cache.get, key)
+        if cached_path:
+            stored = await open_local_file(cached_path, key)
+            if stored is not None:
+                return stored
+    stored = await storage.open(key, chunk_size=FILE_STREAM_CHUNK_SIZE)
+    if stored is None and storage is not local_storage:
+        stored = await local_storage.open(filename, chunk_size=FILE_STREAM_CHUNK_SIZE)
+    return stored
+
+async def stat_stored_file(filename: str, key: str) -> Optional[ObjectInfo]:
+    """Metadatos de un archivo guardado (almacenamiento o uploads/)"""
+    info = await storage.head(key)
+    if info is None and storage is not local_storage:
+        info = await local_storage.head(filename)
+    return info
+
+def redirect_to_presigned_url(filename: str, key: str) -> RedirectResponse:
+    """Redirige a una URL firmada de R2 de corta duración"""
+    url = storage.presigned_url(key, PRESIGNED_URL_EXPIRES, {
+        'ResponseContentDisposition': build_content_disposition(filename),
+        'ResponseContentType': mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    })
+    # La URL expira, así que la redirección no debe quedar en caché
+    return RedirectResponse(url, status_code=307, headers={'Cache-Control': 'no-store'})
+
+async def read_variant_source(filename: str, key: str) -> bytes:
+    """Lee el archivo original completo para generar una variante"""
+    stored = await open_stored_file(filename, key)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    if stored.info.size > IMAGE_VARIANT_MAX_SOURCE_BYTES:
+        await stored.aclose()
+        raise HTTPException(status_code=413, detail="Imagen demasiado grande para generar la variante")
+    return await stored.read()
+
+async def generate_image_variant(filename: str, key: str, vkey: str, width: int) -> bytes:
+    """Genera la variante en el pool de procesos y la guarda junto a los originales"""
+    async def load_source():
+        return await read_variant_source(filename, key)
+    
+    async def store(data: bytes):
+        await storage.put_bytes(vkey, data, VARIANT_MEDIA_TYPE)
+    
+    try:
+        data = await variant_generator.generate(vkey, width, load_source, store)
+    except HTTPException:
+        raise
+    except (OSError, ValueError) as e:
+        # Pillow no pudo leer la imagen (formato no soportado, archivo dañado, etc.)
+        print(f"⚠️ No se pudo generar la variante {vkey}: {e}")
+        raise HTTPException(status_code=422, detail="No se pudo procesar la imagen")
+    print(f"🖼️ Variante generada: {vkey} ({len(data)} bytes)")
+    return data
+
+async def serve_image_variant(request: Request, filename: str, key: str, width: int,
+                              etag: Optional[str] = None):
+    """Sirve la variante de `width` px de ancho, generándola la primera vez"""
+    if width not in IMAGE_VARIANT_WIDTHS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Ancho no soportado. Valores permitidos: {', '.join(map(str, IMAGE_VARIANT_WIDTHS))}"
+        )
+    if not is_variant_source(filename):
+        raise HTTPException(status_code=400, detail="Solo se generan variantes de imágenes")
+    
+    vkey = variant_key(key, width)
+    vname = variant_filename(filename)
+    
+    if USE_R2 and FILE_DOWNLOAD_MODE == "redirect":
+        if await storage.head(vkey) is None:
+            await generate_image_variant(filename, key, vkey, width)
+        return redirect_to_presigned_url(vname, vkey)
+    
+    if file_cache:
+        cached_path = await run_in_threadpool(file_cache.get, vkey)
+        if cached_path:
+            return await serve_local_file(request, vname, cached_path, etag)
+    response = await serve_storage_file(request, vname, vkey, etag)
+    if response is not None:
+        return response
+    
+    data = await generate_image_variant(filename, key, vkey, width)
+    if storage.local_path(vkey) is not None:
+        return await serve_storage_file(request, vname, vkey, etag)
+    
+    # Primera vez en R2: se responde con la variante recién generada
+    headers = {
+        'Content-Disposition': build_content_disposition(vname),
+        'Cache-Control': file_cache_control(vname)
+    }
+    if etag:
+        headers['ETag'] = etag
+    return Response(data, media_type=VARIANT_MEDIA_TYPE, headers=headers)
+
+async def legacy_preview_key(filename: str, key: str) -> tuple:
+    """Clave de caché y tamaño de una planilla antigua (sin hash de contenido)"""
+    info = await stat_stored_file(filename, key)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    digest = hashlib.sha256(f"{key}:{storage_object_etag(info)}".encode()).hexdigest()
+    return f"legacy-{digest}", info.size
+
+async def local_copy_for_preview(filename: str, key: str) -> tuple:
+    """Ruta local de la planilla; si está solo en R2 se descarga a un temporal"""
+    file_path = storage.local_path(key)
+    if file_path is not None and await storage.head(key) is not None:
+        return file_path, False
+    
+    stored = await open_stored_file(filename, key)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    tmp_path = spreadsheet_previewer.cache_dir / f"{uuid.uuid4().hex}.download"
+    try:
+        async with aiofiles.open(tmp_path, 'wb') as f:
+            async for chunk in stored:
+                await f.write(chunk)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return tmp_path, True
+
+def check_file_name(filename: str):
+    """
+    Solo se sirven alias y nombres de uploads/: un nombre con ruta podría llegar
+    a claves internas (objects/, staging/, variants/) o a subcarpetas locales
+    """
+    if '/' in filename or '\\' in filename or filename.startswith('.'):
+        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+
+@api_router.get("/files/{filename}/preview")
+async def preview_file(
+    filename: str,
+    sheet: Optional[str] = Query(None, description="Nombre o índice de la hoja (0 = primera)"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    cell_range: Optional[str] = Query(None, alias="range", description="Rango de celdas, p. ej. A1:F50"),
+    db: Session = Depends(get_db)
+):
+    """Vista previa paginada de una planilla .xlsx / .xlsm"""
+    check_file_name(filename)
+    if not is_previewable(filename):
+        raise HTTPException(status_code=400, detail="Solo se pueden previsualizar planillas .xlsx / .xlsm")
+    
+    contenido = await run_in_threadpool(resolve_alias, db, filename)
+    key = contenido.storage_key if contenido else filename
+    if contenido:
+        cache_key, size = contenido.sha256, contenido.tamano
+    else:
+        cache_key, size = await legacy_preview_key(filename, key)
+    
+    parsed = await run_in_threadpool(spreadsheet_previewer.get_cached, cache_key)
+    if parsed is None:
+        if size is not None and size > PREVIEW_MAX_FILE_BYTES:
+            raise HTTPException(status_code=413, detail="La planilla es demasiado grande para la vista previa")
+        
+        try:
+            parsed = await spreadsheet_previewer.parse(
+                cache_key, lambda: local_copy_for_preview(filename, key)
+            )
+        except PreviewError as e:
+            print(f"⚠️ Vista previa de {filename}: {e}")
+            raise HTTPException(status_code=422, detail=str(e))
+        print(f"📊 Vista previa generada: {filename}")
+    
+    try:
+        page = paginate_sheet(parsed, sheet, offset, limit, cell_range)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"filename": filename, **page}
+
+@api_router.get("/files/{filename}")
+async def get_file(
+    filename: str,
+    request: Request,
+    w: Optional[int] = Query(None, description="Ancho de la variante WebP (p. ej. 256)"),
+    db: Session = Depends(get_db)
+):
+    check_file_name(filename)
+    # Los archivos nuevos son alias de un contenido deduplicado; los antiguos usan su nombre como clave
+    contenido = await run_in_threadpool(resolve_alias, db, filename)
+    key = contenido.storage_key if contenido else filename
+    
+    # Con el hash del contenido se responde 304 sin tocar R2 ni el disco
+    etag = content_etag(contenido, w)
+    if etag and request.headers.get("if-none-match") and is_not_modified(request, etag, None):
+        return not_modified_response(etag, None, file_cache_control(filename))
+    
+    if w is not None:
+        return await serve_image_variant(request, filename, key, w, etag)
+    
+    if USE_R2 and FILE_DOWNLOAD_MODE == "redirect":
+        return redirect_to_presigned_url(filename, key)
+    
+    return await serve_stored_file(request, filename, key, etag)
+
+# ZIP EXPORT Endpoints
+ZIP_FETCH_CONCURRENCY = int(os.environ.get("ZIP_FETCH_CONCURRENCY", 4))
+
+async def iter_stored_file(filename: str, key: str):
+    """Lee un archivo guardado por bloques (caché local, almacenamiento o uploads/)"""
+    stored = await open_stored_file(filename, key)
+    if stored is None:
+        raise FileNotFoundError(filename)
+    async for chunk in stored:
+        yield chunk
+
+def safe_folder_name(name: str) -> str:
+    return re.sub(r'[<>:"/\\|?*\s]+', '_', name).strip('_.') or "sin_nombre"
+
+def base_zip_entries(db_base: BaseDBModel, folder: str = "") -> list:
+    """(ruta en el ZIP, archivo) de una base con sus fichas y tizados"""
+    entries = []
+    for archivo in (db_base.imagen, db_base.patron):
+        if archivo:
+            entries.append((f"{folder}{extract_original_name(archivo)}", archivo))
+    for ficha in db_base.fichas:
+        if ficha.archivo:
+            entries.append((f"{folder}fichas/{extract_original_name(ficha.archivo)}", ficha.archivo))
+    for tizado in db_base.tizados:
+        if tizado.archivo_tizado:
+            entries.append((f"{folder}tizados/{extract_original_name(tizado.archivo_tizado)}", tizado.archivo_tizado))
+    return entries
+
+def build_zip_members(db: Session, entries: list) -> List[ZipMember]:
+    """Resuelve las claves de almacenamiento y evita nombres repetidos"""
+    contenidos = resolve_aliases(db, [get_file_key(archivo) for _, archivo in entries])
+    used = set()
+    members = []
+    for arcname, archivo in entries:
+        filename = get_file_key(archivo)
+        contenido = contenidos.get(filename)
+        members.append(ZipMember(
+            arcname=unique_arcname(arcname, used),
+            filename=filename,
+            key=contenido.storage_key if contenido else filename,
+            size=contenido.tamano if contenido else None
+        ))
+    return members
+
+def zip_response(members: List[ZipMember], zip_name: str) -> StreamingResponse:
+    return StreamingResponse(
+        stream_zip(members, lambda m: iter_stored_file(m.filename, m.key), concurrency=ZIP_FETCH_CONCURRENCY),
+        media_type="application/zip",
+        headers={
+            'Content-Disposition': f"attachment; filename=\"{zip_name}\"",
+            'Cache-Control': 'no-store'
+        }
+    )
+
+def get_base_zip_members(db: Session, id_base: int) -> List[ZipMember]:
+    db_base = db.query(BaseDBModel).options(
+        selectinload(BaseDBModel.fichas),
+        selectinload(BaseDBModel.tizados)
+    ).filter(BaseDBModel.id_base == id_base).first()
+    if not db_base:
+        raise HTTPException(status_code=404, detail="Base no encontrada")
+    return build_zip_members(db, base_zip_entries(db_base))
+
+def get_muestra_zip_members(db: Session, id_muestra_base: int) -> List[ZipMember]:
+    muestra = db.query(MuestraBaseModel).options(
+        selectinload(MuestraBaseModel.bases).selectinload(BaseDBModel.fichas),
+        selectinload(MuestraBaseModel.bases).selectinload(BaseDBModel.tizados)
+    ).filter(MuestraBaseModel.id_muestra_base == id_muestra_base).first()
+    if not muestra:
+        raise HTTPException(status_code=404, detail="Muestra base no encontrada")
+    
+    entries = []
+    if muestra.archivo_costo:
+        entries.append((extract_original_name(muestra.archivo_costo), muestra.archivo_costo))
+    for db_base in muestra.bases:
+        folder = f"base_{db_base.id_base}"
+        if db_base.modelo:
+            folder += f"_{safe_folder_name(db_base.modelo)}"
+        entries.extend(base_zip_entries(db_base, f"{folder}/"))
+    return build_zip_members(db, entries)
+
+@api_router.get("/bases/{id_base}/archivos.zip")
+async def download_base_zip(id_base: int, db: Session = Depends(get_db)):
+    """Descarga en un ZIP la imagen, el patrón, las fichas y los tizados de una base"""
+    members = await run_in_threadpool(get_base_zip_members, db, id_base)
+    if not members:
+        raise HTTPException(status_code=404, detail="La base no tiene archivos")
+    return zip_response(members, f"base_{id_base}.zip")
+
+@api_router.get("/muestras-base/{id_muestra_base}/archivos.zip")
+async def download_muestra_base_zip(id_muestra_base: int, db: Session = Depends(get_db)):
+    """Descarga en un ZIP el archivo de costo y los archivos de todas las bases de la muestra"""
+    members = await run_in_threadpool(get_muestra_zip_members, db, id_muestra_base)
+    if not members:
+        raise HTTPException(status_code=404, detail="La muestra base no tiene archivos")
+    return zip_response(members, f"muestra_base_{id_muestra_base}.zip")
 
 # FILE DELETE Endpoint
 @api_router.delete("/files/{filename}")
-async def delete_file(filename: str):
+def delete_file(filename: str, db: Session = Depends(get_db)):
     try:
-        if USE_R2:
-            # Eliminar de Cloudflare R2
-            s3_client.delete_object(
-                Bucket=R2_BUCKET_NAME,
-                Key=filename
-            )
-            print(f"✅ Archivo eliminado de R2: {filename}")
-        
-        # También eliminar de local si existe (por si hay copia)
-        file_path = UPLOAD_DIR / filename
-        if file_path.exists():
-            file_path.unlink()
-            print(f"✅ Archivo local eliminado: {filename}")
-        
+        # Se encola y el worker lo elimina de R2 / disco en segundo plano
+        enqueue_file_deletion(db, filename)
+        db.commit()
+        deletion_worker.notify()
         return {"message": "Archivo eliminado", "filename": filename}
     except Exception as e:
+        db.rollback()
         print(f"❌ Error eliminando archivo: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/storage/cache/stats")
+def get_file_cache_stats(current_user: UsuarioModel = Depends(require_admin)):
+    """Estadísticas de la caché local de archivos"""
+    if not file_cache:
+        return {"enabled": False}
+    return {"enabled": True, **file_cache.stats()}
+
+@api_router.get("/storage/delete-queue/stats")
+def get_delete_queue_stats(
+    db: Session = Depends(get_db),
+    current_user: UsuarioModel = Depends(require_admin)
+):
+    """Estado de la cola de eliminación de archivos"""
+    return {
+        **queue_stats(db),
+        "eliminados_proceso": deletion_worker.eliminados,
+        "fallidos_proceso": deletion_worker.fallidos
+    }
+
+@api_router.get("/storage/gc/stats")
+def get_gc_stats(
+    db: Session = Depends(get_db),
+    current_user: UsuarioModel = Depends(require_admin)
+):
+    """Avance del recolector de archivos huérfanos y estado de la cuarentena"""
+    return gc_stats(db)
+
+@api_router.get("/cache/catalogos/stats")
+def get_catalog_cache_stats(current_user: UsuarioModel = Depends(require_admin)):
+    """Aciertos y tiempo de reconstrucción de la caché de catálogos de este proceso"""
+    return catalog_cache.stats()
+
+@api_router.get("/search")
+def search_catalog(
+    q: str = Query(..., min_length=1, max_length=100),
+    tipos: Optional[str] = Query(None, description="Tipos separados por coma, p. ej. tela,base"),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    """Busca en telas, bases, tizados, fichas, marcas, tipos de producto y entalles"""
+    tipos_pedidos = [tipo.strip() for tipo in tipos.split(",") if tipo.strip()] if tipos else None
+    desconocidos = [tipo for tipo in tipos_pedidos or [] if tipo not in search_index.sources]
+    if desconocidos:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tipo desconocido: {', '.join(desconocidos)}. Tipos: {', '.join(search_index.sources)}"
+        )
+    search_index.refresh(db)
+    return search_index.search(q, tipos_pedidos, limit)
+
+@api_router.post("/search/rebuild")
+def rebuild_search_index(
+    db: Session = Depends(get_db),
+    current_user: UsuarioModel = Depends(require_admin)
+):
+    """Reconstruye desde cero el índice de búsqueda de este proceso"""
+    reconstruidos = search_index.rebuild(db)
+    return {"reconstruidos": reconstruidos, **search_index.stats()}
+
+@api_router.get("/search/stats")
+def get_search_stats(current_user: UsuarioModel = Depends(require_admin)):
+    return search_index.stats()
+
+@api_router.post("/storage/gc/run")
+def run_gc(
+    max_pages: int = Query(10, ge=1, le=1000),
+    current_user: UsuarioModel = Depends(require_admin)
+):
+    """Ejecuta un paso del recolector (hasta max_pages páginas por fase)"""
+    return orphan_collector.run_once(max_pages)
+
 # ==================== AUTH ENDPOINTS ====================
 
 @api_router.post("/auth/login", response_model=Token)
@@ -1191,8 +2362,13 @@ def get_historial(
     db: Session = Depends(get_db),
     current_user: UsuarioModel = Depends(require_admin)
 ):
-    """Obtiene el historial de movimientos con filtros opcionales"""
+    """
+    Obtiene el historial de movimientos con filtros opcionales.
+    Si el rango de fechas llega a meses archivados, después de los
+    movimientos de la tabla se devuelven los del archivo.
+    """
     query = db.query(HistorialMovimiento)
+    fecha_desde_dt = fecha_hasta_dt = None
     
     # Aplicar filtros
     if usuario:
@@ -1214,13 +2390,24 @@ def get_historial(
         except ValueError:
             pass
     
+    # Con cualquiera de las dos fechas: solo fecha_hasta ya alcanza a todos los meses anteriores
+    meses = archived_months(db, fecha_desde_dt, fecha_hasta_dt) if fecha_desde_dt or fecha_hasta_dt else []
+    # Lo archivado se lee solo del archivo, aunque el mes esté a medio borrar de la tabla
+    query = exclude_archived(query, meses)
+    
     # Ordenar por fecha descendente y paginar
     total = query.count()
+    offset = (page - 1) * page_size
     movimientos = query.order_by(desc(HistorialMovimiento.fecha_hora))\
-        .offset((page - 1) * page_size)\
+        .offset(offset)\
         .limit(page_size)\
         .all()
     
+    if meses and len(movimientos) < page_size:
+        filtro = ArchiveFilter(usuario, tabla, accion, fecha_desde_dt, fecha_hasta_dt)
+        movimientos += search_archive(
+            HISTORIAL_ARCHIVE_DIR, meses, filtro, max(offset - total, 0), page_size - len(movimientos)
+        )
     return movimientos
 
 @api_router.get("/historial/stats")
@@ -1266,9 +2453,25 @@ def get_historial_stats(
         "ultimos_7_dias": ultimos_7_dias,
         "por_tabla": {t: c for t, c in por_tabla},
         "por_accion": {str(a.value) if hasattr(a, 'value') else str(a): c for a, c in por_accion},
-        "por_usuario": {u: c for u, c in por_usuario}
+        "por_usuario": {u: c for u, c in por_usuario},
+        # Meses que ya no están en la tabla (no entran en los conteos de arriba)
+        "archivo": archive_stats(db)
     }
 
+@api_router.post("/historial/archivar", status_code=202)
+def archive_historial(current_user: UsuarioModel = Depends(require_admin)):
+    """Pide archivar ahora, en segundo plano, los meses que quedaron fuera de la ventana caliente"""
+    if not historial_archiver.trigger():
+        return {"message": "Ya se está archivando el historial", "iniciado": False}
+    return {"message": "Archivado del historial iniciado", "iniciado": True}
+
+@api_router.get("/historial/escritor/stats")
+def get_audit_writer_stats(current_user: UsuarioModel = Depends(require_admin)):
+    """Movimientos encolados, escritos y descartados por la escritura en lotes de este proceso"""
+    if not audit_writer:
+        return {"modo": AUDIT_WRITE_MODE}
+    return {"modo": AUDIT_WRITE_MODE, **audit_writer.stats()}
+
 @api_router.get("/historial/tablas")
 def get_historial_tablas(
     db: Session = Depends(get_db),
@@ -1280,6 +2483,33 @@ def get_historial_tablas(
         .all()
     return [t[0] for t in tablas]
 
+@api_router.get("/historial/registro/{tabla}/{id_registro}")
+def get_estado_registro(
+    tabla: str,
+    id_registro: int,
+    id_movimiento: Optional[int] = Query(None, description="Estado después de este movimiento"),
+    fecha: Optional[str] = Query(None, description="Estado a esta fecha (ISO format)"),
+    db: Session = Depends(get_db),
+    current_user: UsuarioModel = Depends(require_admin)
+):
+    """
+    Reconstruye el registro completo en un punto de su historia (por defecto, el último).
+    Si el punto cae en un mes archivado se lee el archivo de ese mes y de los
+    anteriores hasta encontrar el registro completo, que es más lento.
+    """
+    hasta_fecha = None
+    if fecha:
+        try:
+            hasta_fecha = datetime.fromisoformat(fecha.replace('Z', '+00:00'))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Fecha inválida")
+    estado = reconstruir_registro(db, tabla, id_registro, id_movimiento, hasta_fecha)
+    if estado is None:
+        estado = reconstruir_archivado(db, HISTORIAL_ARCHIVE_DIR, tabla, id_registro, id_movimiento, hasta_fecha)
+    if estado is None:
+        raise HTTPException(status_code=404, detail="No hay historial del registro hasta ese punto")
+    return estado
+
 @api_router.get("/historial/{id_movimiento}", response_model=HistorialSchema)
 def get_movimiento(
     id_movimiento: int,
@@ -1290,6 +2520,8 @@ def get_movimiento(
     movimiento = db.query(HistorialMovimiento)\
         .filter(HistorialMovimiento.id_movimiento == id_movimiento)\
         .first()
+    if not movimiento:
+        movimiento = find_archived(db, HISTORIAL_ARCHIVE_DIR, id_movimiento)
     
     if not movimiento:
         raise HTTPException(status_code=404, detail="Movimiento no encontrado")
@@ -1461,6 +2693,8 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    # Paginación de los listados (ver pagination.py)
+    expose_headers=["X-Next-Cursor", "X-Total-Count"],
 )
 
 logging.basicConfig(
@@ -1473,9 +2707,28 @@ logger = logging.getLogger(__name__)
 def startup():
     # Las tablas son creadas manualmente por el usuario
     # Base.metadata.create_all(bind=engine)
+    deletion_worker.start()
+    orphan_collector.start()
+    upload_session_reaper.start()
+    historial_archiver.start()
+    if audit_writer:
+        audit_writer.start()
+        set_audit_writer(audit_writer)
     logger.info("Sistema iniciado - conexión a base de datos establecida")
 
 @app.on_event("shutdown")
-def shutdown():
+async def shutdown():
+    await run_in_threadpool(orphan_collector.stop)
+    await run_in_threadpool(upload_session_reaper.stop)
+    await run_in_threadpool(deletion_worker.stop)
+    await run_in_threadpool(historial_archiver.stop)
+    if audit_writer:
+        # Los movimientos que sigan llegando se escriben en el momento
+        set_audit_writer(None)
+        await run_in_threadpool(audit_writer.stop)
+    variant_generator.shutdown()
+    spreadsheet_previewer.shutdown()
+    await storage.close()
     engine.dispose()
+    await async_engine.dispose()
     logger.info("Database connection closed")
@@ -0,0 +1,148 @@
+"""
+Campos parciales (fields=) y relaciones a pedido (expand=) en los endpoints de lectura
+Las columnas pedidas se cargan con load_only y solo las relaciones pedidas
+se cargan (muchos a uno en el mismo SELECT, colecciones con selectinload),
+así lo que no se pide no se lee de la base de datos ni genera consultas.
+
+    /api/bases?fields=id_base,modelo
+    /api/bases?expand=tizados&fields=modelo,tizados.ancho
+    /api/muestras-base?expand=tela,bases.tizados&fields=aprobado,tela.nombre_tela
+
+Sin fields ni expand los endpoints responden igual que siempre.
+"""
+from fastapi import HTTPException, Query, Response
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import joinedload, load_only, selectinload
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+from serializers import column_converters, to_json_dict
+
+class SparseParams(NamedTuple):
+    fields: Optional[str] = None
+    expand: Optional[str] = None
+
+    @property
+    def active(self) -> bool:
+        return bool(self.fields or self.expand)
+
+def sparse_params(
+    fields: Optional[str] = Query(None, description="Columnas a devolver, p. ej. id_base,modelo,tizados.ancho"),
+    expand: Optional[str] = Query(None, description="Relaciones a incluir, p. ej. tela,bases.tizados")
+) -> SparseParams:
+    return SparseParams(fields, expand)
+
+class ModelSpec:
+    """Columnas y relaciones que se pueden pedir de un modelo"""
+
+    def __init__(self, model, relations: Optional[Dict[str, "ModelSpec"]] = None):
+        self.model = model
+        mapper = model.__mapper__
+        self.columns = {attr.key: getattr(model, attr.key) for attr in mapper.column_attrs}
+        self.pk = mapper.primary_key[0].key
+        self.relations = relations or {}
+        self.many = {name: mapper.relationships[name].uselist for name in self.relations}
+        # Decimal como texto, igual que en las respuestas con response_model
+        self.converters = column_converters(model, str)
+
+class Selection:
+    """Columnas (None = todas) y relaciones pedidas para un nivel del árbol"""
+
+    def __init__(self, spec: ModelSpec):
+        self.spec = spec
+        self.columns: Optional[Set[str]] = None
+        self.children: Dict[str, "Selection"] = {}
+
+def _split(value: Optional[str]) -> List[str]:
+    return [part.strip() for part in (value or "").split(",") if part.strip()]
+
+def parse_selection(spec: ModelSpec, params: SparseParams) -> Selection:
+    """Arma el árbol de lo pedido validando nombres de columnas y relaciones"""
+    root = Selection(spec)
+
+    def node_for(path: List[str]) -> Selection:
+        node = root
+        for name in path:
+            if name not in node.spec.relations:
+                validas = ", ".join(node.spec.relations) or "ninguna"
+                raise HTTPException(status_code=400, detail=f"Relación desconocida '{name}'. Relaciones: {validas}")
+            if name not in node.children:
+                node.children[name] = Selection(node.spec.relations[name])
+            node = node.children[name]
+        return node
+
+    for path in _split(params.expand):
+        node_for(path.split("."))
+
+    for field in _split(params.fields):
+        *path, column = field.split(".")
+        node = node_for(path)
+        if column not in node.spec.columns:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Campo desconocido '{field}'. Campos: {', '.join(node.spec.columns)}"
+            )
+        if node.columns is None:
+            node.columns = {node.spec.pk}
+        node.columns.add(column)
+    return root
+
+def _loaded_columns(node: Selection, extra: Iterable[str] = ()) -> Optional[list]:
+    if node.columns is None:
+        return None
+    return [node.spec.columns[name] for name in sorted(node.columns | set(extra))]
+
+def _child_options(node: Selection) -> list:
+    options = []
+    for name, child in node.children.items():
+        attr = getattr(node.spec.model, name)
+        # Muchos a uno en el mismo SELECT; colecciones en una consulta IN aparte
+        loader = selectinload(attr) if node.spec.many[name] else joinedload(attr)
+        columns = _loaded_columns(child)
+        if columns:
+            loader = loader.load_only(*columns)
+        nested = _child_options(child)
+        if nested:
+            loader = loader.options(*nested)
+        options.append(loader)
+    return options
+
+def load_options(selection: Selection, extra_columns: Iterable[str] = ()) -> list:
+    """
+    Opciones de carga para la consulta. extra_columns se cargan aunque no se
+    pidan (p. ej. la columna de orden para el cursor de paginación).
+    """
+    options = []
+    columns = _loaded_columns(selection, extra_columns)
+    if columns:
+        options.append(load_only(*columns))
+    return options + _child_options(selection)
+
+def _to_dict(obj, node: Selection) -> dict:
+    if node.columns is None:
+        data = to_json_dict(obj)
+    else:
+        # En el orden de las columnas del modelo
+        data = {}
+        for name, converter in node.spec.converters.items():
+            if name not in node.columns:
+                continue
+            value = getattr(obj, name)
+            data[name] = converter(value) if converter is not None and value is not None else value
+    for name, child in node.children.items():
+        value = getattr(obj, name)
+        if node.spec.many[name]:
+            data[name] = [_to_dict(item, child) for item in value]
+        else:
+            data[name] = _to_dict(value, child) if value is not None else None
+    return data
+
+def serialize(objs, selection: Selection):
+    """Convierte a JSON solo lo pedido (sin tocar relaciones no cargadas)"""
+    if isinstance(objs, list):
+        return [_to_dict(obj, selection) for obj in objs]
+    return _to_dict(objs, selection)
+
+def sparse_response(objs, selection: Selection, response: Optional[Response] = None) -> JSONResponse:
+    """Respuesta JSON con lo pedido, conservando los headers ya fijados (paginación, ETag)"""
+    headers = dict(response.headers) if response is not None else None
+    return JSONResponse(serialize(objs, selection), headers=headers)
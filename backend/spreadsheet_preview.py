@@ -0,0 +1,297 @@
+"""
+Vista previa de planillas (.xlsx / .xlsm)
+Las planillas se leen con openpyxl en modo read-only en un pool de procesos,
+con límite de tiempo y de memoria por archivo. El resultado se guarda en disco
+(gzip) por hash de contenido, así una planilla se procesa una sola vez y las
+páginas siguientes se sirven desde la caché.
+"""
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+import asyncio
+import gzip
+import json
+import multiprocessing
+import os
+import threading
+import uuid
+
+PREVIEW_EXTENSIONS = ['.xlsx', '.xlsm']
+CACHE_FORMAT_VERSION = 1
+
+class PreviewError(Exception):
+    """La planilla no se pudo procesar (archivo dañado, muy grande o muy lento)"""
+
+def is_previewable(filename: str) -> bool:
+    return Path(filename).suffix.lower() in PREVIEW_EXTENSIONS
+
+def _limit_worker_memory(max_memory_bytes: Optional[int]):
+    """Inicializador del pool: limita la memoria de cada proceso"""
+    if not max_memory_bytes:
+        return
+    try:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory_bytes, max_memory_bytes))
+    except (ImportError, ValueError, OSError) as e:
+        print(f"⚠️ No se pudo limitar la memoria del proceso de vistas previas: {e}")
+
+def _raise_timeout(signum, frame):
+    raise TimeoutError("Tiempo máximo de procesamiento excedido")
+
+def json_cell(value):
+    """Convierte el valor de una celda a un tipo serializable en JSON"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, timedelta):
+        return str(value)
+    return str(value)
+
+def parse_workbook(path: str, max_rows: int, max_cols: int, timeout: Optional[int] = None) -> dict:
+    """
+    Lee todas las hojas de una planilla (hasta max_rows x max_cols por hoja).
+    Se ejecuta en un proceso del pool.
+    """
+    import signal
+    from openpyxl import load_workbook
+
+    if timeout:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.alarm(timeout)
+    try:
+        # Se abre el archivo directamente: los contenidos deduplicados no tienen extensión
+        source = open(path, 'rb')
+        wb = load_workbook(source, read_only=True, data_only=True, keep_links=False)
+        try:
+            sheets = []
+            for ws in wb.worksheets:
+                rows = []
+                total_rows = 0
+                max_column = 0
+                truncated = False
+                for row in ws.iter_rows(values_only=True):
+                    total_rows += 1
+                    if total_rows > max_rows:
+                        truncated = True
+                        break
+                    if len(row) > max_cols:
+                        truncated = True
+                    values = [json_cell(v) for v in row[:max_cols]]
+                    # Quitar las celdas vacías del final para ahorrar espacio
+                    while values and values[-1] in (None, ""):
+                        values.pop()
+                    max_column = max(max_column, len(values))
+                    rows.append(values)
+                while rows and not rows[-1]:
+                    rows.pop()
+                sheets.append({
+                    "name": ws.title,
+                    "rows": rows,
+                    "row_count": len(rows),
+                    "column_count": max_column,
+                    "truncated": truncated
+                })
+        finally:
+            wb.close()
+            source.close()
+    finally:
+        if timeout:
+            signal.alarm(0)
+    return {"version": CACHE_FORMAT_VERSION, "sheets": sheets}
+
+class SpreadsheetPreviewer:
+    """Procesa planillas en un pool de procesos y guarda el resultado por hash"""
+
+    def __init__(self, cache_dir: Path, max_workers: int = 2, timeout: int = 30,
+                 max_memory_bytes: Optional[int] = 512 * 1024 * 1024,
+                 max_rows: int = 5000, max_cols: int = 100, memory_entries: int = 8):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_memory_bytes = max_memory_bytes
+        self.max_rows = max_rows
+        self.max_cols = max_cols
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()  # Últimas planillas usadas (ya descomprimidas)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.parsed = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_limit_worker_memory,
+                initargs=(self.max_memory_bytes,)
+            )
+        return self._pool
+
+    def _cache_path(self, cache_key: str) -> Path:
+        return self.cache_dir / f"{cache_key}.json.gz"
+
+    def _remember(self, cache_key: str, parsed: dict):
+        with self._lock:
+            self._memory[cache_key] = parsed
+            self._memory.move_to_end(cache_key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get_cached(self, cache_key: str) -> Optional[dict]:
+        """Resultado ya procesado (memoria o disco), o None"""
+        with self._lock:
+            parsed = self._memory.get(cache_key)
+            if parsed is not None:
+                self._memory.move_to_end(cache_key)
+                return parsed
+        try:
+            with gzip.open(self._cache_path(cache_key), "rt", encoding="utf-8") as f:
+                parsed = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Vista previa en caché dañada, se vuelve a generar: {e}")
+            return None
+        if parsed.get("version") != CACHE_FORMAT_VERSION:
+            return None
+        self._remember(cache_key, parsed)
+        return parsed
+
+    def _store(self, cache_key: str, parsed: dict):
+        path = self._cache_path(cache_key)
+        tmp_path = path.with_name(f"{uuid.uuid4().hex}.tmp")
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(parsed, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    async def parse(
+        self,
+        cache_key: str,
+        load_source: Callable[[], Awaitable[Tuple[Path, bool]]]
+    ) -> dict:
+        """
+        Procesa la planilla y guarda el resultado. load_source retorna
+        (ruta local, es_temporal); los temporales se borran al terminar.
+        """
+        pending = self._in_flight.get(cache_key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._in_flight[cache_key] = future
+        try:
+            path, is_temp = await load_source()
+            try:
+                parsed = await asyncio.wait_for(
+                    loop.run_in_executor(
+                        self._get_pool(), parse_workbook,
+                        str(path), self.max_rows, self.max_cols, self.timeout
+                    ),
+                    # Respaldo por si el proceso no responde a la alarma
+                    timeout=self.timeout + 10 if self.timeout else None
+                )
+            except (TimeoutError, asyncio.TimeoutError):
+                raise PreviewError("La planilla tardó demasiado en procesarse")
+            except MemoryError:
+                raise PreviewError("La planilla es demasiado grande para la vista previa")
+            except BrokenProcessPool:
+                self.shutdown()
+                raise PreviewError("El proceso de vista previa terminó inesperadamente")
+            except Exception as e:
+                # Archivo dañado o que no es una planilla válida
+                raise PreviewError(f"No se pudo leer la planilla: {e}")
+            finally:
+                if is_temp:
+                    path.unlink(missing_ok=True)
+
+            await loop.run_in_executor(None, self._store, cache_key, parsed)
+            self._remember(cache_key, parsed)
+            self.parsed += 1
+            future.set_result(parsed)
+            return parsed
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            self._in_flight.pop(cache_key, None)
+
+    def invalidate(self, cache_key: str):
+        with self._lock:
+            self._memory.pop(cache_key, None)
+        self._cache_path(cache_key).unlink(missing_ok=True)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+def paginate_sheet(parsed: dict, sheet: Optional[str], offset: int, limit: int,
+                   cell_range: Optional[str] = None) -> dict:
+    """
+    Arma una página de una hoja.
+    sheet: nombre o índice (0 = primera hoja). cell_range: rango A1 (p. ej. "B2:F100").
+    """
+    from openpyxl.utils.cell import get_column_letter, range_boundaries
+
+    sheets = parsed["sheets"]
+    if not sheets:
+        raise ValueError("La planilla no tiene hojas")
+    if sheet is None:
+        data = sheets[0]
+    elif sheet.isdigit() and int(sheet) < len(sheets):
+        data = sheets[int(sheet)]
+    else:
+        data = next((s for s in sheets if s["name"] == sheet), None)
+        if data is None:
+            raise LookupError(f"Hoja no encontrada: {sheet}")
+
+    # Rango pedido (1-based, inclusivo), acotado a lo que tiene la hoja
+    min_col, min_row, max_col, max_row = 1, 1, data["column_count"], data["row_count"]
+    if cell_range:
+        try:
+            r_min_col, r_min_row, r_max_col, r_max_row = range_boundaries(cell_range.upper())
+        except (TypeError, ValueError):
+            raise ValueError(f"Rango inválido: {cell_range}")
+        min_col, min_row = r_min_col or 1, r_min_row or 1
+        max_col = min(r_max_col or max_col, max_col)
+        max_row = min(r_max_row or max_row, max_row)
+
+    total_rows = max(max_row - min_row + 1, 0)
+    first = min_row + offset
+    last = min(first + limit - 1, max_row)
+    width = max(max_col - min_col + 1, 0)
+    rows = []
+    for row_number in range(first, last + 1):
+        row = data["rows"][row_number - 1] if row_number - 1 < len(data["rows"]) else []
+        cells = row[min_col - 1:max_col]
+        rows.append(cells + [None] * (width - len(cells)))
+
+    return {
+        "sheets": [
+            {"name": s["name"], "rows": s["row_count"], "columns": s["column_count"], "truncated": s["truncated"]}
+            for s in sheets
+        ],
+        "sheet": data["name"],
+        "range": cell_range.upper() if cell_range else None,
+        "offset": offset,
+        "limit": limit,
+        "total_rows": total_rows,
+        "has_more": offset + len(rows) < total_rows,
+        "start_row": first,
+        "columns": [get_column_letter(c) for c in range(min_col, min_col + width)],
+        "rows": rows
+    }
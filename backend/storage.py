@@ -0,0 +1,515 @@
+"""
+Almacenamiento de archivos: disco local o Cloudflare R2 (API S3)
+server.py solo usa la interfaz Storage, que es asíncrona: el disco se lee y
+escribe con aiofiles y las llamadas de boto3 corren en un pool de hilos propio
+y acotado, así una petición lenta a R2 no bloquea el event loop.
+Para pruebas se puede apuntar S3Storage a un S3 local (MinIO, moto) con
+R2_ENDPOINT_URL.
+"""
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+import asyncio
+import functools
+import hashlib
+import mimetypes
+import os
+import shutil
+import stat
+import uuid
+
+import aiofiles
+import aiofiles.os
+from botocore.exceptions import ClientError
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+MIN_PART_SIZE = 5 * 1024 * 1024  # R2 / S3 exigen partes de al menos 5 MB (salvo la última)
+DELETE_BATCH_SIZE = 1000  # Máximo de claves por DeleteObjects
+MULTIPART_DIR = ".multipart"  # Partes de las subidas en curso (LocalStorage)
+
+class ObjectInfo(NamedTuple):
+    key: str
+    size: int
+    etag: Optional[str] = None
+    last_modified: Optional[datetime] = None  # UTC
+    content_type: Optional[str] = None
+
+class StoredObject:
+    """Archivo abierto para lectura: metadatos + bloques asíncronos"""
+
+    def __init__(self, info: ObjectInfo, chunks: AsyncIterator[bytes],
+                 content_range: Optional[str] = None):
+        self.info = info
+        self.content_range = content_range
+        self._chunks = chunks
+
+    def __aiter__(self):
+        return self._chunks
+
+    async def read(self) -> bytes:
+        return b"".join([chunk async for chunk in self._chunks])
+
+    async def aclose(self):
+        await self._chunks.aclose()
+
+class Storage(ABC):
+    """Interfaz común de almacenamiento"""
+
+    name = "storage"
+
+    @abstractmethod
+    async def head(self, key: str) -> Optional[ObjectInfo]:
+        """Metadatos del archivo, o None si no existe"""
+
+    @abstractmethod
+    async def open(self, key: str, start: Optional[int] = None, end: Optional[int] = None,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE) -> Optional[StoredObject]:
+        """Abre el archivo (o el rango [start, end] inclusivo); None si no existe"""
+
+    @abstractmethod
+    async def put_bytes(self, key: str, data: bytes, content_type: Optional[str] = None) -> None:
+        """Guarda un archivo pequeño completo"""
+
+    @abstractmethod
+    async def put_stream(self, key: str, chunks: AsyncIterator[bytes],
+                         content_type: Optional[str] = None) -> int:
+        """Guarda un archivo recibido por bloques sin cargarlo en memoria; retorna el tamaño"""
+
+    @abstractmethod
+    async def delete_many(self, keys: List[str]) -> Dict[str, str]:
+        """Elimina varias claves; retorna {clave: error} de las que fallaron"""
+
+    @abstractmethod
+    async def move(self, src_key: str, dst_key: str) -> None:
+        """Mueve un archivo a otra clave"""
+
+    # Subidas por partes (reanudables): las partes quedan guardadas hasta completar o abortar
+    @abstractmethod
+    async def create_multipart(self, key: str, content_type: Optional[str] = None) -> str:
+        """Inicia una subida por partes; retorna su id"""
+
+    @abstractmethod
+    async def put_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        """Guarda (o reemplaza) la parte part_number (desde 1); retorna su ETag"""
+
+    @abstractmethod
+    async def complete_multipart(self, key: str, upload_id: str, parts: List[Tuple[int, str]]) -> None:
+        """Une las partes [(número, etag)] en orden en el archivo final"""
+
+    @abstractmethod
+    async def abort_multipart(self, key: str, upload_id: str) -> None:
+        """Descarta las partes de una subida"""
+
+    @abstractmethod
+    async def list_page(self, start_after: Optional[str] = None, limit: int = 1000) -> List[ObjectInfo]:
+        """Hasta `limit` archivos en orden, a partir de la clave siguiente a start_after"""
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """Ruta en disco si el almacenamiento es local (para servirla con FileResponse)"""
+        return None
+
+    def presigned_url(self, key: str, expires: int, response_headers: Optional[dict] = None) -> Optional[str]:
+        """URL firmada de descarga directa, si el almacenamiento la soporta"""
+        return None
+
+    async def close(self):
+        pass
+
+async def _iter_file(path: Path, start: int, end: int, chunk_size: int):
+    async with aiofiles.open(path, 'rb') as f:
+        await f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+async def open_local_file(path: Path, key: Optional[str] = None, start: Optional[int] = None,
+                          end: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Optional[StoredObject]:
+    """Abre un archivo de disco como StoredObject (también usado para la caché local)"""
+    try:
+        stat_result = await aiofiles.os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if not stat.S_ISREG(stat_result.st_mode):
+        return None
+    size = stat_result.st_size
+    first = start or 0
+    last = size - 1 if end is None else min(end, size - 1)
+    info = ObjectInfo(
+        key=key or path.name,
+        size=size,
+        last_modified=datetime.fromtimestamp(stat_result.st_mtime, tz=timezone.utc),
+        content_type=mimetypes.guess_type(path.name)[0]
+    )
+    content_range = f"bytes {first}-{last}/{size}" if start is not None or end is not None else None
+    return StoredObject(info, _iter_file(path, first, last, chunk_size), content_range)
+
+class LocalStorage(Storage):
+    """Archivos en un directorio local (uploads/)"""
+
+    name = "local"
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._resolved_root = self.root.resolve()
+
+    def local_path(self, key: str) -> Optional[Path]:
+        path = self.root / key
+        # Evitar salir del directorio con claves como ../../etc/passwd
+        if not path.resolve().is_relative_to(self._resolved_root):
+            return None
+        return path
+
+    async def head(self, key: str) -> Optional[ObjectInfo]:
+        path = self.local_path(key)
+        if path is None:
+            return None
+        try:
+            stat_result = await aiofiles.os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if not stat.S_ISREG(stat_result.st_mode):
+            return None
+        return ObjectInfo(
+            key=key,
+            size=stat_result.st_size,
+            last_modified=datetime.fromtimestamp(stat_result.st_mtime, tz=timezone.utc),
+            content_type=mimetypes.guess_type(key)[0]
+        )
+
+    async def open(self, key: str, start: Optional[int] = None, end: Optional[int] = None,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE) -> Optional[StoredObject]:
+        path = self.local_path(key)
+        if path is None:
+            return None
+        return await open_local_file(path, key, start, end, chunk_size)
+
+    async def put_bytes(self, key: str, data: bytes, content_type: Optional[str] = None) -> None:
+        async def single():
+            yield data
+        await self.put_stream(key, single(), content_type)
+
+    async def put_stream(self, key: str, chunks: AsyncIterator[bytes],
+                         content_type: Optional[str] = None) -> int:
+        path = self.local_path(key)
+        if path is None:
+            raise ValueError(f"Clave inválida: {key}")
+        await aiofiles.os.makedirs(path.parent, exist_ok=True)
+        # Se escribe en un temporal y se publica con un rename atómico
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.part")
+        size = 0
+        try:
+            async with aiofiles.open(tmp_path, 'wb') as f:
+                async for chunk in chunks:
+                    await f.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            try:
+                await aiofiles.os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        await aiofiles.os.replace(tmp_path, path)
+        return size
+
+    async def move(self, src_key: str, dst_key: str) -> None:
+        src, dst = self.local_path(src_key), self.local_path(dst_key)
+        if src is None or dst is None:
+            raise ValueError(f"Clave inválida: {src_key} -> {dst_key}")
+        await aiofiles.os.makedirs(dst.parent, exist_ok=True)
+        await aiofiles.os.replace(src, dst)
+
+    def _parts_dir(self, upload_id: str) -> Path:
+        if not upload_id.isalnum():
+            raise ValueError(f"Id de subida inválido: {upload_id}")
+        return self.root / MULTIPART_DIR / upload_id
+
+    async def create_multipart(self, key: str, content_type: Optional[str] = None) -> str:
+        upload_id = uuid.uuid4().hex
+        await aiofiles.os.makedirs(self._parts_dir(upload_id), exist_ok=True)
+        return upload_id
+
+    async def put_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        parts_dir = self._parts_dir(upload_id)
+        if not await aiofiles.os.path.isdir(parts_dir):
+            raise FileNotFoundError(f"Subida no encontrada: {upload_id}")
+        path = parts_dir / f"{part_number:05d}"
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.part")
+        async with aiofiles.open(tmp_path, 'wb') as f:
+            await f.write(data)
+        await aiofiles.os.replace(tmp_path, path)
+        return hashlib.md5(data).hexdigest()
+
+    async def complete_multipart(self, key: str, upload_id: str, parts: List[Tuple[int, str]]) -> None:
+        parts_dir = self._parts_dir(upload_id)
+
+        async def chunks():
+            for part_number, _ in sorted(parts):
+                async with aiofiles.open(parts_dir / f"{part_number:05d}", 'rb') as f:
+                    while True:
+                        chunk = await f.read(DEFAULT_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        yield chunk
+
+        await self.put_stream(key, chunks())
+        await self.abort_multipart(key, upload_id)
+
+    async def abort_multipart(self, key: str, upload_id: str) -> None:
+        await asyncio.to_thread(shutil.rmtree, self._parts_dir(upload_id), True)
+
+    async def list_page(self, start_after: Optional[str] = None, limit: int = 1000) -> List[ObjectInfo]:
+        return await asyncio.to_thread(self._list_page, start_after, limit)
+
+    def _list_page(self, start_after: Optional[str], limit: int) -> List[ObjectInfo]:
+        # Recorrido en profundidad ordenado por componentes de la ruta, salteando
+        # los directorios que quedan antes de start_after. Se ignoran los ocultos
+        # (.cache, .previews, temporales .part)
+        after = tuple(start_after.split('/')) if start_after else ()
+        page = []
+
+        def walk(directory: Path, parts: tuple) -> bool:
+            with os.scandir(directory) as it:
+                entries = sorted((e for e in it if not e.name.startswith('.')), key=lambda e: e.name)
+            for entry in entries:
+                entry_parts = parts + (entry.name,)
+                if entry.is_dir(follow_symlinks=False):
+                    if entry_parts < after[:len(entry_parts)]:
+                        continue
+                    if walk(Path(entry.path), entry_parts):
+                        return True
+                elif entry.is_file(follow_symlinks=False):
+                    if entry_parts <= after:
+                        continue
+                    stat_result = entry.stat()
+                    page.append(ObjectInfo(
+                        key='/'.join(entry_parts),
+                        size=stat_result.st_size,
+                        last_modified=datetime.fromtimestamp(stat_result.st_mtime, tz=timezone.utc)
+                    ))
+                    if len(page) >= limit:
+                        return True
+            return False
+
+        walk(self.root, ())
+        return page
+
+    async def delete_many(self, keys: List[str]) -> Dict[str, str]:
+        errores = {}
+        for key in keys:
+            path = self.local_path(key)
+            if path is None:
+                continue
+            try:
+                await aiofiles.os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                errores[key] = str(e)
+        return errores
+
+class S3Storage(Storage):
+    """Archivos en un bucket S3 / Cloudflare R2"""
+
+    name = "r2"
+
+    def __init__(self, client, bucket: str, max_threads: int = 16, part_size: int = 8 * 1024 * 1024):
+        self.client = client
+        self.bucket = bucket
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        # Pool propio: las llamadas a R2 no compiten con el threadpool de FastAPI
+        self._executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="storage-io")
+
+    async def _call(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    @staticmethod
+    def is_missing(error: Exception) -> bool:
+        return isinstance(error, ClientError) and \
+            error.response.get('Error', {}).get('Code') in ('NoSuchKey', '404', 'NotFound')
+
+    @staticmethod
+    def _last_modified(value: Optional[datetime]) -> Optional[datetime]:
+        return value.astimezone(timezone.utc) if value else None
+
+    async def head(self, key: str) -> Optional[ObjectInfo]:
+        try:
+            head = await self._call(self.client.head_object, Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if self.is_missing(e):
+                return None
+            raise
+        return ObjectInfo(
+            key=key,
+            size=head['ContentLength'],
+            etag=head.get('ETag'),
+            last_modified=self._last_modified(head.get('LastModified')),
+            content_type=head.get('ContentType')
+        )
+
+    async def _iter_body(self, body, chunk_size: int):
+        iterator = body.iter_chunks(chunk_size)
+        try:
+            while True:
+                chunk = await self._call(next, iterator, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            body.close()
+
+    async def open(self, key: str, start: Optional[int] = None, end: Optional[int] = None,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE) -> Optional[StoredObject]:
+        kwargs = {}
+        if start is not None or end is not None:
+            kwargs['Range'] = f"bytes={start or 0}-{'' if end is None else end}"
+        try:
+            response = await self._call(self.client.get_object, Bucket=self.bucket, Key=key, **kwargs)
+        except ClientError as e:
+            if self.is_missing(e):
+                return None
+            raise
+        content_range = response.get('ContentRange')
+        # Con rango, el tamaño total viene en Content-Range: bytes 0-99/1234
+        size = int(content_range.rsplit('/', 1)[1]) if content_range else response['ContentLength']
+        info = ObjectInfo(
+            key=key,
+            size=size,
+            etag=response.get('ETag'),
+            last_modified=self._last_modified(response.get('LastModified')),
+            content_type=response.get('ContentType')
+        )
+        return StoredObject(info, self._iter_body(response['Body'], chunk_size), content_range)
+
+    async def put_bytes(self, key: str, data: bytes, content_type: Optional[str] = None) -> None:
+        kwargs = {'ContentType': content_type} if content_type else {}
+        await self._call(self.client.put_object, Bucket=self.bucket, Key=key, Body=data, **kwargs)
+
+    async def put_stream(self, key: str, chunks: AsyncIterator[bytes],
+                         content_type: Optional[str] = None) -> int:
+        """Sube por partes (multipart); los archivos de una sola parte van en un put_object"""
+        kwargs = {'ContentType': content_type} if content_type else {}
+        size = 0
+        parts = []
+        upload_id = None
+        buffer = bytearray()
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                buffer.extend(chunk)
+                while len(buffer) >= self.part_size:
+                    if upload_id is None:
+                        response = await self._call(
+                            self.client.create_multipart_upload, Bucket=self.bucket, Key=key, **kwargs
+                        )
+                        upload_id = response['UploadId']
+                    part = bytes(buffer[:self.part_size])
+                    del buffer[:self.part_size]
+                    parts.append(await self._upload_part(key, upload_id, len(parts) + 1, part))
+
+            if upload_id is None:
+                # Archivo pequeño (o vacío): una sola petición
+                await self._call(self.client.put_object, Bucket=self.bucket, Key=key, Body=bytes(buffer), **kwargs)
+                return size
+
+            if buffer:
+                parts.append(await self._upload_part(key, upload_id, len(parts) + 1, bytes(buffer)))
+            await self._call(
+                self.client.complete_multipart_upload,
+                Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts}
+            )
+            return size
+        except BaseException:
+            if upload_id is not None:
+                try:
+                    await self._call(
+                        self.client.abort_multipart_upload, Bucket=self.bucket, Key=key, UploadId=upload_id
+                    )
+                except Exception as e:
+                    print(f"⚠️ Error abortando subida multipart {key}: {e}")
+            raise
+
+    async def _upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> dict:
+        response = await self._call(
+            self.client.upload_part,
+            Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=data
+        )
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    async def move(self, src_key: str, dst_key: str) -> None:
+        # CopyObject es una copia dentro de R2 (sin pasar los bytes por el servidor), hasta 5 GB
+        await self._call(
+            self.client.copy_object,
+            Bucket=self.bucket, Key=dst_key, CopySource={'Bucket': self.bucket, 'Key': src_key}
+        )
+        await self._call(self.client.delete_object, Bucket=self.bucket, Key=src_key)
+
+    async def create_multipart(self, key: str, content_type: Optional[str] = None) -> str:
+        kwargs = {'ContentType': content_type} if content_type else {}
+        response = await self._call(self.client.create_multipart_upload, Bucket=self.bucket, Key=key, **kwargs)
+        return response['UploadId']
+
+    async def put_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        return (await self._upload_part(key, upload_id, part_number, data))['ETag']
+
+    async def complete_multipart(self, key: str, upload_id: str, parts: List[Tuple[int, str]]) -> None:
+        await self._call(
+            self.client.complete_multipart_upload,
+            Bucket=self.bucket, Key=key, UploadId=upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': n, 'ETag': etag} for n, etag in sorted(parts)]}
+        )
+
+    async def abort_multipart(self, key: str, upload_id: str) -> None:
+        try:
+            await self._call(self.client.abort_multipart_upload, Bucket=self.bucket, Key=key, UploadId=upload_id)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'NoSuchUpload':
+                raise
+
+    async def list_page(self, start_after: Optional[str] = None, limit: int = 1000) -> List[ObjectInfo]:
+        kwargs = {'StartAfter': start_after} if start_after else {}
+        response = await self._call(
+            self.client.list_objects_v2, Bucket=self.bucket, MaxKeys=limit, **kwargs
+        )
+        return [
+            ObjectInfo(
+                key=item['Key'],
+                size=item['Size'],
+                etag=item.get('ETag'),
+                last_modified=self._last_modified(item.get('LastModified'))
+            )
+            for item in response.get('Contents', [])
+        ]
+
+    async def delete_many(self, keys: List[str]) -> Dict[str, str]:
+        errores = {}
+        for i in range(0, len(keys), DELETE_BATCH_SIZE):
+            lote = keys[i:i + DELETE_BATCH_SIZE]
+            try:
+                response = await self._call(
+                    self.client.delete_objects,
+                    Bucket=self.bucket,
+                    Delete={'Objects': [{'Key': key} for key in lote], 'Quiet': True}
+                )
+            except Exception as e:
+                errores.update({key: str(e) for key in lote})
+                continue
+            for error in response.get('Errors', []):
+                errores[error['Key']] = f"{error.get('Code')}: {error.get('Message')}"
+        return errores
+
+    def presigned_url(self, key: str, expires: int, response_headers: Optional[dict] = None) -> Optional[str]:
+        # La firma es local (no hace peticiones a R2)
+        params = {'Bucket': self.bucket, 'Key': key}
+        params.update(response_headers or {})
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=expires)
+
+    async def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,112 @@
+"""
+Versiones por tabla
+Cada commit que modifica una tabla registrada aumenta su versión en la misma
+transacción (track_versions detecta los cambios del ORM, incluidas las bajas
+en cascada y los delete/update masivos). Cualquier proceso (o worker de
+uvicorn) puede comparar la versión para saber si lo que tiene en memoria, o
+lo que tiene el navegador (ETag), sigue vigente, con una lectura por clave
+primaria.
+"""
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import event, select, update
+from datetime import datetime, timezone
+from itertools import chain
+from typing import Callable, Dict, Iterable, Optional, Set
+import hashlib
+import json
+
+from models import VersionTabla
+
+PENDING_KEY = "tablas_modificadas"
+COMMITTED_KEY = "tablas_confirmadas"
+
+def bump_version(db: Session, tabla: str):
+    """Aumenta la versión de la tabla (sin commit: se confirma junto con el cambio)"""
+    result = db.execute(
+        update(VersionTabla)
+        .where(VersionTabla.tabla == tabla)
+        .values(version=VersionTabla.version + 1, actualizado=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.add(VersionTabla(tabla=tabla, version=1, actualizado=datetime.now(timezone.utc)))
+        db.flush()
+
+def get_version(db: Session, tabla: str) -> int:
+    version = db.execute(select(VersionTabla.version).where(VersionTabla.tabla == tabla)).scalar()
+    return version or 0
+
+def _versions_statement(tablas: list):
+    return select(VersionTabla.tabla, VersionTabla.version).where(VersionTabla.tabla.in_(tablas))
+
+def _versions_dict(tablas: list, rows) -> Dict[str, int]:
+    versions = dict.fromkeys(tablas, 0)
+    versions.update({tabla: version for tabla, version in rows})
+    return versions
+
+def get_versions(db: Session, tablas: Iterable[str]) -> Dict[str, int]:
+    """Versiones de varias tablas en una sola consulta (0 si la tabla aún no tiene fila)"""
+    tablas = list(tablas)
+    return _versions_dict(tablas, db.execute(_versions_statement(tablas)).all())
+
+async def get_versions_async(db: AsyncSession, tablas: Iterable[str]) -> Dict[str, int]:
+    tablas = list(tablas)
+    return _versions_dict(tablas, (await db.execute(_versions_statement(tablas))).all())
+
+def versions_etag(versions: Dict[str, int], variant: str = "") -> str:
+    """ETag débil a partir de las versiones (variant distingue ruta y parámetros)"""
+    raw = json.dumps([sorted(versions.items()), variant], separators=(",", ":"))
+    return f'W/"{hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest()}"'
+
+def track_versions(session_factory, tables: Dict[type, str],
+                   on_commit: Optional[Callable[[Session, Dict[str, int]], None]] = None):
+    """
+    Registra los eventos de sesión que aumentan la versión de las tablas
+    modificadas. tables: modelo -> nombre de la versión. on_commit(session,
+    versiones) se llama después de cada commit que cambió alguna de ellas, con
+    la versión que dejó ese commit en cada tabla.
+    """
+    names = {model.__table__.name: name for model, name in tables.items()}
+
+    def pending(session) -> Set[str]:
+        return session.info.setdefault(PENDING_KEY, set())
+
+    @event.listens_for(session_factory, "after_flush")
+    def collect_flushed(session, flush_context):
+        # En after_flush new/dirty/deleted todavía tienen lo que se acaba de escribir
+        for obj in chain(session.new, session.dirty, session.deleted):
+            name = names.get(obj.__table__.name) if hasattr(obj, "__table__") else None
+            if name and (obj not in session.dirty or session.is_modified(obj)):
+                pending(session).add(name)
+
+    @event.listens_for(session_factory, "do_orm_execute")
+    def collect_bulk(orm_execute_state):
+        # query(...).delete() / update() no pasan por el flush
+        if orm_execute_state.is_delete or orm_execute_state.is_update:
+            mapper = orm_execute_state.bind_mapper
+            name = names.get(mapper.local_table.name) if mapper is not None else None
+            if name:
+                pending(orm_execute_state.session).add(name)
+
+    @event.listens_for(session_factory, "before_commit")
+    def bump_pending(session):
+        session.flush()
+        tablas = session.info.pop(PENDING_KEY, set())
+        # Siempre en el mismo orden para no provocar deadlocks entre transacciones
+        for tabla in sorted(tablas):
+            bump_version(session, tabla)
+        if tablas:
+            # Dentro de la transacción: la versión que deja este commit
+            session.info[COMMITTED_KEY] = get_versions(session, tablas)
+
+    @event.listens_for(session_factory, "after_commit")
+    def notify_committed(session):
+        versions = session.info.pop(COMMITTED_KEY, None)
+        if versions and on_commit:
+            on_commit(session, versions)
+
+    @event.listens_for(session_factory, "after_rollback")
+    def discard_pending(session):
+        session.info.pop(PENDING_KEY, None)
+        session.info.pop(COMMITTED_KEY, None)
@@ -0,0 +1,129 @@
+"""
+Exportación de archivos en ZIP generado al vuelo
+El ZIP se escribe mientras se transmite (sin armarlo completo en memoria ni
+en disco). Los archivos se leen de R2 / disco en paralelo, con un límite de
+descargas simultáneas, y se agregan al ZIP en orden.
+"""
+from pathlib import PurePosixPath
+from typing import AsyncIterator, Callable, List, NamedTuple, Optional
+import asyncio
+import time
+import zipfile
+
+# Formatos ya comprimidos: se guardan sin volver a comprimir
+STORED_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.zip', '.rar', '.7z', '.gz',
+    '.pdf', '.xlsx', '.xlsm', '.docx', '.pptx', '.mp4', '.mov'
+}
+ZIP_COMPRESSLEVEL = 6
+FLUSH_BYTES = 256 * 1024
+MISSING_FILES_NAME = "ARCHIVOS_FALTANTES.txt"
+
+class ZipMember(NamedTuple):
+    arcname: str  # Ruta dentro del ZIP
+    filename: str  # Nombre guardado (uuid_nombre.ext)
+    key: str  # Clave de almacenamiento
+    size: Optional[int] = None
+
+class _ChunkBuffer:
+    """Destino no posicionable para ZipFile: acumula lo escrito hasta que se transmite"""
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+def unique_arcname(arcname: str, used: set) -> str:
+    """Evita nombres repetidos dentro del ZIP: foto.jpg, foto (2).jpg, ..."""
+    candidate = arcname
+    path = PurePosixPath(arcname)
+    counter = 2
+    while candidate.lower() in used:
+        candidate = str(path.with_name(f"{path.stem} ({counter}){path.suffix}"))
+        counter += 1
+    used.add(candidate.lower())
+    return candidate
+
+_END = object()
+
+async def stream_zip(
+    members: List[ZipMember],
+    open_member: Callable[[ZipMember], AsyncIterator[bytes]],
+    concurrency: int = 4,
+    prefetch_chunks: int = 4
+) -> AsyncIterator[bytes]:
+    """
+    Genera el ZIP por bloques.
+    open_member(member) retorna un iterador asíncrono con el contenido del
+    archivo. Hasta `concurrency` archivos se
+    descargan a la vez y cada uno adelanta como máximo `prefetch_chunks` bloques.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    queues = [asyncio.Queue(maxsize=prefetch_chunks) for _ in members]
+
+    async def fetch(member: ZipMember, queue: asyncio.Queue):
+        # El semáforo atiende en orden, así el archivo que se está escribiendo
+        # siempre tiene su descarga en curso
+        async with semaphore:
+            try:
+                async for chunk in open_member(member):
+                    await queue.put(chunk)
+                await queue.put(_END)
+            except Exception as e:
+                await queue.put(e)
+
+    tasks = [asyncio.create_task(fetch(m, q)) for m, q in zip(members, queues)]
+    buffer = _ChunkBuffer()
+    faltantes = []
+    try:
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED,
+                             compresslevel=ZIP_COMPRESSLEVEL) as zf:
+            for member, queue in zip(members, queues):
+                item = await queue.get()
+                if isinstance(item, Exception):
+                    print(f"⚠️ ZIP: no se pudo leer {member.filename}: {item}")
+                    faltantes.append(member.arcname)
+                    continue
+
+                info = zipfile.ZipInfo(member.arcname, date_time=time.localtime()[:6])
+                info.compress_type = zipfile.ZIP_STORED \
+                    if PurePosixPath(member.arcname).suffix.lower() in STORED_EXTENSIONS \
+                    else zipfile.ZIP_DEFLATED
+                info.file_size = member.size or 0
+                with zf.open(info, 'w', force_zip64=member.size is None) as entry:
+                    while item is not _END:
+                        if isinstance(item, Exception):
+                            # Falló a mitad de la descarga: la entrada queda incompleta
+                            print(f"⚠️ ZIP: descarga interrumpida de {member.filename}: {item}")
+                            faltantes.append(f"{member.arcname} (incompleto)")
+                            break
+                        entry.write(item)
+                        if buffer.size >= FLUSH_BYTES:
+                            yield buffer.take()
+                        item = await queue.get()
+                if buffer.size:
+                    yield buffer.take()
+
+            if faltantes:
+                zf.writestr(
+                    MISSING_FILES_NAME,
+                    "No se pudieron incluir los siguientes archivos:\n" + "\n".join(faltantes) + "\n"
+                )
+        yield buffer.take()
+    finally:
+        # Cliente desconectado: cancelar las descargas pendientes
+        for task in tasks:
+            task.cancel()
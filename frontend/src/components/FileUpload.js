@@ -2,10 +2,7 @@ import React, { useCallback, useState } from 'react';
 import { useDropzone } from 'react-dropzone';
 import { Upload, X, File } from 'lucide-react';
 import { Button } from './ui/button';
-import axios from 'axios';
-
-const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
-const API = `${BACKEND_URL}/api`;
+import { uploadFile } from '../lib/upload';
 
 const FileUpload = ({ value, onChange, accept = '*', multiple = false }) => {
   const [uploading, setUploading] = useState(false);
@@ -16,12 +13,9 @@ const FileUpload = ({ value, onChange, accept = '*', multiple = false }) => {
     try {
       const uploadedFiles = [];
       for (const file of acceptedFiles) {
-        const formData = new FormData();
-        formData.append('file', file);
-        const response = await axios.post(`${API}/upload`, formData, {
-          headers: { 'Content-Type': 'multipart/form-data' },
-        });
-        uploadedFiles.push(response.data.filename);
+        // Los archivos grandes se suben por partes y se pueden retomar
+        const uploaded = await uploadFile(file);
+        uploadedFiles.push(uploaded.filename);
       }
 
       const newFiles = multiple ? [...files, ...uploadedFiles] : uploadedFiles;
@@ -0,0 +1,82 @@
+import axios from 'axios';
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const API = `${BACKEND_URL}/api`;
+
+// A partir de este tamaño se usa la subida reanudable por partes
+const RESUMABLE_THRESHOLD = 16 * 1024 * 1024;
+const MAX_RETRIES = 5;
+
+const sessionStorageKey = (file) => `subida:${file.name}:${file.size}:${file.lastModified}`;
+
+const wait = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Sesión guardada de un intento anterior del mismo archivo (si sigue vigente)
+const resumeSession = async (file) => {
+  const id = localStorage.getItem(sessionStorageKey(file));
+  if (!id) return null;
+  try {
+    const response = await axios.get(`${API}/uploads/${id}`);
+    return response.data;
+  } catch (error) {
+    localStorage.removeItem(sessionStorageKey(file));
+    return null;
+  }
+};
+
+const putChunk = async (session, file, index) => {
+  const start = index * session.chunk_size;
+  const chunk = file.slice(start, Math.min(start + session.chunk_size, file.size));
+  for (let attempt = 0; ; attempt++) {
+    try {
+      await axios.put(`${API}/uploads/${session.upload_id}/chunks/${index}`, chunk, {
+        headers: { 'Content-Type': 'application/octet-stream' },
+      });
+      return;
+    } catch (error) {
+      // Errores de red o del servidor: reintentar con espera creciente
+      const status = error.response?.status;
+      if (attempt >= MAX_RETRIES || (status && status < 500)) throw error;
+      await wait(1000 * 2 ** attempt);
+    }
+  }
+};
+
+const uploadResumable = async (file, onProgress) => {
+  let session = await resumeSession(file);
+  if (!session) {
+    const response = await axios.post(`${API}/uploads`, {
+      filename: file.name,
+      size: file.size,
+      content_type: file.type || null,
+    });
+    session = response.data;
+    localStorage.setItem(sessionStorageKey(file), session.upload_id);
+  }
+
+  const received = new Set(session.received_chunks);
+  let done = received.size;
+  for (let index = 0; index < session.total_chunks; index++) {
+    if (received.has(index)) continue;
+    await putChunk(session, file, index);
+    done += 1;
+    if (onProgress) onProgress(done / session.total_chunks);
+  }
+
+  const response = await axios.post(`${API}/uploads/${session.upload_id}/complete`);
+  localStorage.removeItem(sessionStorageKey(file));
+  return response.data;
+};
+
+// Sube un archivo y retorna { filename, url, ... } (misma respuesta que /upload)
+export const uploadFile = async (file, { onProgress } = {}) => {
+  if (file.size >= RESUMABLE_THRESHOLD) {
+    return uploadResumable(file, onProgress);
+  }
+  const formData = new FormData();
+  formData.append('file', file);
+  const response = await axios.post(`${API}/upload`, formData, {
+    headers: { 'Content-Type': 'multipart/form-data' },
+  });
+  return response.data;
+};
@@ -3,6 +3,7 @@ import axios from 'axios';
 import { toast } from 'sonner';
 import ExcelGrid from '../components/ExcelGrid';
 import FileUpload from '../components/FileUpload';
+import { uploadFile } from '../lib/upload';
 import { useAuth } from '../context/AuthContext';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogFooter } from '../components/ui/dialog';
 import { AlertDialog, AlertDialogAction, AlertDialogCancel, AlertDialogContent, AlertDialogDescription, AlertDialogFooter, AlertDialogHeader, AlertDialogTitle } from '../components/ui/alert-dialog';
@@ -18,6 +19,25 @@ import { Edit, Trash2, CheckCircle, XCircle, Plus, X, Search, AlertTriangle, Upl
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Extensiones para las que el backend genera miniaturas (?w=), igual que image_variants.py
+const RASTER_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff'];
+
+// URL de la miniatura de 256px, o del archivo original si no es una imagen rasterizada
+const thumbnailUrl = (filename) => {
+  const url = `${API}/files/${filename}`;
+  const lower = filename.toLowerCase();
+  return RASTER_EXTENSIONS.some((ext) => lower.endsWith(ext)) ? `${url}?w=256` : url;
+};
+
+// Si la miniatura falla se muestra el original (una sola vez, para no entrar en bucle)
+const fallbackToOriginal = (filename) => (e) => {
+  const img = e.currentTarget;
+  if (!img.dataset.fallback) {
+    img.dataset.fallback = 'original';
+    img.src = `${API}/files/${filename}`;
+  }
+};
+
 // Componente para la celda de imagen con subida directa
 const ImageCell = ({ base, onViewImage, onUploadImage, canUpload }) => {
   const inputRef = useRef(null);
@@ -36,7 +56,8 @@ const ImageCell = ({ base, onViewImage, onUploadImage, canUpload }) => {
         className="inline-block"
       >
         <img 
-          src={`${API}/files/${base.imagen}`} 
+          src={thumbnailUrl(base.imagen)}
+          onError={fallbackToOriginal(base.imagen)}
           alt="Base"
           className="w-16 h-16 object-cover rounded border border-slate-200 hover:border-blue-500 transition-all cursor-pointer hover:scale-105"
         />
@@ -645,14 +666,8 @@ const Bases = () => {
   // Función para subir patrón desde la tabla
   const handleUploadPatronFromTable = async (baseId, file) => {
     try {
-      const formDataUpload = new FormData();
-      formDataUpload.append('file', file);
-      
-      const uploadResponse = await axios.post(`${API}/upload`, formDataUpload, {
-        headers: { 'Content-Type': 'multipart/form-data' }
-      });
-      
-      const filename = uploadResponse.data.filename;
+      // Los patrones pueden ser grandes: se suben por partes y se pueden retomar
+      const { filename } = await uploadFile(file);
       
       await axios.put(`${API}/bases/${baseId}`, { patron: filename });
       
@@ -1909,7 +1924,8 @@ const Bases = () => {
                 {formData.imagen && (
                   <div className="mt-2">
                     <img 
-                      src={`${API}/files/${formData.imagen}`} 
+                      src={thumbnailUrl(formData.imagen)}
+                      onError={fallbackToOriginal(formData.imagen)}
                       alt="Preview"
                       className="w-32 h-32 object-cover rounded border border-slate-200"
                     />
@@ -0,0 +1,92 @@
+"""
+Entorno de pruebas: el backend corre sobre SQLite en un directorio temporal
+Los motores sync y async apuntan al mismo archivo, así los endpoints de
+lectura (aiosqlite) ven lo que escriben los de escritura. Las variables de
+entorno se fijan antes de importar el backend porque se leen al importar.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+TMP_DIR = Path(tempfile.mkdtemp(prefix="backend-tests-"))
+os.environ.setdefault("PG_PORT", "3306")
+os.environ.setdefault("UPLOAD_DIR", str(TMP_DIR / "uploads"))
+os.environ.setdefault("HISTORIAL_ARCHIVE_DIR", str(TMP_DIR / "historial_archivo"))
+os.environ.setdefault("GC_INTERVAL", "0")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from sqlalchemy import create_engine  # noqa: E402
+
+import database  # noqa: E402
+
+DB_PATH = TMP_DIR / "test.db"
+engine = create_engine(f"sqlite:///{DB_PATH}", connect_args={"check_same_thread": False})
+database.engine = engine
+database.SessionLocal.configure(bind=engine)
+
+import models  # noqa: E402
+import server  # noqa: E402
+
+def _get_db():
+    db = database.SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+server.app.dependency_overrides[database.get_db] = _get_db
+
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine
+    import aiosqlite  # noqa: F401
+except ImportError:
+    async_engine = None
+else:
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{DB_PATH}")
+    database.AsyncSessionLocal.configure(bind=async_engine)
+
+    async def _get_async_db():
+        async with database.AsyncSessionLocal() as db:
+            yield db
+
+    server.app.dependency_overrides[database.get_async_db] = _get_async_db
+
+@pytest.fixture
+def db():
+    """Sesión sobre un esquema recién creado"""
+    database.Base.metadata.drop_all(engine)
+    database.Base.metadata.create_all(engine)
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@pytest.fixture
+def admin(db):
+    """Usuario super_admin con el que se autentican las peticiones"""
+    usuario = models.Usuario(username="admin", email="admin@example.com", password_hash="x",
+                             nombre="Admin", rol=models.RolEnum.super_admin)
+    db.add(usuario)
+    db.commit()
+    db.refresh(usuario)
+    db.expunge(usuario)
+    server.app.dependency_overrides[server.get_current_user] = lambda: usuario
+    server.app.dependency_overrides[server.require_admin] = lambda: usuario
+    yield usuario
+    server.app.dependency_overrides.pop(server.get_current_user, None)
+    server.app.dependency_overrides.pop(server.require_admin, None)
+
+@pytest.fixture
+def client(admin):
+    """Cliente sin eventos de arranque: los hilos de fondo no se inician"""
+    from fastapi.testclient import TestClient
+    return TestClient(server.app)
+
+@pytest.fixture
+def needs_async():
+    if async_engine is None:
+        pytest.skip("aiosqlite no está instalado")
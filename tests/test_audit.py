@@ -0,0 +1,20 @@
+from decimal import Decimal
+
+from models import HistorialMovimiento, Tela
+
+def ultimo_movimiento(db):
+    return db.query(HistorialMovimiento).order_by(HistorialMovimiento.id_movimiento.desc()).first()
+
+def test_numeric_inputs_are_rounded_like_the_database(client, db):
+    response = client.post("/api/telas", json={"nombre_tela": "Jersey", "precio": "12.345", "gramaje": 180.5})
+    assert response.status_code == 200, response.text
+    tela = response.json()
+    assert Decimal(str(tela["precio"])) == Decimal("12.35")
+    assert ultimo_movimiento(db).datos_nuevos["precio"] == 12.35
+
+    response = client.put(f"/api/telas/{tela['id_tela']}", json={"precio": "7.004"})
+    assert response.status_code == 200, response.text
+    assert Decimal(str(response.json()["precio"])) == Decimal("7.00")
+    movimiento = ultimo_movimiento(db)
+    assert movimiento.datos_nuevos["precio"] == 7.0
+    assert db.get(Tela, tela["id_tela"]).precio == Decimal("7.00")
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import audit
+from audit import audit_create, audit_delete, audit_update, field_delta, needs_checkpoint, reconstruir_registro
+from models import HistorialMovimiento
+
+TABLA = "telas"
+ID = 1
+
+@pytest.fixture(autouse=True)
+def checkpoint_every(monkeypatch):
+    # Un punto de control cada 3 movimientos para cruzar varios en pocas ediciones
+    monkeypatch.setattr(audit, "CHECKPOINT_EVERY", 3)
+    return 3
+
+def crear(db, estado):
+    return audit_create(db, None, TABLA, dict(estado), ID, "Creó tela").id_movimiento
+
+def editar(db, anterior, nuevo):
+    return audit_update(db, None, TABLA, dict(anterior), dict(nuevo), ID, "Editó tela").id_movimiento
+
+def eliminar(db, estado):
+    return audit_delete(db, None, TABLA, dict(estado), ID, "Eliminó tela").id_movimiento
+
+def historia(db, ediciones: int) -> list:
+    """Crea el registro y lo edita; [(id_movimiento, estado después del movimiento)]"""
+    estado = {"id_tela": ID, "nombre_tela": "Jersey", "precio": 10.0, "proveedor": "A"}
+    pasos = [(crear(db, estado), dict(estado))]
+    for i in range(1, ediciones + 1):
+        nuevo = dict(estado, precio=10.0 + i, proveedor="A" if i % 2 else "B")
+        pasos.append((editar(db, estado, nuevo), dict(nuevo)))
+        estado = nuevo
+    return pasos
+
+def completos(db) -> list:
+    return [completo for (completo,) in db.query(HistorialMovimiento.datos_completos)
+            .filter(HistorialMovimiento.id_registro == ID)
+            .order_by(HistorialMovimiento.id_movimiento)]
+
+def test_field_delta_keeps_only_changed_columns():
+    antes, despues = field_delta({"a": 1, "b": 2, "c": None}, {"a": 1, "b": 3, "c": None, "d": 4})
+
+    assert antes == {"b": 2, "d": None}
+    assert despues == {"b": 3, "d": 4}
+
+def test_field_delta_without_changes_is_empty():
+    assert field_delta({"a": 1}, {"a": 1}) == ({}, {})
+
+def test_checkpoint_every_n_state_movements(db, checkpoint_every):
+    historia(db, 7)
+
+    assert completos(db) == [True, False, False, True, False, False, True, False]
+    assert not needs_checkpoint(db, TABLA, ID)
+    editar(db, {"precio": 17.0}, {"precio": 18.0})
+    assert needs_checkpoint(db, TABLA, ID)
+
+def test_delta_rows_store_only_the_changed_columns(db):
+    historia(db, 1)
+
+    movimiento = db.query(HistorialMovimiento).order_by(HistorialMovimiento.id_movimiento.desc()).first()
+    assert movimiento.datos_completos is False
+    assert movimiento.datos_anteriores == {"precio": 10.0}
+    assert movimiento.datos_nuevos == {"precio": 11.0}
+
+def test_rebuild_at_every_movement_across_checkpoints(db, checkpoint_every):
+    pasos = historia(db, 8)
+
+    for id_movimiento, esperado in pasos:
+        registro = reconstruir_registro(db, TABLA, ID, hasta_id=id_movimiento)
+        assert registro["datos"] == esperado
+        assert registro["existe"] is True
+        assert registro["id_movimiento"] == id_movimiento
+        # Nunca lee más de un punto de control más las ediciones que le siguen
+        assert registro["movimientos_aplicados"] <= checkpoint_every
+
+def test_rebuild_latest_without_bounds(db):
+    pasos = historia(db, 5)
+
+    assert reconstruir_registro(db, TABLA, ID)["datos"] == pasos[-1][1]
+
+def test_rebuild_at_date(db):
+    pasos = historia(db, 6)
+    inicio = datetime(2026, 1, 1)
+    for dia, (id_movimiento, _) in enumerate(pasos):
+        db.query(HistorialMovimiento).filter(HistorialMovimiento.id_movimiento == id_movimiento)\
+            .update({"fecha_hora": inicio + timedelta(days=dia)})
+    db.commit()
+
+    for dia, (_, esperado) in enumerate(pasos):
+        registro = reconstruir_registro(db, TABLA, ID, hasta_fecha=inicio + timedelta(days=dia, hours=12))
+        assert registro["datos"] == esperado
+    assert reconstruir_registro(db, TABLA, ID, hasta_fecha=inicio - timedelta(days=1)) is None
+
+def test_rebuild_after_delete_and_recreate(db):
+    pasos = historia(db, 4)
+    ultimo = pasos[-1][1]
+    id_eliminado = eliminar(db, ultimo)
+    recreado = {"id_tela": ID, "nombre_tela": "Piqué", "precio": 99.0, "proveedor": "C"}
+    id_recreado = crear(db, recreado)
+    editado = dict(recreado, proveedor="D")
+    id_editado = editar(db, recreado, editado)
+
+    eliminado = reconstruir_registro(db, TABLA, ID, hasta_id=id_eliminado)
+    assert eliminado["existe"] is False
+    assert eliminado["datos"] is None
+    assert reconstruir_registro(db, TABLA, ID, hasta_id=id_eliminado - 1)["datos"] == ultimo
+    assert reconstruir_registro(db, TABLA, ID, hasta_id=id_recreado)["datos"] == recreado
+    # Las ediciones posteriores se aplican sobre el registro nuevo, no sobre el eliminado
+    assert reconstruir_registro(db, TABLA, ID, hasta_id=id_editado)["datos"] == editado
+
+def test_rebuild_without_history_is_none(db):
+    assert reconstruir_registro(db, TABLA, ID) is None
@@ -0,0 +1,55 @@
+from datetime import datetime, timezone
+
+from sqlalchemy.exc import OperationalError
+
+from audit import AuditWriter
+from database import SessionLocal
+from models import AccionEnum, HistorialMovimiento
+
+def fila(username="admin", id_registro=1) -> dict:
+    return dict(id_usuario=None, username=username, fecha_hora=datetime.now(timezone.utc), tabla="telas",
+                accion=AccionEnum.crear, id_registro=id_registro, descripcion=None, datos_anteriores=None,
+                datos_nuevos=None, ip_address=None, user_agent=None, datos_completos=True)
+
+def failing_sessions(fallas: int):
+    """Fábrica de sesiones cuyos primeros `fallas` INSERT fallan como si se cayera la conexión"""
+    restantes = [fallas]
+
+    def factory():
+        db = SessionLocal()
+        if restantes[0] > 0:
+            restantes[0] -= 1
+
+            def execute(*args, **kwargs):
+                raise OperationalError("INSERT", {}, Exception("Lost connection to MySQL server"))
+            db.execute = execute
+        return db
+    return factory
+
+def test_failed_batch_is_retried(db):
+    writer = AuditWriter(failing_sessions(1), retry_backoff=0)
+
+    writer._write([fila(id_registro=i) for i in range(5)])
+
+    assert db.query(HistorialMovimiento).count() == 5
+    assert (writer.escritos, writer.fallidos, writer.lotes) == (5, 0, 1)
+
+def test_batch_falls_back_to_rows_and_drops_only_the_bad_one(db, capsys):
+    writer = AuditWriter(SessionLocal, retries=1, retry_backoff=0)
+    batch = [fila(id_registro=1), fila(username=None, id_registro=2), fila(id_registro=3)]
+
+    writer._write(batch)
+
+    assert sorted(m.id_registro for m in db.query(HistorialMovimiento)) == [1, 3]
+    assert (writer.escritos, writer.fallidos) == (2, 1)
+    assert "descartado: telas crear id_registro=2" in capsys.readouterr().out
+
+def test_rows_are_dropped_only_after_retries_and_row_fallback(db):
+    # La base no responde en los 2 intentos del lote ni en las 3 filas
+    writer = AuditWriter(failing_sessions(5), retries=1, retry_backoff=0)
+
+    writer._write([fila(id_registro=i) for i in range(3)])
+
+    assert db.query(HistorialMovimiento).count() == 0
+    assert (writer.escritos, writer.fallidos) == (0, 3)
+    assert "Lost connection" in writer.ultimo_error
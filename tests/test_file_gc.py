@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta, timezone
+import hashlib
+
+import server
+from delete_queue import process_batch
+from file_dedup import content_key
+from file_gc import TIPO_OBJETO, purge_quarantine
+from models import ArchivoContenido, CuarentenaArchivo, EliminacionPendiente
+
+CONTENIDO = b"contenido huerfano"
+SHA = hashlib.sha256(CONTENIDO).hexdigest()
+
+def orphan_in_expired_quarantine(db):
+    """objects/<sha> sin registro de contenido y con la cuarentena vencida"""
+    path = server.UPLOAD_DIR / content_key(SHA)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(CONTENIDO)
+    vencido = datetime.now(timezone.utc) - timedelta(minutes=1)
+    db.add(CuarentenaArchivo(tipo=TIPO_OBJETO, clave=content_key(SHA), detectado=vencido, eliminar_despues=vencido))
+    db.commit()
+    return path
+
+def delete_local(borradas: list):
+    def delete_keys(keys):
+        borradas.extend(keys)
+        for key in keys:
+            (server.UPLOAD_DIR / key).unlink(missing_ok=True)
+        return {}
+    return delete_keys
+
+def test_purged_content_objects_are_queued_with_their_sha(db):
+    orphan_in_expired_quarantine(db)
+
+    assert purge_quarantine(db)["encolados"] == 1
+
+    pendiente = db.query(EliminacionPendiente).one()
+    assert (pendiente.storage_key, pendiente.sha256) == (content_key(SHA), SHA)
+
+def test_orphan_content_is_deleted(db):
+    path = orphan_in_expired_quarantine(db)
+    purge_quarantine(db)
+    borradas = []
+
+    result = process_batch(db, delete_local(borradas))
+
+    assert result["eliminados"] == 1
+    assert borradas == [content_key(SHA)]
+    assert not path.exists()
+
+def test_reupload_during_purge_keeps_the_object(client, db):
+    path = orphan_in_expired_quarantine(db)
+    purge_quarantine(db)
+    # Entre la cuarentena y el worker alguien sube los mismos bytes
+    response = client.post("/api/upload", files={"file": ("otra.txt", CONTENIDO, "text/plain")})
+    assert response.status_code == 200, response.text
+    borradas = []
+
+    result = process_batch(db, delete_local(borradas))
+
+    assert borradas == []
+    assert result["eliminados"] == 0
+    assert db.query(EliminacionPendiente).count() == 0
+    assert db.query(ArchivoContenido).one().ref_count == 1
+    assert path.read_bytes() == CONTENIDO
+    assert client.get(f"/api/files/{response.json()['filename']}").content == CONTENIDO
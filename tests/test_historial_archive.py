@@ -0,0 +1,189 @@
+from datetime import datetime
+from typing import Optional
+import shutil
+import time
+
+import pytest
+
+import server
+import historial_archive
+from audit import audit_create, audit_update
+from database import SessionLocal
+from historial_archive import (
+    ArchiveFilter, HistorialArchiver, add_months, archive_month, archived_months, month_key, search_archive
+)
+from models import AccionEnum, HistorialArchivo, HistorialMovimiento
+
+@pytest.fixture
+def archive_dir():
+    directory = server.HISTORIAL_ARCHIVE_DIR
+    shutil.rmtree(directory, ignore_errors=True)
+    directory.mkdir(parents=True)
+    return directory
+
+def movimiento(db, fecha: datetime, tabla: str = "telas", username: str = "admin",
+               id_movimiento: Optional[int] = None) -> int:
+    m = HistorialMovimiento(id_movimiento=id_movimiento, username=username, fecha_hora=fecha, tabla=tabla,
+                            accion=AccionEnum.crear, id_registro=1, datos_nuevos={"fecha": fecha.isoformat()})
+    db.add(m)
+    db.commit()
+    return m.id_movimiento
+
+def historial(client, **params) -> list:
+    response = client.get("/api/historial", params=params)
+    assert response.status_code == 200, response.text
+    return [m["id_movimiento"] for m in response.json()]
+
+@pytest.fixture
+def meses(db, archive_dir):
+    """Tres movimientos por mes de enero a abril de 2025; enero y febrero archivados"""
+    ids = {}
+    for mes in (1, 2, 3, 4):
+        ids[mes] = [movimiento(db, datetime(2025, mes, dia, 12)) for dia in (5, 15, 25)]
+    for mes in ("2025-01", "2025-02"):
+        assert archive_month(db, archive_dir, mes)["filas"] == 3
+    return ids
+
+def test_only_fecha_hasta_reaches_archived_months(client, meses):
+    ids = historial(client, fecha_hasta="2025-02-20T00:00:00")
+
+    assert ids == [meses[2][1], meses[2][0], *reversed(meses[1])]
+
+def test_only_fecha_desde_reaches_archived_months(client, meses):
+    ids = historial(client, fecha_desde="2025-02-10T00:00:00")
+
+    assert ids == [*reversed(meses[4]), *reversed(meses[3]), meses[2][2], meses[2][1]]
+
+def test_table_rows_outside_the_archive_are_listed_once(client, db, archive_dir):
+    # Un movimiento de marzo con id menor que los de febrero (escrito antes que ellos)
+    marzo = movimiento(db, datetime(2025, 3, 10))
+    febrero = [movimiento(db, datetime(2025, 2, dia)) for dia in (5, 15)]
+    archive_month(db, archive_dir, "2025-02")
+    # Escrito en febrero después de archivarlo: sigue en la tabla (id explícito porque
+    # SQLite reutiliza los ids borrados y MariaDB no)
+    tardio = movimiento(db, datetime(2025, 2, 20), id_movimiento=10)
+
+    ids = historial(client, fecha_desde="2025-02-01T00:00:00")
+
+    assert sorted(ids) == sorted([marzo, tardio, *febrero])
+    assert len(ids) == len(set(ids))
+
+def test_half_deleted_month_is_read_only_from_the_archive(client, db, archive_dir):
+    febrero = [movimiento(db, datetime(2025, 2, dia)) for dia in (5, 15, 25)]
+    archive_month(db, archive_dir, "2025-02")
+    # Como si el borrado se hubiera cortado: las filas vuelven a estar en la tabla
+    db.add_all([HistorialMovimiento(id_movimiento=id_movimiento, username="admin", fecha_hora=datetime(2025, 2, 1),
+                                    tabla="telas", accion=AccionEnum.crear)
+                for id_movimiento in febrero])
+    db.commit()
+
+    ids = historial(client, fecha_hasta="2025-02-28T00:00:00")
+
+    assert ids == list(reversed(febrero))
+
+def test_pages_through_table_and_archive_without_gaps(client, meses):
+    completo = historial(client, fecha_desde="2025-01-01T00:00:00", page_size=200)
+    paginas = []
+    for page in range(1, 7):
+        paginas += historial(client, fecha_desde="2025-01-01T00:00:00", page=page, page_size=2)
+
+    assert len(completo) == 12
+    assert paginas == completo
+
+def test_search_archive_filters_and_pages_by_date_descending(db, archive_dir):
+    for dia in range(1, 11):
+        movimiento(db, datetime(2025, 1, dia), tabla="telas" if dia % 2 else "bases")
+        movimiento(db, datetime(2025, 2, dia), tabla="telas" if dia % 2 else "bases")
+    archive_month(db, archive_dir, "2025-01")
+    archive_month(db, archive_dir, "2025-02")
+    meses = archived_months(db)
+    filtro = ArchiveFilter(tabla="telas")
+
+    todos = search_archive(archive_dir, meses, filtro, 0, 100)
+    paginas = [m for skip in range(0, 10, 3) for m in search_archive(archive_dir, meses, filtro, skip, 3)]
+
+    assert [m["tabla"] for m in todos] == ["telas"] * 10
+    assert [m["fecha_hora"] for m in todos] == sorted((m["fecha_hora"] for m in todos), reverse=True)
+    assert paginas == todos
+
+def test_skipped_months_are_counted_once(db, archive_dir):
+    for mes in (1, 2, 3):
+        for dia in (5, 15):
+            movimiento(db, datetime(2025, mes, dia))
+        archive_month(db, archive_dir, f"2025-0{mes}")
+    meses = archived_months(db)
+    historial_archive._count_file.cache_clear()
+
+    search_archive(archive_dir, meses, ArchiveFilter(), 4, 2)
+    leidos = historial_archive._count_file.cache_info().misses
+    pagina = search_archive(archive_dir, meses, ArchiveFilter(), 4, 2)
+
+    assert leidos == 3
+    assert historial_archive._count_file.cache_info().misses == leidos
+    assert [m["fecha_hora"][:7] for m in pagina] == ["2025-01", "2025-01"]
+
+def archivados(db) -> dict:
+    """{mes: filas} de los meses ya archivados y borrados de la tabla"""
+    db.expire_all()
+    return {m.mes: m.filas for m in db.query(HistorialArchivo).filter(HistorialArchivo.completado.isnot(None))}
+
+@pytest.fixture
+def mes_viejo(db) -> str:
+    """Un movimiento de hace 8 meses, fuera de la ventana caliente de 6"""
+    fecha = add_months(datetime.now(), -8).replace(day=10)
+    movimiento(db, fecha)
+    return month_key(fecha)
+
+def test_archivar_returns_before_archiving(client, db, archive_dir, mes_viejo):
+    response = client.post("/api/historial/archivar")
+
+    assert response.status_code == 202
+    assert response.json()["iniciado"] is True
+    server.historial_archiver._manual.join(10)
+    assert archivados(db)[mes_viejo] == 1
+    assert db.query(HistorialMovimiento).count() == 0
+
+def test_trigger_wakes_the_periodic_thread(db, archive_dir, mes_viejo):
+    archiver = HistorialArchiver(SessionLocal, archive_dir, hot_months=6, interval=3600)
+    archiver.start()
+    try:
+        assert archiver.trigger() is True
+        limite = time.monotonic() + 10
+        while mes_viejo not in archivados(db) and time.monotonic() < limite:
+            time.sleep(0.05)
+        assert archivados(db)[mes_viejo] == 1
+        # Lo hizo el hilo periódico, no una pasada manual
+        assert archiver._manual is None
+    finally:
+        archiver.stop()
+    assert not archiver._thread.is_alive()
+
+def test_rebuild_inside_archived_months(client, db, archive_dir):
+    # Creado en enero y editado (solo cambios) en enero, febrero y marzo; se archivan enero y febrero
+    estados = [{"id_tela": 1, "nombre_tela": "Jersey", "precio": 10.0}]
+    pasos = [audit_create(db, None, "telas", dict(estados[0]), 1, "Creó tela").id_movimiento]
+    for precio in (11.0, 12.0, 13.0):
+        estados.append(dict(estados[-1], precio=precio))
+        pasos.append(audit_update(db, None, "telas", dict(estados[-2]), dict(estados[-1]), 1, "Editó tela").id_movimiento)
+    fechas = [datetime(2025, 1, 5), datetime(2025, 1, 20), datetime(2025, 2, 10), datetime(2025, 3, 10)]
+    for id_movimiento, fecha in zip(pasos, fechas):
+        db.query(HistorialMovimiento).filter(HistorialMovimiento.id_movimiento == id_movimiento)\
+            .update({"fecha_hora": fecha})
+    db.commit()
+    archive_month(db, archive_dir, "2025-01")
+    archive_month(db, archive_dir, "2025-02")
+    assert db.query(HistorialMovimiento).count() == 1
+
+    def estado(**params) -> dict:
+        response = client.get("/api/historial/registro/telas/1", params=params)
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    for id_movimiento, esperado in zip(pasos, estados):
+        registro = estado(id_movimiento=id_movimiento)
+        assert registro["datos"] == esperado
+        assert registro["id_movimiento"] == id_movimiento
+    assert estado(fecha="2025-01-25T00:00:00")["datos"] == estados[1]
+    assert estado(fecha="2025-02-28T00:00:00")["datos"] == estados[2]
+    assert estado()["datos"] == estados[3]
+    assert client.get("/api/historial/registro/telas/1", params={"fecha": "2024-12-31T00:00:00"}).status_code == 404
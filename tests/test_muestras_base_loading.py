@@ -0,0 +1,87 @@
+"""
+La carga de muestras base hace siempre el mismo número de SELECT, sin importar
+cuántas muestras, bases, tizados y fichas haya, y ningún SELECT devuelve más
+filas que entidades de su tabla (sin multiplicar muestras x bases x tizados)
+"""
+import re
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from models import BaseModel, Entalle, Ficha, Marca, MuestraBase, Tela, TipoProducto, Tizado
+from tests.conftest import async_engine, engine
+
+# Muestras → bases; tizados y fichas por base
+BASES_POR_MUESTRA = 3
+HIJOS_POR_BASE = 2
+
+def seed(db, muestras: int) -> dict:
+    """Crea el árbol y retorna {tabla: filas}"""
+    tipo = TipoProducto(nombre_tipo="Polo")
+    entalle = Entalle(nombre_entalle="Slim")
+    tela = Tela(nombre_tela="Jersey")
+    marca = Marca(nombre_marca="Marca")
+    for i in range(muestras):
+        muestra = MuestraBase(tipo_producto=tipo, entalle=entalle, tela=tela, marca=marca if i % 2 else None)
+        for j in range(BASES_POR_MUESTRA):
+            base = BaseModel(muestra_base=muestra, modelo=f"modelo {i}-{j}")
+            base.tizados = [Tizado(ancho=1.5, curva=f"curva {k}") for k in range(HIJOS_POR_BASE)]
+            base.fichas = [Ficha(nombre_ficha=f"ficha {k}") for k in range(HIJOS_POR_BASE)]
+        db.add(muestra)
+    db.commit()
+    tablas = (MuestraBase, BaseModel, Tizado, Ficha)
+    return {modelo.__tablename__: db.query(modelo).count() for modelo in tablas}
+
+@contextmanager
+def capture_selects():
+    """SELECT (sentencia, parámetros) ejecutados en el motor async, sin la consulta de versiones"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and "x_version_tabla" not in statement:
+            statements.append((statement, parameters))
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+def rows_per_select(statements) -> list:
+    """(tabla del FROM, filas) de cada SELECT, ejecutándolo de nuevo en el motor sync"""
+    result = []
+    with engine.connect() as conn:
+        for statement, parameters in statements:
+            tabla = re.search(r"\bFROM\s+(\w+)", statement).group(1)
+            result.append((tabla, len(conn.exec_driver_sql(statement, parameters).all())))
+    return result
+
+@pytest.mark.parametrize("muestras", [1, 4])
+def test_list_runs_fixed_number_of_selects(client, db, needs_async, muestras):
+    entidades = seed(db, muestras)
+
+    with capture_selects() as statements:
+        response = client.get("/api/muestras-base")
+
+    assert response.status_code == 200, response.text
+    assert len(response.json()) == muestras
+    assert len(statements) == 4
+    for tabla, filas in rows_per_select(statements):
+        assert filas <= entidades[tabla], tabla
+
+@pytest.mark.parametrize("muestras", [1, 4])
+def test_detail_runs_fixed_number_of_selects(client, db, needs_async, muestras):
+    entidades = seed(db, muestras)
+    id_muestra_base = db.query(MuestraBase.id_muestra_base).order_by(MuestraBase.id_muestra_base.desc()).limit(1).scalar()
+
+    with capture_selects() as statements:
+        response = client.get(f"/api/muestras-base/{id_muestra_base}")
+
+    assert response.status_code == 200, response.text
+    muestra = response.json()
+    assert len(muestra["bases"]) == BASES_POR_MUESTRA
+    assert all(len(base["tizados"]) == HIJOS_POR_BASE for base in muestra["bases"])
+    assert len(statements) == 4
+    for tabla, filas in rows_per_select(statements):
+        assert filas <= entidades[tabla], tabla
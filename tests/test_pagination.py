@@ -0,0 +1,67 @@
+import pytest
+from fastapi import HTTPException, Response
+
+from models import BaseModel
+from pagination import ListParams, apply_list_params
+from server import BASE_LIST
+
+# NULL y valores repetidos en la columna de orden
+MODELOS = [None, "b", "a", None, "b", "a", "c", None, "b", "a", None]
+
+@pytest.fixture
+def bases(db):
+    db.add_all([BaseModel(id_muestra_base=1, modelo=modelo) for modelo in MODELOS])
+    db.commit()
+    return [b.id_base for b in db.query(BaseModel)]
+
+def paginate(db, sort, limit):
+    """Recorre todas las páginas siguiendo X-Next-Cursor; (ids en orden, páginas)"""
+    ids, cursor, pages = [], None, 0
+    while True:
+        response = Response()
+        rows = apply_list_params(db.query(BaseModel), BASE_LIST, ListParams(limit, cursor, sort), response)
+        ids.extend(row.id_base for row in rows)
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return ids, pages
+
+@pytest.mark.parametrize("sort", ["modelo", "-modelo", "id_base", "-id_base"])
+@pytest.mark.parametrize("limit", [1, 2, 3, 4])
+def test_pages_cover_every_row_once_in_order(db, bases, sort, limit):
+    completo = [row.id_base for row in apply_list_params(db.query(BaseModel), BASE_LIST, ListParams(sort=sort), Response())]
+
+    ids, pages = paginate(db, sort, limit)
+
+    assert ids == completo
+    assert sorted(ids) == sorted(bases)
+    assert pages == -(-len(bases) // limit)
+
+def test_nulls_go_first_ascending_and_last_descending(db, bases):
+    ascendente, _ = paginate(db, "modelo", 2)
+    descendente, _ = paginate(db, "-modelo", 2)
+    modelos = {b.id_base: b.modelo for b in db.query(BaseModel)}
+
+    assert [modelos[i] for i in ascendente] == [None] * 4 + ["a"] * 3 + ["b"] * 3 + ["c"]
+    assert [modelos[i] for i in descendente] == ["c"] + ["b"] * 3 + ["a"] * 3 + [None] * 4
+    # Los empates se desempatan por id en el mismo sentido del orden
+    assert ascendente[:4] == sorted(ascendente[:4])
+    assert descendente[-4:] == sorted(descendente[-4:], reverse=True)
+
+def test_cursor_from_another_sort_is_rejected(db, bases):
+    response = Response()
+    apply_list_params(db.query(BaseModel), BASE_LIST, ListParams(limit=2, sort="modelo"), response)
+    cursor = response.headers["X-Next-Cursor"]
+
+    with pytest.raises(HTTPException) as error:
+        apply_list_params(db.query(BaseModel), BASE_LIST, ListParams(limit=2, cursor=cursor, sort="-modelo"), Response())
+    assert error.value.status_code == 400
+
+def test_cursor_from_another_sort_returns_400(client, bases, needs_async):
+    response = client.get("/api/bases", params={"sort": "modelo", "limit": 2})
+    assert response.status_code == 200, response.text
+
+    response = client.get("/api/bases", params={"sort": "-modelo", "limit": 2,
+                                                 "cursor": response.headers["X-Next-Cursor"]})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "El cursor corresponde a otro orden"
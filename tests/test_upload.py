@@ -0,0 +1,50 @@
+import server
+from models import ArchivoAlias, ArchivoContenido, SubidaSesion
+
+def upload(client, nombre, contenido):
+    response = client.post("/api/upload", files={"file": (nombre, contenido, "text/plain")})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def test_upload_same_content_twice_stores_it_once(client, db):
+    primero = upload(client, "a.txt", b"contenido")
+    segundo = upload(client, "b.txt", b"contenido")
+
+    assert primero["duplicado"] is False
+    assert segundo["duplicado"] is True
+    assert primero["sha256"] == segundo["sha256"]
+    contenido = db.query(ArchivoContenido).one()
+    assert contenido.ref_count == 2
+    assert {a.nombre for a in db.query(ArchivoAlias)} == {primero["filename"], segundo["filename"]}
+
+def test_upload_new_content_is_written_before_it_is_referenced(client, db):
+    respuesta = upload(client, "a.txt", b"otro contenido")
+
+    assert (server.UPLOAD_DIR / "objects" / respuesta["sha256"]).read_bytes() == b"otro contenido"
+    assert db.query(ArchivoContenido).one().ref_count == 1
+
+def test_get_file_serves_aliases_only(client, db):
+    respuesta = upload(client, "a.txt", b"privado")
+
+    assert client.get(f"/api/files/{respuesta['filename']}").content == b"privado"
+    for nombre in (f"objects/{respuesta['sha256']}", f"objects%2F{respuesta['sha256']}",
+                   "staging/x", "variants/256/x.webp", ".cache", "..%2Fserver.py"):
+        assert client.get(f"/api/files/{nombre}").status_code == 404, nombre
+
+def resumable_upload(client, nombre, contenido):
+    sesion = client.post("/api/uploads", json={"filename": nombre, "size": len(contenido)}).json()
+    response = client.put(f"/api/uploads/{sesion['upload_id']}/chunks/0", content=contenido)
+    assert response.status_code == 200, response.text
+    response = client.post(f"/api/uploads/{sesion['upload_id']}/complete")
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def test_resumable_upload_reuses_stored_content(client, db):
+    primero = resumable_upload(client, "a.txt", b"por partes")
+    segundo = resumable_upload(client, "b.txt", b"por partes")
+
+    assert (primero["duplicado"], segundo["duplicado"]) == (False, True)
+    assert db.query(ArchivoContenido).one().ref_count == 2
+    assert db.query(SubidaSesion).count() == 0
+    assert not list((server.UPLOAD_DIR / "staging").glob("*"))
+    assert client.get(f"/api/files/{segundo['filename']}").content == b"por partes"